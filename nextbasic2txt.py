@@ -20,15 +20,15 @@
 
 import sys
 import os
-import argparse
 import logging
-import gettext
 
 if sys.version_info > (3, 5):
     from pathlib import Path
 else:
     from pathlib2 import Path
 
+import zxn_codec  # Registers the zxnext codec
+
 __MY_NAME__ = 'nextbasic2txt.py'
 __MY_VERSION__ = '1.1.2'
 
@@ -38,18 +38,30 @@ LOG_FORMAT = logging.Formatter(
     '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
 LOG_STREAM = logging.StreamHandler(sys.stdout)
 LOG_STREAM.setFormatter(LOG_FORMAT)
-LOGGER.addHandler(LOG_STREAM)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
 
 path_locale = os.path.dirname(__file__)
 path_locale = os.path.join(path_locale, 'locale')
-gettext.bindtextdomain(__MY_NAME__, localedir=path_locale)
-gettext.textdomain(__MY_NAME__)
-_ = gettext.gettext
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
 
 
 def main():
     """Main Routine"""
 
+    LOGGER.addHandler(LOG_STREAM)
+
     # Check Python version
     arr_v = sys.version_info
     if arr_v[0] < 3 or (arr_v[0] == 3 and arr_v[1] < 6):
@@ -59,15 +71,119 @@ def main():
 
     arg_data = parse_args()
 
-    if arg_data['input']:
-        with open(arg_data['input'], 'rb') as f:
-            bindata = f.read()
+    if arg_data['batch']:
+        batch_main(arg_data)
+        return
+
+    if arg_data['input'] == STDIO and not arg_data['output']:
+        arg_data['output'] = STDIO
+    if arg_data['output'] == STDIO:
+        LOG_STREAM.stream = sys.stderr  # Keep stdout for the data
+
+    if arg_data['input'] == STDIO:
+        write_text(sys.stdin.buffer.read(), arg_data['output'],
+                   arg_data['name'])
+        return
+
+    import mmap
+
+    with open(arg_data['input'], 'rb') as f:
+        bindata = b''  # Empty files can't be mapped
+        if os.fstat(f.fileno()).st_size:
+            bindata = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            write_text(bindata, arg_data['output'], arg_data['name'])
+        finally:
+            if bindata:
+                bindata.close()
+
+
+def batch_main(arg_data):
+    """Batch mode: converts all files found, in parallel"""
+
+    import zxn_batch
+    zxn_batch.LOGGER.addHandler(LOG_STREAM)
+
+    arr_files = zxn_batch.find_files(
+        arg_data['batch'], arr_exclude=['build', arg_data['output'].name])
+
+    arr_jobs = []
+    for i_path, rel_path in arr_files:
+        arr_jobs.append((i_path, arg_data['output'] / rel_path, None))
+
+    arr_results, elapsed = zxn_batch.run(convert_file, arr_jobs,
+                                         arg_data['jobs'])
+    if zxn_batch.report(arr_files, arr_results, elapsed):
+        sys.exit(1)
+
+
+def convert_file(arr_job):
+    """
+        Batch worker: converts one file as main() does, and returns the
+        number of lines and bytes read
+    """
+
+    i_path, o_path, name = arr_job
+
+    with open(i_path, 'rb') as f:
+        bindata = f.read()
+
+    arr_str = decode(bindata, name)
+
+    o_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(o_path, 'w') as f:
+        f.writelines(arr_str)
+
+    return len(arr_str), len(bindata)
+
+
+def format_file(arr_job):
+    """
+        Batch worker: formats a text file, converting it to NextBASIC and
+        back, and keeps a .bak copy of the original file
+    """
+
+    import txt2nextbasic
+
+    i_path, name = arr_job
+
+    with open(i_path, 'r') as f:
+        code = f.readlines()
+
+    bin_data = txt2nextbasic.encode(code)
+    arr_str = decode(bin_data, name)
+
+    os.replace(str(i_path), str(i_path.with_name(i_path.name + '.bak')))
+    with open(i_path, 'w') as f:
+        f.writelines(arr_str)
+
+    return len(code), len(bin_data)
 
-    arr_str = []
-    if arg_data['name']:
-        arr_str.append('#program {0}\r\n'.format(arg_data['name']))
 
-    arr_result = []
+# API
+# ---
+
+
+def decode(bindata, name=None):
+    """
+        Converts a +3DOS NextBASIC file, given as bytes, to a list of text
+        lines (with directives), each one ending with CRLF
+    """
+
+    return list(iter_decode(bindata, name))
+
+
+def iter_decode(bindata, name=None):
+    """
+        Same as decode(), but yields the lines one by one, so big files can
+        be converted without keeping all the text in memory. bindata can be
+        bytes, a memoryview or a mmap
+    """
+
+    if name:
+        yield '#program {0}\r\n'.format(name)
+
     if len(bindata) > 128 and bindata[:8] == b'PLUS3DOS' and bindata[
             15:16] == b'\x00':
         i_len = int.from_bytes(bindata[11:15], 'little')
@@ -77,27 +193,43 @@ def main():
             s_addr = '#autostart'
             if i_saddr > 0:
                 s_addr += ' {0}'.format(i_saddr)
-            arr_str.append(s_addr + '\r\n')
+            yield s_addr + '\r\n'
 
-        arr_bin = bindata[128:]  # Remove header
-        arr_str += procbin(arr_bin, i_len)
+        yield from procbin(bindata, i_len, 128)  # Skip header
     else:
         str_msg = _('Not a valid file')
         LOGGER.error(str_msg)
         raise RuntimeError(str_msg)
 
-    if arr_str:
-        with open(arg_data['output'], 'w') as f:
-            f.writelines(arr_str)
-
 
 # Functions
 # ---------
 
 
+def write_text(bindata, o_path, name=None):
+    """
+        Decodes bindata, writing the lines as they are decoded to o_path
+        (or to stdout). Nothing is written if there are no lines
+    """
+
+    it_str = iter_decode(bindata, name)
+    str_line = next(it_str, None)
+    if str_line is not None:
+        if o_path == STDIO:
+            sys.stdout.write(str_line)
+            sys.stdout.writelines(it_str)
+            sys.stdout.flush()
+        else:
+            with open(o_path, 'w') as f:
+                f.write(str_line)
+                f.writelines(it_str)
+
+
 def parse_args():
     """Command Line Parser"""
 
+    import argparse
+
     parser = argparse.ArgumentParser(description='NextBASIC to Text Converter')
     parser.add_argument('-v',
                         '--version',
@@ -107,35 +239,56 @@ def parse_args():
                         '--output',
                         action='store',
                         dest='output_path',
-                        help='Output path')
+                        help='Output path (- for stdout)')
     parser.add_argument('-i',
                         '--input',
-                        required=True,
+                        required=False,
                         action='store',
                         dest='input_path',
-                        help='Input binary file with NextBASIC code')
+                        help='Input NextBASIC binary file (- for stdin)')
     parser.add_argument('-n',
                         '--name',
                         required=False,
                         action='store',
                         dest='program_name',
                         help='Text for #program directive')
+    parser.add_argument('--batch',
+                        action='store',
+                        nargs='+',
+                        dest='batch',
+                        help='Directories or glob patterns to convert')
+    parser.add_argument('-j',
+                        '--jobs',
+                        action='store',
+                        type=int,
+                        dest='jobs',
+                        help='Number of parallel jobs for batch mode')
 
     arguments = parser.parse_args()
 
+    if arguments.batch:
+        if not arguments.output_path:
+            parser.error(_('An output directory is required in batch mode'))
+    elif not arguments.input_path:
+        parser.error(_('An input file is required'))
+
     values = {}
 
     i_path = None
     if arguments.input_path:
         i_path = Path(arguments.input_path)
+        if arguments.input_path == '-':
+            i_path = STDIO
 
     o_path = None
     if arguments.output_path:
         o_path = Path(arguments.output_path)
+        if arguments.output_path == '-':
+            o_path = STDIO
     values['output'] = o_path
 
     if i_path:
-        if not i_path.exists():
+        if i_path != STDIO and not i_path.exists():
             str_msg = _('Path not found: {0}')
             LOGGER.error(str_msg.format(i_path))
             str_msg = _('Input path does not exist!')
@@ -147,114 +300,109 @@ def parse_args():
     values['name'] = p_name
 
     values['input'] = i_path
+    values['batch'] = arguments.batch or []
+    values['jobs'] = arguments.jobs
 
     return values
 
 
-def procbin(b_data, i_len):
-    arr_str = []
+def procbin(b_data, i_len, i_pos=0):
+    """
+        Yields the text of each BASIC line found in b_data, starting at
+        i_pos. Data is read by offset, one line at a time, and each line is
+        converted with decode_line()
+    """
+
     prev_line = -1
     while i_len > 4:
-        line_number = int.from_bytes(b_data[:2], 'big')
-        l_length = int.from_bytes(b_data[2:4], 'little')
+        line_number = int.from_bytes(b_data[i_pos:i_pos + 2], 'big')
+        l_length = int.from_bytes(b_data[i_pos + 2:i_pos + 4], 'little')
         if line_number < prev_line or line_number > 9999:
             LOGGER.debug('End of program: Line {0}'.format(line_number))
             break
         prev_line = line_number
 
-        b_data = b_data[4:]
-        i_len = i_len - 4
-
-        n_counter = 0
-        tkn_expand = 1
-        b_eol = False
-        b_rem = False
-        str_line = u''
-        while l_length:
-            b_char = b_data[:1]
-            i_char = int.from_bytes(b_char, "big")
-            s_char = chr(i_char)
-
-            b_data = b_data[1:]
-            l_length = l_length - 1
-            i_len = i_len - 1
-
-            # EOL char only valid at the real End Of Line
-            if i_char == 0x0d and not l_length:
-                b_eol = True
-                break
-
-            # Skip number 5-bytes data
-            if i_char == 0x0e and not n_counter and not b_rem:
-                n_counter = 6
-            if n_counter:
-                n_counter -= 1
-                continue
-
-            # Quoted data
-            if s_char == '"':
-                tkn_expand = 1 - tkn_expand
-
-            # Comments
-            if b_rem:
-                tkn_expand = 0
-
-            if tkn_expand:
-                # Token expansion
-                if i_char in TOKENS:
-                    s_char = '{0} '.format(TOKENS[i_char])
-            else:
-                # Char conversion
-                if s_char in CHARS:
-                    s_char = '{0}'.format(CHARS[s_char])
-                else:
-                    # Escape non printable character
-                    if i_char < 0x20 or i_char > 0x7e:
-                        s_char = '`x{:02x}'.format(i_char)
-
-            # Detect REM
-            if i_char == 0x0EA:
-                b_rem = True
+        i_pos += 4
+        b_line = b_data[i_pos:i_pos + l_length]
+        if len(b_line) < l_length:
+            b_line = bytes(b_line) + b'\x00' * (l_length - len(b_line))
+        i_pos += l_length
+        i_len -= 4 + l_length
+
+        yield decode_line(line_number, b_line)
+
+
+def decode_line(line_number, b_line):
+    """
+        Text of a BASIC line, given its number and its tokenized data. Each
+        byte is converted using TABLE_EXPAND or TABLE_LITERAL (comments are
+        converted at once, with the zxnext codec)
+    """
+
+    l_length = len(b_line)
+    n_counter = 0
+    tkn_expand = 1
+    b_rem = False
+    s_last = None  # Last char that is not a space
+    arr_line = []
+    for i_char in b_line:
+        l_length -= 1
+
+        # EOL char only valid at the real End Of Line
+        if i_char == 0x0d and not l_length:
+            break
 
-            # Detect ; comments
-            if s_char == ';' and tkn_expand:
-                if not str_line.strip() or str_line.strip()[-1] == ':':
-                    b_rem = True
+        # Skip number 5-bytes data
+        if n_counter:
+            n_counter -= 1
+            continue
+        if i_char == 0x0e and not b_rem:
+            n_counter = 5
+            continue
 
-            str_line += s_char
+        # Quoted data
+        if i_char == 0x22:
+            tkn_expand = 1 - tkn_expand
 
-        str_line = str_line.strip()
-        str_line += '\r\n'
+        # Comments
+        if b_rem:
+            tkn_expand = 0
 
-        arr_str.append('{0:>4} {1}'.format(line_number, str_line))
-        LOGGER.debug('{0}-> {1}'.format(line_number, str_line))
+        if tkn_expand:
+            s_char, s_end = TABLE_EXPAND[i_char]
 
-    return arr_str
+            # Detect ; comments
+            if i_char == 0x3b and s_last in (None, ':'):
+                b_rem = True
+        else:
+            s_char, s_end = TABLE_LITERAL[i_char]
+
+        # Detect REM
+        if i_char == 0x0EA:
+            b_rem = True
+
+        arr_line.append(s_char)
+        if s_end:
+            s_last = s_end
+
+        # The rest of a comment is all literal, so it's decoded at once
+        if b_rem:
+            b_rest = b_line[len(b_line) - l_length:]
+            if b_rest[-1:] == b'\r':
+                b_rest = b_rest[:-1]
+            arr_line.append(str(b_rest, zxn_codec.CODEC_NAME))
+            break
+
+    str_line = ''.join(arr_line).strip()
+    str_line += '\r\n'
+
+    LOGGER.debug('{0}-> {1}'.format(line_number, str_line))
+    return '{0:>4} {1}'.format(line_number, str_line)
 
 
 # Constants
 # ---------
 
-CHARS = {
-    '`': '£',
-    127: '©',
-    129: '\u259D',  # Quadrant upper right
-    130: '\u2598',  # Quadrant upper left
-    131: '\u2580',  # Upper half block
-    132: '\u2597',  # Quadrant lower right
-    133: '\u2590',  # Right half block
-    134: '\u259A',  # Quadrant upper left and lower right
-    135: '\u259C',  # Quadrant upper left and upper right and lower right
-    136: '\u2596',  # Quadrant lower left
-    137: '\u259E',  # Quadrant upper right and lower left
-    138: '\u258C',  # Left half block
-    139: '\u259B',  # Quadrant upper left and upper right and lower left
-    140: '\u2584',  # Lower half block
-    141: '\u259F',  # Quadrant upper right and lower left and lower right
-    142: '\u2599',  # Quadrant upper left and lower left and lower right
-    143: '\u2588'  # Full block
-}
-
 TOKENS = {
     135: 'PEEK$',
     136: 'REG',
@@ -379,26 +527,19 @@ TOKENS = {
     255: 'COPY'
 }
 
-CHARS = {
-    '`': '£',
-    '\x7f': '©',
-    '\x81': '\u259D',  # Quadrant upper right
-    '\x81': '\u259D',  # Quadrant upper right
-    '\x82': '\u2598',  # Quadrant upper left
-    '\x83': '\u2580',  # Upper half block
-    '\x84': '\u2597',  # Quadrant lower right
-    '\x85': '\u2590',  # Right half block
-    '\x86': '\u259A',  # Quadrant upper left and lower right
-    '\x87': '\u259C',  # Quadrant upper left and upper right and lower right
-    '\x88': '\u2596',  # Quadrant lower left
-    '\x89': '\u259E',  # Quadrant upper right and lower left
-    '\x8a': '\u258C',  # Left half block
-    '\x8b': '\u259B',  # Quadrant upper left and upper right and lower left
-    '\x8c': '\u2584',  # Lower half block
-    '\x8d': '\u259F',  # Quadrant upper right and lower left and lower right
-    '\x8e': '\u2599',  # Quadrant upper left and lower left and lower right
-    '\x8f': '\u2588',  # Full block
-}
+STDIO = Path('-')  # Path for stdin or stdout
+
+# Text for each byte, and its last char that is not a space (or None)
+TABLE_EXPAND = []  # Outside quotes, with tokens expanded
+TABLE_LITERAL = []  # Inside quotes or comments
+for i_char in range(256):
+    s_char = chr(i_char)
+    if i_char in TOKENS:
+        s_char = '{0} '.format(TOKENS[i_char])
+    TABLE_EXPAND.append((s_char, s_char.rstrip()[-1:] or None))
+
+    s_char = zxn_codec.DECODE_TABLE.get(i_char, chr(i_char))
+    TABLE_LITERAL.append((s_char, s_char.rstrip()[-1:] or None))
 
 if __name__ == '__main__':
     main()
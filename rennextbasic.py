@@ -23,16 +23,17 @@ Text NextBASIC Renumbering
 
 import sys
 import os
-import argparse
 import logging
 import re
-import gettext
 
 if sys.version_info > (3, 5):
     from pathlib import Path
 else:
     from pathlib2 import Path
 
+import zxn_codec  # Registers the zxnext codec
+import zxn_program
+
 __MY_NAME__ = 'rennextbasic.py'
 __MY_VERSION__ = '1.1.2'
 
@@ -42,146 +43,50 @@ LOG_FORMAT = logging.Formatter(
     '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
 LOG_STREAM = logging.StreamHandler(sys.stdout)
 LOG_STREAM.setFormatter(LOG_FORMAT)
-LOGGER.addHandler(LOG_STREAM)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
 
 path_locale = os.path.dirname(__file__)
 path_locale = os.path.join(path_locale, 'locale')
-gettext.bindtextdomain(__MY_NAME__, localedir=path_locale)
-gettext.textdomain(__MY_NAME__)
-_ = gettext.gettext
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
 
 
 def main():
     """Main Routine"""
 
+    LOGGER.addHandler(LOG_STREAM)
+
     arg_data = parse_args()
 
+    if arg_data['batch']:
+        batch_main(arg_data)
+        return
+
     new_lines = []
     if arg_data['decode']:
         # Binary decoding to ` codes
         LOGGER.debug("Decoding...")
         with open(arg_data['input'], 'rb') as f:
             code = f.read()
-            code = code.split(b'\r')
 
-        for line in code:
-            n_line = ''
-            for i_char in line:
-                if i_char in CHARS:
-                    n_line += CHARS[i_char]
-                elif i_char < 32 or i_char > 127:
-                    n_line += '`x{:02x}'.format(i_char)
-                else:
-                    n_line += chr(i_char)
-
-            new_lines.append(n_line + '\r\n')
+        new_lines = decode_escapes(code)
     else:
-        LOGGER.debug("Renumbering...")
-        with open(arg_data['input'], 'r') as f:
-            code = f.readlines()
-
-        arr_lines = {}
-        for line in code:
-            test_line = line.strip()
-            if test_line and test_line[
-                    0] != '#':  # Lines with just directives aren't parsed
-                # Split line number and content, then catalog
-                det_comm = re.compile('(\\s*\\d+)\\s*(.*)')
-                match_comm = det_comm.match(line)
-                if match_comm:
-                    l_number = int(match_comm.group(1).strip())
-                    l_text = match_comm.group(2).strip()
-                    if l_number not in arr_lines:
-                        arr_lines[l_number] = [0, l_text]
-                    else:
-                        str_msg = _('Duplicated line number: {0}')
-                        LOGGER.error(str_msg.format(l_number))
-                else:
-                    str_msg = _('Line number not found: {0}')
-                    LOGGER.warn(str_msg.format(line))
-
-        max_lines = len(arr_lines.keys())
-        if max_lines < 1000:
-            n_step = 10
-        elif max_lines < 2000:
-            n_step = 5
-        elif max_lines < 5000:
-            n_step = 2
-        else:
-            n_step = 1
-
-        if arg_data['step'] > n_step:
-            str_msg = _('Too many lines ({0})!. Step changed to: {1}')
-            LOGGER.warn(str_msg.format(max_lines, n_step))
-        else:
-            n_step = arg_data['step']
-
-        must_change = False
-
-        cur_line = n_step
-        for item in arr_lines:
-            arr_lines[item][0] = cur_line
-            if item != cur_line:
-                must_change = True
-            cur_line += n_step
-
-        if must_change:
-            for line in code:
-                test_line = line.strip()
-                if test_line:
-                    if test_line[
-                            0] == '#':  # Lines with directives aren't parsed
-                        l_text = line
-                        if test_line.startswith('#autostart '):
-                            # Split line number and content
-                            det_comm = re.compile('(#autostart\\s+)(\\d+)(.*)')
-                            match_comm = det_comm.match(line)
-                            if match_comm:
-                                old_number = int(match_comm.group(2))
-                                new_number = arr_lines[old_number][0]
-                                l_text = '{0}'.format(match_comm.group(1))
-                                l_text += '{0}'.format(new_number)
-                                l_text += '{0}\r\n'.format(match_comm.group(3))
-
-                        new_lines.append(l_text)
-                    else:
-                        # Split line number and content
-                        det_comm = re.compile('(\\s*\\d+)\\s*(.*)')
-                        match_comm = det_comm.match(line)
-                        if match_comm:
-                            l_number = int(match_comm.group(1).strip())
-                            l_text = match_comm.group(2)
-
-                        new_number = arr_lines[l_number][0]
-                        new_line = '{0:>4} '.format(new_number)
-
-                        # Find GO TO, GO SUB, SAVE or RESTORE
-                        arr_match = [
-                            '(.*\\s*go\\s+to\\s+)(\\d+)(.*)',
-                            '(.*\\s*go\\s+sub\\s+)(\\d+)(.*)',
-                            '(.*save\\s*".*"\\s*line\\s*)',
-                            '(.*\\s*restore\\s+)(\\d+)(.*)',
-                        ]
-                        for str_match in arr_match:
-                            det_comm = re.compile(str_match, re.IGNORECASE)
-                            match_comm = det_comm.match(l_text)
-                            if match_comm:
-                                old_number = int(match_comm.group(2))
-                                if old_number in arr_lines:
-                                    new_number = arr_lines[old_number][0]
-                                    l_text = '{0}'.format(match_comm.group(1))
-                                    l_text += '{0}{1}'.format(
-                                        new_number, match_comm.group(3))
-                                else:
-                                    str_msg = _(
-                                        'Line not found!: {0} in line {1}({2})'
-                                    )
-                                    LOGGER.error(
-                                        str_msg.format(old_number, l_number,
-                                                       new_number))
-
-                        new_line += l_text + '\r\n'
-                        new_lines.append(new_line)
+        try:
+            new_lines = renumber_file(arg_data)
+        except ValueError as error:
+            LOGGER.error(error)  # Range or room that can't be used
+            sys.exit(1)
 
     if new_lines:
         if arg_data['output']:
@@ -192,23 +97,704 @@ def main():
                 arg_data['input'],
                 arg_data['input'].with_name(arg_data['input'].name + '.bak'))
 
-        with open(output_file, 'w') as f:
-            f.writelines(new_lines)
+        if isinstance(new_lines, bytes):
+            with open(output_file, 'wb') as f:
+                f.write(new_lines)
+        else:
+            with open(output_file, 'w') as f:
+                f.writelines(new_lines)
 
     else:
         str_msg = _('Nothing to do')
         LOGGER.debug(str_msg)
 
 
+def renumber_file(arg_data):
+    """Renumbers the input file, and returns the new lines or bytes"""
+
+    if is_plus3dos(arg_data['input']):
+        LOGGER.debug("Renumbering binary...")
+        with open(arg_data['input'], 'rb') as f:
+            code = f.read()
+
+        return renumber_binary(code, arg_data['step'], arg_data['range'],
+                               arg_data['room'])
+
+    LOGGER.debug("Renumbering...")
+    with open(arg_data['input'], 'r') as f:
+        code = f.readlines()
+
+    new_lines, must_change = renumber_lines(code, arg_data['step'],
+                                            arg_data['range'],
+                                            arg_data['room'])
+    if not must_change:
+        new_lines = []
+
+    return new_lines
+
+
+def batch_main(arg_data):
+    """Batch mode: processes all files found, in parallel"""
+
+    import zxn_batch
+    zxn_batch.LOGGER.addHandler(LOG_STREAM)
+
+    arr_exclude = ['build']
+    if arg_data['output']:
+        arr_exclude.append(arg_data['output'].name)
+    arr_files = zxn_batch.find_files(arg_data['batch'],
+                                     arr_exclude=arr_exclude)
+
+    arr_jobs = []
+    for i_path, rel_path in arr_files:
+        o_path = None
+        if arg_data['output']:
+            o_path = arg_data['output'] / rel_path
+        arr_jobs.append((i_path, o_path, arg_data['step'],
+                         arg_data['decode'], arg_data['range'],
+                         arg_data['room']))
+
+    arr_results, elapsed = zxn_batch.run(convert_file, arr_jobs,
+                                         arg_data['jobs'])
+    if zxn_batch.report(arr_files, arr_results, elapsed):
+        sys.exit(1)
+
+
+def convert_file(arr_job):
+    """
+        Batch worker: processes one file as main() does, and returns the
+        number of lines and bytes read
+    """
+
+    i_path, o_path, step, b_decode, arr_range, arr_room = arr_job
+
+    if b_decode:
+        with open(i_path, 'rb') as f:
+            code = f.read()
+        n_bytes = len(code)
+        new_lines = decode_escapes(code)
+        n_lines = len(new_lines)
+    elif is_plus3dos(i_path):
+        with open(i_path, 'rb') as f:
+            code = f.read()
+        n_bytes = len(code)
+        n_lines = 0
+        new_lines = renumber_binary(code, step, arr_range, arr_room)
+    else:
+        with open(i_path, 'r') as f:
+            code = f.readlines()
+        n_bytes = os.path.getsize(i_path)
+        n_lines = len(code)
+        new_lines, must_change = renumber_lines(code, step, arr_range,
+                                                arr_room)
+        if not must_change:
+            new_lines = []
+
+    if new_lines:
+        if o_path:
+            o_path.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            o_path = i_path
+            os.rename(i_path, i_path.with_name(i_path.name + '.bak'))
+
+        if isinstance(new_lines, bytes):
+            with open(o_path, 'wb') as f:
+                f.write(new_lines)
+        else:
+            with open(o_path, 'w') as f:
+                f.writelines(new_lines)
+
+    return n_lines, n_bytes
+
+
+# API
+# ---
+
+
+def renumber(lines, step=10, first=None, last=None, start=None):
+    """
+        Renumbers BASIC text lines (with directives), updating GO TO, GO SUB
+        and RESTORE references. If first and last are given, only the lines
+        between them are renumbered, from start. Returns a new list of
+        lines, each one ending with CRLF
+    """
+
+    arr_range = None
+    if first is not None and last is not None:
+        arr_range = (first, last, start)
+
+    code = [line.rstrip('\r\n') + '\n' for line in lines]
+    new_lines, must_change = renumber_lines(code, step, arr_range)
+    if not must_change:
+        new_lines = code
+
+    return [line.rstrip('\r\n') + '\r\n' for line in new_lines]
+
+
+def make_room(lines, line, count=1):
+    """
+        Moves as few BASIC text lines as possible to leave room for count
+        new lines after line, updating references to them. Returns a new
+        list of lines, each one ending with CRLF
+    """
+
+    code = [l_text.rstrip('\r\n') + '\n' for l_text in lines]
+    new_lines, must_change = renumber_lines(code, arr_room=(line, count))
+    if not must_change:
+        new_lines = code
+
+    return [l_text.rstrip('\r\n') + '\r\n' for l_text in new_lines]
+
+
+def renumber_bin(bindata, step=10, first=None, last=None, start=None):
+    """
+        Renumbers a +3DOS NextBASIC file, given as bytes, without
+        converting it to text, like renumber() does. Returns the new file
+        as bytes
+    """
+
+    arr_range = None
+    if first is not None and last is not None:
+        arr_range = (first, last, start)
+
+    return renumber_binary(bindata, step, arr_range) or bytes(bindata)
+
+
+def decode_escapes(code):
+    """
+        Converts binary BASIC data, given as bytes, to a list of text lines
+        using ` codes for non printable characters
+    """
+
+    return [
+        str(line, zxn_codec.CODEC_NAME) + '\r\n'
+        for line in code.split(b'\r')
+    ]
+
+
 # Functions
 # ---------
 
 
+def renumber_lines(code, step=10, arr_range=None, arr_room=None):
+    """
+        Renumbers BASIC text lines. Returns the new lines and True if any
+        line number has changed (if not, the new lines aren't built).
+        Line number references are indexed while reading the lines (see
+        find_references), and then all of them are updated at once.
+        With arr_range (first, last, start), only lines from first to last
+        are renumbered, from start. With arr_room (line, count), the fewest
+        lines possible are moved to leave room for count new lines after
+        line. In both cases, only the lines that are moved or that refer to
+        them are rewritten
+    """
+
+    arr_code = []  # Line number (None if not a BASIC line), text, references
+    arr_lines = {}
+    arr_refered = {}  # Indexes in arr_code of lines refering to each number
+    arr_computed = []  # Lines with computed line numbers
+    for line in code:
+        test_line = line.strip()
+        if not test_line:
+            continue
+        if test_line[0] == '#':  # Lines with just directives aren't parsed
+            match_comm = RE_AUTOSTART.match(line)
+            if match_comm:
+                arr_refered.setdefault(int(match_comm.group(2)),
+                                       []).append(len(arr_code))
+            arr_code.append((None, line, None))
+            continue
+
+        # Split line number and content, then catalog
+        match_comm = RE_LINENUMBER.match(line)
+        if match_comm:
+            l_number = int(match_comm.group(1).strip())
+            l_text = match_comm.group(2)
+            if l_number not in arr_lines:
+                arr_lines[l_number] = len(arr_code)
+            else:
+                str_msg = _('Duplicated line number: {0}')
+                LOGGER.error(str_msg.format(l_number))
+            arr_refs = find_references(l_text)
+            for _i_start, _i_end, old_number in arr_refs:
+                if old_number is None:
+                    arr_computed.append(l_number)
+                else:
+                    arr_refered.setdefault(old_number,
+                                           []).append(len(arr_code))
+            arr_code.append((l_number, l_text, arr_refs))
+        else:
+            str_msg = _('Line number not found: {0}')
+            LOGGER.warn(str_msg.format(line))
+            arr_code.append((None, line, None))
+
+    arr_numbers = list(arr_lines)
+    if arr_range:
+        arr_new = range_numbers(arr_numbers, step, *arr_range)
+    elif arr_room:
+        arr_new = room_numbers(arr_numbers, *arr_room)
+    else:
+        arr_new = all_numbers(arr_numbers, step)
+
+    must_change = bool(arr_new)
+
+    new_lines = []
+    if must_change:
+        for l_number in sorted(set(arr_computed)):
+            str_msg = _('Computed line number not renumbered: {0}')
+            LOGGER.warning(str_msg.format(l_number))
+
+        if arr_range or arr_room:
+            # Only moved lines, and lines refering to them, are rewritten
+            arr_rewrite = set()
+            for old_number in arr_new:
+                arr_rewrite.add(arr_lines[old_number])
+                arr_rewrite.update(arr_refered.get(old_number, ()))
+        else:
+            arr_rewrite = None
+
+        i_line = 0
+        for line in code:
+            if not line.strip():
+                continue
+            if arr_rewrite is None or i_line in arr_rewrite:
+                line = rewrite_line(arr_code[i_line], line, arr_lines,
+                                    arr_new, arr_rewrite is None)
+            new_lines.append(line)
+            i_line += 1
+
+    return new_lines, must_change
+
+
+def all_numbers(arr_numbers, step):
+    """
+        Returns new numbers (as a dict: old -> new) to renumber all lines
+        with the given step, or with a smaller one if there are too many
+        lines. Only changed line numbers are included
+    """
+
+    max_lines = len(arr_numbers)
+    if max_lines < 1000:
+        n_step = 10
+    elif max_lines < 2000:
+        n_step = 5
+    elif max_lines < 5000:
+        n_step = 2
+    else:
+        n_step = 1
+
+    if step > n_step:
+        str_msg = _('Too many lines ({0})!. Step changed to: {1}')
+        LOGGER.warn(str_msg.format(max_lines, n_step))
+    else:
+        n_step = step
+
+    arr_new = {}
+    cur_line = n_step
+    for item in arr_numbers:
+        if item != cur_line:
+            arr_new[item] = cur_line
+        cur_line += n_step
+
+    return arr_new
+
+
+def range_numbers(arr_numbers, step, first, last, start=None):
+    """
+        Returns new numbers (as a dict: old -> new) to renumber only the
+        lines from first to last, starting from start (by default, the
+        first line found) and with the given step. The new numbers must fit
+        between the previous and next lines, or ValueError is raised (and
+        logged by the caller)
+    """
+
+    arr_pos = [i_pos for i_pos, l_number in enumerate(arr_numbers)
+               if first <= l_number <= last]
+    if not arr_pos:
+        str_msg = _('No lines between {0} and {1}')
+        raise ValueError(str_msg.format(first, last))
+
+    i_first = arr_pos[0]
+    i_last = arr_pos[-1]
+    if start is None:
+        start = arr_numbers[i_first]
+    new_last = start + step * (i_last - i_first)
+
+    l_prev = 0
+    if i_first > 0:
+        l_prev = arr_numbers[i_first - 1]
+    l_next = MAX_LINE + 1
+    if i_last + 1 < len(arr_numbers):
+        l_next = arr_numbers[i_last + 1]
+    if start <= l_prev or new_last >= l_next:
+        str_msg = _('Lines {0} to {1} do not fit between {2} and {3}')
+        raise ValueError(str_msg.format(start, new_last, l_prev, l_next))
+
+    arr_new = {}
+    cur_line = start
+    for item in arr_numbers[i_first:i_last + 1]:
+        if item != cur_line:
+            arr_new[item] = cur_line
+        cur_line += step
+
+    return arr_new
+
+
+def room_numbers(arr_numbers, line, count=1):
+    """
+        Returns new numbers (as a dict: old -> new) that leave room for
+        count new lines after line, moving as few lines as possible, by one
+        line number each, forwards (the lines after) or backwards (line and
+        the ones before). Raises ValueError (logged by the caller) if there
+        isn't enough room
+    """
+
+    if line not in arr_numbers:
+        str_msg = _('Line not found: {0}')
+        raise ValueError(str_msg.format(line))
+
+    i_line = arr_numbers.index(line)
+    n_lines = len(arr_numbers)
+
+    arr_forward = {}
+    cur_line = line + count + 1
+    i_pos = i_line + 1
+    while i_pos < n_lines and arr_numbers[i_pos] < cur_line:
+        arr_forward[arr_numbers[i_pos]] = cur_line
+        cur_line += 1
+        i_pos += 1
+    if cur_line - 1 > MAX_LINE:
+        arr_forward = None
+
+    arr_backward = None
+    if i_line + 1 < n_lines:
+        arr_backward = {}
+        cur_line = arr_numbers[i_line + 1] - count - 1
+        i_pos = i_line
+        while i_pos >= 0 and arr_numbers[i_pos] > cur_line:
+            arr_backward[arr_numbers[i_pos]] = cur_line
+            cur_line -= 1
+            i_pos -= 1
+        if cur_line + 1 < 1:
+            arr_backward = None
+
+    if arr_forward is None and arr_backward is None:
+        str_msg = _('Not enough room for {0} lines after line {1}')
+        raise ValueError(str_msg.format(count, line))
+
+    if arr_forward is None or (arr_backward is not None
+                               and len(arr_backward) < len(arr_forward)):
+        arr_new = arr_backward
+    else:
+        arr_new = arr_forward
+
+    str_msg = _('Room for {0} lines after line {1}')
+    LOGGER.info(str_msg.format(count, arr_new.get(line, line)))
+
+    return arr_new
+
+
+def rewrite_line(arr_line, line, arr_lines, arr_new, b_format):
+    """
+        Rebuilds a text line with new line numbers. If b_format is True,
+        the line number is padded and the line ends with CRLF, like in a
+        full renumbering. If not, the line keeps its layout
+    """
+
+    l_number, l_text, arr_refs = arr_line
+    if l_number is None:
+        match_comm = RE_AUTOSTART.match(l_text)
+        if match_comm and int(match_comm.group(2)) in arr_lines:
+            new_number = int(match_comm.group(2))
+            str_end = '\r\n'
+            if not b_format:
+                str_end = l_text[len(l_text.rstrip('\r\n')):]
+            l_text = '{0}{1}{2}{3}'.format(
+                match_comm.group(1), arr_new.get(new_number, new_number),
+                match_comm.group(3), str_end)
+        return l_text
+
+    new_number = arr_new.get(l_number, l_number)
+    if b_format:
+        arr_text = ['{0:>4} '.format(new_number)]
+        str_end = '\r\n'
+    else:
+        match_comm = RE_LINENUMBER.match(line)
+        str_number = match_comm.group(1)
+        arr_text = [
+            '{0:>{1}}'.format(new_number, len(str_number)),
+            line[match_comm.end(1):match_comm.start(2)]
+        ]
+        str_end = line[len(line.rstrip('\r\n')):]
+
+    i_pos = 0
+    for i_start, i_end, old_number in arr_refs:
+        if old_number is None:
+            continue
+        elif old_number in arr_lines:
+            arr_text.append(l_text[i_pos:i_start])
+            arr_text.append(str(arr_new.get(old_number, old_number)))
+            i_pos = i_end
+        else:
+            str_msg = _('Line not found!: {0} in line {1}({2})')
+            LOGGER.error(str_msg.format(old_number, l_number, new_number))
+    arr_text.append(l_text[i_pos:])
+    arr_text.append(str_end)
+
+    return ''.join(arr_text)
+
+
+def find_references(l_text):
+    """
+        Finds the line numbers after GO TO, GO SUB, RESTORE, RUN, LIST,
+        LLIST and SAVE ... LINE in the text of a BASIC line, skipping quoted
+        strings, comments and dot commands. Returns the start and end of
+        each one in l_text and its value, or None as value if the line
+        number is an expression
+    """
+
+    arr_refs = []
+    if not RE_REFERENCE.search(l_text):
+        return arr_refs
+
+    arr_tokens = [(match_tk.group(), match_tk.start(), match_tk.end())
+                  for match_tk in RE_TOKENS.finditer(l_text)]
+    n_tokens = len(arr_tokens)
+
+    b_start = True  # At the start of a statement
+    b_dot = False  # In a dot command
+    str_first = None  # First token of statement
+    i_tk = 0
+    while i_tk < n_tokens:
+        str_tk, i_start, i_end = arr_tokens[i_tk]
+        i_tk += 1
+        if str_tk == ':':
+            b_start = True
+            b_dot = False
+            continue
+        if b_dot:
+            continue
+        if b_start:
+            b_start = False
+            if str_tk in ('REM', ';'):
+                break  # Comment until the end of the line
+            if str_tk == '.':
+                b_dot = True  # Dot command until next statement
+                continue
+            str_first = str_tk
+        if str_tk in ('THEN', 'ELSE'):
+            b_start = True
+            continue
+
+        str_tk = RE_SPACES.sub(' ', str_tk)
+        if str_tk in REF_KEYWORDS or (str_tk == 'LINE'
+                                      and str_first == 'SAVE'):
+            str_arg = ':'
+            if i_tk < n_tokens:
+                str_arg = arr_tokens[i_tk][0]
+            if str_arg in (':', 'ELSE') or (str_tk == 'RUN'
+                                            and str_arg == 'AT'):
+                continue  # No line number (e.g. RUN, RESTORE, RUN AT)
+
+            str_next = ':'
+            if i_tk + 1 < n_tokens:
+                str_next = arr_tokens[i_tk + 1][0]
+            if str_arg.isdigit() and str_next in (':', 'ELSE'):
+                arr_refs.append((arr_tokens[i_tk][1], arr_tokens[i_tk][2],
+                                 int(str_arg)))
+                i_tk += 1
+            else:
+                arr_refs.append((i_end, i_end, None))
+
+    return arr_refs
+
+
+def is_plus3dos(i_path):
+    """Returns True if the file is a +3DOS BASIC program"""
+
+    with open(i_path, 'rb') as f:
+        b_head = f.read(16)
+
+    return b_head[:8] == b'PLUS3DOS' and b_head[15:16] == b'\x00'
+
+
+def renumber_binary(bindata, step=10, arr_range=None, arr_room=None):
+    """
+        Renumbers a +3DOS BASIC program, given as bytes, as renumber_lines
+        does with text lines. The program is read into a zxn_program.Program,
+        and then each line is copied once to a new one, changing its number
+        and the line numbers it refers to (both the digits and the hidden
+        5-byte number). The header is updated at the end. Returns the new
+        file as bytes, or None if no line number has changed
+    """
+
+    if len(bindata) < 128 or bindata[:8] != b'PLUS3DOS' or bindata[
+            15] != 0:
+        str_msg = _('Not a valid file')
+        LOGGER.error(str_msg)
+        raise RuntimeError(str_msg)
+
+    program = zxn_program.Program.from_bytes(bindata)
+    arr_numbers = []
+    for line_number in program.numbers:
+        if arr_numbers and line_number == arr_numbers[-1]:
+            str_msg = _('Duplicated line number: {0}')
+            LOGGER.error(str_msg.format(line_number))
+        else:
+            arr_numbers.append(line_number)
+
+    if arr_range:
+        arr_new = range_numbers(arr_numbers, step, *arr_range)
+    elif arr_room:
+        arr_new = room_numbers(arr_numbers, *arr_room)
+    else:
+        arr_new = all_numbers(arr_numbers, step)
+
+    if not arr_new:
+        return None
+
+    new_program = zxn_program.Program(program.autostart)
+    for i_line, l_number in enumerate(program.numbers):
+        new_number = arr_new.get(l_number, l_number)
+        b_line = program.line(i_line)
+        arr_refs = find_bin_references(b_line)
+        if arr_refs:
+            arr_line = []
+            i_pos = 0
+            for i_digits, i_number, old_number in arr_refs:
+                if old_number is None:
+                    str_msg = _('Computed line number not renumbered: {0}')
+                    LOGGER.warning(str_msg.format(l_number))
+                elif old_number in program:
+                    ref_number = arr_new.get(old_number, old_number)
+                    arr_line.append(b_line[i_pos:i_digits])
+                    arr_line.append(str(ref_number).encode('ascii'))
+                    arr_line.append(b'\x0e\x00\x00')
+                    arr_line.append(ref_number.to_bytes(2, 'little'))
+                    arr_line.append(b'\x00')
+                    i_pos = i_number + 6
+                else:
+                    str_msg = _('Line not found!: {0} in line {1}({2})')
+                    LOGGER.error(
+                        str_msg.format(old_number, l_number, new_number))
+            arr_line.append(b_line[i_pos:])
+            b_line = b''.join(arr_line)
+
+        new_program.append(new_number, b_line)
+    new_program.variables = program.variables
+
+    new_data = bytearray(bindata[:128])
+    for b_chunk in new_program.iter_chunks():
+        new_data += b_chunk
+    i_prog = len(new_data) - 128 - len(new_program.variables)
+
+    # Header: lengths, autostart line and checksum
+    i_delta = len(new_data) - len(bindata)
+    i_len = int.from_bytes(bindata[11:15], 'little') + i_delta
+    new_data[11:15] = i_len.to_bytes(4, 'little')
+    i_len = int.from_bytes(bindata[16:18], 'little') + i_delta
+    new_data[16:18] = i_len.to_bytes(2, 'little')
+    new_data[20:22] = i_prog.to_bytes(2, 'little')
+    i_saddr = int.from_bytes(bindata[18:20], 'little')
+    if i_saddr in arr_new:
+        new_data[18:20] = arr_new[i_saddr].to_bytes(2, 'little')
+    new_data[127] = sum(new_data[:127]) % 256
+
+    return bytes(new_data)
+
+
+def find_bin_references(b_line):
+    """
+        Finds the line numbers after GO TO, GO SUB, RESTORE, RUN, LIST,
+        LLIST and SAVE ... LINE in a tokenized BASIC line, as
+        find_references does with text. Returns the position of the digits
+        of each one, the position of its 5-byte number and its value (None
+        if the line number is an expression)
+    """
+
+    arr_refs = []
+    if not RE_BIN_REFERENCE.search(b_line):
+        return arr_refs
+
+    n_len = len(b_line)
+    b_start = True  # At the start of a statement
+    b_dot = False  # In a dot command
+    b_quote = False  # In a quoted string
+    i_first = None  # First byte of statement
+    i_pos = 0
+    while i_pos < n_len:
+        i_char = b_line[i_pos]
+        i_pos += 1
+        if i_char == 0x0e:  # Skip number 5-bytes data
+            i_pos += 5
+            continue
+        if b_quote:
+            b_quote = i_char != 0x22
+            continue
+        if i_char == 0x3a:
+            b_start = True
+            b_dot = False
+            continue
+        if b_dot or i_char == 0x20:
+            continue
+        if i_char == 0x22:
+            b_quote = True
+        if b_start:
+            b_start = False
+            if i_char in (BIN_REM, 0x3b):
+                break  # Comment until the end of the line
+            if i_char == 0x2e:
+                b_dot = True  # Dot command until next statement
+                continue
+            i_first = i_char
+        if i_char in (BIN_THEN, BIN_ELSE):
+            b_start = True
+            continue
+
+        if i_char in BIN_REF_TOKENS or (i_char == BIN_LINE
+                                        and i_first == BIN_SAVE):
+            i_digits = i_pos
+            while i_digits < n_len and b_line[i_digits] == 0x20:
+                i_digits += 1
+            i_number = i_digits
+            while i_number < n_len and 0x30 <= b_line[i_number] <= 0x39:
+                i_number += 1
+            i_next = i_number + 6
+            while i_next < n_len and b_line[i_next] == 0x20:
+                i_next += 1
+
+            if i_digits >= n_len or b_line[i_digits] in BIN_END or (
+                    i_char == BIN_RUN and b_line[i_digits] == BIN_AT):
+                continue  # No line number (e.g. RUN, RESTORE, RUN AT)
+            if i_number > i_digits and b_line[i_number:i_number + 1] == (
+                    b'\x0e') and (i_next >= n_len
+                                  or b_line[i_next] in BIN_END):
+                b_number = b_line[i_number + 1:i_number + 6]
+                if b_number[:2] == b'\x00\x00' and b_number[4] == 0:
+                    old_number = int.from_bytes(b_number[2:4], 'little')
+                else:
+                    old_number = int(b_line[i_digits:i_number])
+                arr_refs.append((i_digits, i_number, old_number))
+                i_pos = i_number + 6
+            else:
+                arr_refs.append((i_digits, i_digits, None))
+
+    return arr_refs
+
+
 def parse_args():
     """Command Line Parser"""
+
+    import argparse
+
     str_hlp_input = _('Input text file with BASIC code')
     str_hlp_output = _('Output file path')
     str_hlp_steps = _('Line number step size')
+    str_hlp_batch = _('Directories or glob patterns to renumber')
+    str_hlp_jobs = _('Number of parallel jobs for batch mode')
+    str_hlp_range = _('Renumber only lines from FIRST to LAST')
+    str_hlp_start = _('First line number for --range')
+    str_hlp_room = _('Make room for COUNT new lines after LINE')
 
     parser = argparse.ArgumentParser(description='NextBASIC TXT Renumber')
     parser.add_argument('-v',
@@ -217,7 +803,7 @@ def parse_args():
                         version='%(prog)s {}'.format(__MY_VERSION__))
     parser.add_argument('-i',
                         '--input',
-                        required=True,
+                        required=False,
                         action='store',
                         dest='input_path',
                         help=str_hlp_input)
@@ -236,9 +822,44 @@ def parse_args():
                         action='store_true',
                         dest='decode_binary',
                         help='Decode binary BASIC data to `x codes')
+    parser.add_argument('-r',
+                        '--range',
+                        action='store',
+                        dest='range',
+                        metavar='FIRST,LAST',
+                        help=str_hlp_range)
+    parser.add_argument('--start',
+                        action='store',
+                        type=int,
+                        dest='start',
+                        help=str_hlp_start)
+    parser.add_argument('-m',
+                        '--make-room',
+                        action='store',
+                        dest='room',
+                        metavar='LINE[,COUNT]',
+                        help=str_hlp_room)
+    parser.add_argument('--batch',
+                        action='store',
+                        nargs='+',
+                        dest='batch',
+                        help=str_hlp_batch)
+    parser.add_argument('-j',
+                        '--jobs',
+                        action='store',
+                        type=int,
+                        dest='jobs',
+                        help=str_hlp_jobs)
 
     arguments = parser.parse_args()
 
+    if not arguments.input_path and not arguments.batch:
+        parser.error(_('An input file is required'))
+    if arguments.range and arguments.room:
+        parser.error(_('--range and --make-room cannot be used together'))
+    if arguments.start is not None and not arguments.range:
+        parser.error(_('--start needs --range'))
+
     values = {}
 
     i_path = None
@@ -253,7 +874,7 @@ def parse_args():
     if arguments.step:
         step = int(arguments.step)
 
-    if not i_path.exists():
+    if i_path and not i_path.exists():
         str_msg = _('Path not found: {0}')
         LOGGER.error(str_msg.format(i_path))
         str_msg = _('Input path does not exist!')
@@ -263,33 +884,64 @@ def parse_args():
     if arguments.decode_binary:
         b_decode = True
 
+    arr_range = None
+    if arguments.range:
+        try:
+            first, last = [int(x) for x in arguments.range.split(',')]
+        except ValueError:
+            parser.error(_('Invalid range: {0}').format(arguments.range))
+        arr_range = (first, last, arguments.start)
+
+    arr_room = None
+    if arguments.room:
+        try:
+            arr_room = [int(x) for x in arguments.room.split(',')]
+        except ValueError:
+            arr_room = []
+        if len(arr_room) == 1:
+            arr_room.append(1)
+        if len(arr_room) != 2 or arr_room[1] < 1:
+            parser.error(_('Invalid line: {0}').format(arguments.room))
+        arr_room = tuple(arr_room)
+
     values['input'] = i_path
     values['output'] = o_path
     values['step'] = step
     values['decode'] = b_decode
+    values['range'] = arr_range
+    values['room'] = arr_room
+    values['batch'] = arguments.batch or []
+    values['jobs'] = arguments.jobs
 
     return values
 
 
-CHARS = {
-    0x60: '£',
-    0x7f: '©',
-    0x81: '\u259D',  # Quadrant upper right
-    0x82: '\u2598',  # Quadrant upper left
-    0x83: '\u2580',  # Upper half block
-    0x84: '\u2597',  # Quadrant lower right
-    0x85: '\u2590',  # Right half block
-    0x86: '\u259A',  # Quadrant upper left and lower right
-    0x87: '\u259C',  # Quadrant upper left and upper right and lower right
-    0x88: '\u2596',  # Quadrant lower left
-    0x89: '\u259E',  # Quadrant upper right and lower left
-    0x8a: '\u258C',  # Left half block
-    0x8b: '\u259B',  # Quadrant upper left and upper right and lower left
-    0x8c: '\u2584',  # Lower half block
-    0x8d: '\u259F',  # Quadrant upper right and lower left and lower right
-    0x8e: '\u2599',  # Quadrant upper left and lower left and lower right
-    0x8f: '\u2588'  # Full block
-}
+MAX_LINE = 9999
+
+RE_LINENUMBER = re.compile('(\\s*\\d+)\\s*(.*)')
+RE_AUTOSTART = re.compile('(#autostart\\s+)(\\d+)(.*)')
+# Quoted strings, GO TO and GO SUB, words in uppercase, numbers, statement
+# separators, dots and semicolons (for dot commands and comments), and runs
+# of any other chars
+RE_TOKENS = re.compile('"[^"]*"?|GO\\s+TO|GO\\s+SUB|[A-Z$]+'
+                       '|[0-9]+(?:\\.[0-9]*)?|[:.;]|[^\\s":.;A-Z$0-9]+')
+RE_REFERENCE = re.compile('GO\\s+TO|GO\\s+SUB|RESTORE|RUN|LIST|LINE')
+RE_SPACES = re.compile('\\s+')
+
+# Keywords followed by a line number
+REF_KEYWORDS = ('GO TO', 'GO SUB', 'RESTORE', 'RUN', 'LIST', 'LLIST')
+
+# Tokens, for binary renumbering
+BIN_REF_TOKENS = (0xec, 0xed, 0xe5, 0xf7, 0xf0, 0xe1)  # GO TO, GO SUB, etc.
+BIN_LINE = 0xca
+BIN_SAVE = 0xf8
+BIN_RUN = 0xf7
+BIN_AT = 0xac
+BIN_REM = 0xea
+BIN_THEN = 0xcb
+BIN_ELSE = 0x98
+BIN_END = (0x3a, 0x98, 0x0d)  # End of statement: ':', ELSE or end of line
+RE_BIN_REFERENCE = re.compile(b'[\xe1\xe5\xec\xed\xf0\xf7\xca]')
 
 if __name__ == '__main__':
     main()
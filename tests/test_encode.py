@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Tests for txt2nextbasic.py encoding
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Run with: python3 -m unittest discover tests (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nextbasic2txt  # noqa: E402
+import txt2nextbasic  # noqa: E402
+
+
+def round_trip(str_line):
+    """Text of a line after encoding and decoding it"""
+
+    b_line = txt2nextbasic.encode([str_line])[132:]
+    return nextbasic2txt.decode_line(int(str_line.split()[0]), b_line)
+
+
+class TestNumberList(unittest.TestCase):
+    """Statements that are lists of numbers (e.g. DATA)"""
+    def test_list(self):
+        self.assertEqual(round_trip('10 DATA 1,-2,1.5,.5,2.,65536'),
+                         '  10 DATA 1,-2,1.5,.5,2.,65536\r\n')
+
+    def test_not_a_list(self):
+        # Long lists followed by something else (these took exponential
+        # time to be found not to be lists)
+        str_numbers = ','.join(str(i_num * 111) for i_num in range(1, 41))
+        for str_line in ('10 DATA {0},"END"', '10 DATA {0}+a',
+                         '10 DATA {0},'):
+            str_line = str_line.format(str_numbers)
+            self.assertEqual(round_trip(str_line), '  ' + str_line + '\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
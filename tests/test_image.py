@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Tests for zxn_image.py writing (FatImage.put_files)
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Run with: python3 -m unittest discover tests (or pytest)
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zxn_image  # noqa: E402
+
+
+def make_image(i_path, fat_type, n_free=None, root_entries=512):
+    """
+        Creates an empty FAT16 or FAT32 image (512 byte sectors and
+        clusters, two FATs) with a /devel directory. If n_free is given,
+        the clusters after the first n_free free ones are marked as bad
+    """
+
+    i_sector = 512
+    if fat_type == 16:
+        n_clusters = 4200
+        i_reserved = 1
+        i_entry = 2
+        arr_used = [0xfff8, 0xffff, 0xffff]  # Media, reserved, /devel
+        bad = 0xfff7
+    else:
+        n_clusters = 66000
+        i_reserved = 32
+        root_entries = 0
+        i_entry = 4
+        arr_used = [0x0ffffff8, 0x0fffffff, 0x0fffffff, 0x0fffffff]
+        bad = 0x0ffffff7
+
+    fat_sectors = ((n_clusters + 2) * i_entry + i_sector - 1) // i_sector
+    root_sectors = root_entries * 32 // i_sector
+    data_sector = i_reserved + 2 * fat_sectors + root_sectors
+    n_sectors = data_sector + n_clusters
+
+    b_boot = bytearray(i_sector)
+    b_boot[0:3] = b'\xeb\x3c\x90'
+    b_boot[3:11] = b'TESTIMG '
+    b_boot[11:13] = i_sector.to_bytes(2, 'little')
+    b_boot[13] = 1  # Sectors per cluster
+    b_boot[14:16] = i_reserved.to_bytes(2, 'little')
+    b_boot[16] = 2  # FATs
+    b_boot[17:19] = root_entries.to_bytes(2, 'little')
+    b_boot[21] = 0xf8
+    b_boot[32:36] = n_sectors.to_bytes(4, 'little')
+    if fat_type == 16:
+        b_boot[22:24] = fat_sectors.to_bytes(2, 'little')
+    else:
+        b_boot[36:40] = fat_sectors.to_bytes(4, 'little')
+        b_boot[44:48] = (2).to_bytes(4, 'little')  # Root directory cluster
+        b_boot[48:50] = (1).to_bytes(2, 'little')  # FSInfo sector
+    b_boot[510:512] = b'\x55\xaa'
+
+    arr_fat = arr_used + [0] * (n_clusters + 2 - len(arr_used))
+    if n_free is not None:
+        for cluster in range(len(arr_used) + n_free, n_clusters + 2):
+            arr_fat[cluster] = bad
+    b_fat = b''.join(value.to_bytes(i_entry, 'little') for value in arr_fat)
+
+    # Root directory (FAT16 fixed area, FAT32 cluster 2) and /devel
+    devel = len(arr_used) - 1
+    b_root = b'DEVEL      \x10' + bytes(14) + devel.to_bytes(
+        2, 'little') + bytes(4)
+    b_devel = (b'.          \x10' + bytes(14) + devel.to_bytes(2, 'little') +
+               bytes(4) + b'..         \x10' + bytes(20))
+    if fat_type == 32:
+        b_root = (b_root[:20] + (devel >> 16).to_bytes(2, 'little') +
+                  b_root[22:])
+        i_root = data_sector * i_sector
+    else:
+        i_root = (i_reserved + 2 * fat_sectors) * i_sector
+    i_devel = (data_sector + devel - 2) * i_sector
+
+    with open(i_path, 'wb') as f:
+        f.truncate(n_sectors * i_sector)
+        f.write(b_boot)
+        if fat_type == 32:
+            f.seek(i_sector)
+            f.write(b'RRaA' + bytes(480) + b'rrAa' + b'\xff' * 8 + bytes(14) +
+                    b'\x55\xaa')
+        for n_fat in range(2):
+            f.seek((i_reserved + n_fat * fat_sectors) * i_sector)
+            f.write(b_fat[:fat_sectors * i_sector])
+        f.seek(i_root)
+        f.write(b_root)
+        f.seek(i_devel)
+        f.write(b_devel)
+
+
+def file_hash(i_path):
+    with open(i_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ImageTestCase(object):
+    """Tests for each FAT type (FAT_TYPE is set by the subclasses)"""
+
+    FAT_TYPE = None
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'test.img')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make(self, **kwargs):
+        make_image(self.path, self.FAT_TYPE, **kwargs)
+
+    def put(self, arr_files):
+        with zxn_image.FatImage(self.path, b_write=True) as fat_image:
+            return fat_image.put_files(arr_files)
+
+    def read(self, str_path):
+        with zxn_image.FatImage(self.path) as fat_image:
+            fat_entry = fat_image.find(str_path)
+            self.assertIsNotNone(fat_entry, str_path)
+            return bytes(fat_image.read(fat_entry))  # Can be a memoryview
+
+    def names(self, str_dir):
+        with zxn_image.FatImage(self.path) as fat_image:
+            return [
+                fat_entry.path.rsplit('/', 1)[1]
+                for fat_entry in fat_image.listdir(fat_image.find(str_dir))
+            ]
+
+    def free(self):
+        with zxn_image.FatImage(self.path) as fat_image:
+            return fat_image.count_free()
+
+    def test_put(self):
+        self.make()
+        n_free = self.free()
+        data = bytes(range(256)) * 6  # 3 clusters
+        arr_written = self.put([('/devel/PROG.BAS', data),
+                                ('/ROOT.TXT', b'root')])
+
+        # Paths use the names of the directories found in the image
+        self.assertEqual(sorted(arr_written),
+                         ['/DEVEL/PROG.BAS', '/ROOT.TXT'])
+        self.assertEqual(self.read('/devel/prog.bas'), data)
+        self.assertEqual(self.read('/ROOT.TXT'), b'root')
+        self.assertEqual(self.names('/devel'), ['PROG.BAS'])
+        self.assertEqual(self.free(), n_free - 4)
+        with zxn_image.FatImage(self.path) as fat_image:
+            self.assertEqual(fat_image.fat_type, self.FAT_TYPE)
+            # Both FATs are the same
+            i_start = fat_image.fat_offset
+            i_size = fat_image.fat_size
+            self.assertEqual(fat_image.map[i_start:i_start + i_size],
+                             fat_image.map[i_start + i_size:i_start +
+                                           2 * i_size])
+
+    def test_overwrite(self):
+        self.make()
+        n_free = self.free()
+        self.put([('/devel/PROG.BAS', b'a' * 3000)])
+        self.assertEqual(self.free(), n_free - 6)
+
+        self.assertEqual(self.put([('/devel/prog.bas', b'b' * 700)]),
+                         ['/DEVEL/prog.bas'])
+        self.assertEqual(self.read('/devel/PROG.BAS'), b'b' * 700)
+        self.assertEqual(self.names('/devel'), ['PROG.BAS'])
+        self.assertEqual(self.free(), n_free - 2)
+
+    def test_second_put_writes_nothing(self):
+        self.make()
+        arr_files = [('/devel/PROG.BAS', b'x' * 1000),
+                     ('/devel/A long name.txt', b'long')]
+        self.assertEqual(len(self.put(arr_files)), 2)
+        str_hash = file_hash(self.path)
+
+        self.assertEqual(self.put(arr_files), [])
+        self.assertEqual(file_hash(self.path), str_hash)
+
+    def test_long_names(self):
+        self.make()
+        arr_names = [
+            'A long file name.txt', 'A long file name 2.txt', 'lower.bas',
+            'Name with many characters, more than 26.bas'
+        ]
+        self.put([('/devel/' + str_name, str_name.encode('ascii'))
+                  for str_name in arr_names])
+
+        self.assertEqual(sorted(self.names('/devel')), sorted(arr_names))
+        for str_name in arr_names:
+            self.assertEqual(self.read('/devel/' + str_name.upper()),
+                             str_name.encode('ascii'))
+
+        with zxn_image.FatImage(self.path) as fat_image:
+            arr_short = [
+                zxn_image.short_name(fat_image.map[fat_entry.offset:
+                                                   fat_entry.offset + 32])
+                for fat_entry in fat_image.listdir(fat_image.find('/devel'))
+            ]
+        self.assertEqual(len(set(arr_short)), len(arr_names))
+        self.assertIn('ALONGF~1.TXT', arr_short)
+        self.assertIn('ALONGF~2.TXT', arr_short)
+        self.assertIn('LOWER.BAS', arr_short)
+
+    def test_grow_directory(self):
+        self.make()
+        # 16 entries per cluster: ., .. and 30 files with long names
+        arr_files = [('/devel/File number {0}.bas'.format(i_file),
+                      bytes([i_file]) * 10) for i_file in range(30)]
+        self.put(arr_files)
+
+        with zxn_image.FatImage(self.path) as fat_image:
+            devel = fat_image.find('/devel')
+            self.assertGreater(len(fat_image.chain(devel.cluster)), 2)
+        self.assertEqual(len(self.names('/devel')), 30)
+        for str_path, data in arr_files:
+            self.assertEqual(self.read(str_path), data)
+
+    def test_disk_full(self):
+        self.make(n_free=2)
+        str_hash = file_hash(self.path)
+        with self.assertRaises(RuntimeError):
+            self.put([('/devel/PROG.BAS', b'x' * 1500)])  # 3 clusters
+        self.assertEqual(file_hash(self.path), str_hash)
+
+        # A cluster is kept for the directory, in case it has to grow
+        self.assertEqual(self.put([('/devel/PROG.BAS', b'x' * 500)]),
+                         ['/DEVEL/PROG.BAS'])
+        self.assertEqual(self.free(), 1)
+
+    def test_missing_directory(self):
+        self.make()
+        str_hash = file_hash(self.path)
+        with self.assertRaises(RuntimeError):
+            self.put([('/devel/OK.BAS', b'ok'), ('/nothere/PROG.BAS', b'x')])
+        self.assertEqual(file_hash(self.path), str_hash)
+
+
+class TestFat16(ImageTestCase, unittest.TestCase):
+    FAT_TYPE = 16
+
+    def test_root_full(self):
+        self.make(root_entries=16)  # DEVEL and 15 free entries
+        str_hash = file_hash(self.path)
+        # 3 entries each (two long name entries and the short one)
+        arr_files = [('/Root file number {0}.txt'.format(i_file), b'x')
+                     for i_file in range(6)]
+        with self.assertRaises(RuntimeError):
+            self.put(arr_files)
+        self.assertEqual(file_hash(self.path), str_hash)
+
+        self.assertEqual(len(self.put(arr_files[:5])), 5)
+
+
+class TestFat32(ImageTestCase, unittest.TestCase):
+    FAT_TYPE = 32
+
+    def test_fsinfo(self):
+        self.make()
+        self.put([('/devel/PROG.BAS', b'x')])
+        with open(self.path, 'rb') as f:
+            f.seek(512 + 488)
+            self.assertEqual(f.read(8), b'\xff' * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
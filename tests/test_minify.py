@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Tests for txt2nextbasic.py --minify (Minifier)
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Run with: python3 -m unittest discover tests (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import txt2nextbasic  # noqa: E402
+
+
+class TestMinify(unittest.TestCase):
+    """A minified program, compared with the same program written short"""
+    def test_program(self):
+        minifier = txt2nextbasic.Minifier(PROGRAM)
+        data, load_addr, name = txt2nextbasic.encode_lines(
+            PROGRAM, line_index=minifier)
+        expected = txt2nextbasic.encode_lines(MINIFIED)[0]
+
+        self.assertEqual(data, expected)
+        self.assertEqual(load_addr, 10)
+        self.assertEqual(name, 'mintest')
+        self.assertEqual(minifier.names, {'count': 'a'})
+        self.assertEqual(minifier.targets, {10, 60, 200})
+        self.assertEqual(sum(minifier.saved.values()),
+                         len(txt2nextbasic.encode_lines(PROGRAM)[0]) -
+                         len(data))
+
+    def test_no_rename_with_val(self):
+        lines = ['10 LET total=1: PRINT VAL "total"']
+        minifier = txt2nextbasic.Minifier(lines)
+        self.assertEqual(minifier.names, {})
+
+    def test_computed_jump_keeps_lines(self):
+        lines = ['10 GO TO 10*a', '20 REM x']
+        minifier = txt2nextbasic.Minifier(lines)
+        data = txt2nextbasic.encode_lines(lines, line_index=minifier)[0]
+        self.assertEqual(data,
+                         txt2nextbasic.encode_lines(['10 GO TO 10*a',
+                                                     '20 REM'])[0])
+
+
+PROGRAM = [
+    '#program mintest\n',
+    '#autostart\n',
+    '10 REM Start: target of #autostart\n',
+    '20 LET count = 10 : LET Count=Count+1 : REM add one\n',
+    '30 ; just a comment\n',
+    '40 LET s=BIN 1010: LET t=BIN 10101010: PRINT #4;s\n',
+    '50 PRINT "a  b" ::  : GO TO 60\n',
+    '60 REM target of GO TO\n',
+    '70 IF count>1 THEN REM total is not a variable here\n',
+    '80 LET total=count*2: .mycmd total\n',
+    '90 IF total THEN PRINT 1 ELSE ; nothing\n',
+    '100 GO SUB 200: STOP\n',
+    '200 RETURN\n',
+]
+
+# Same program, as it should be after minifying (total is found in a dot
+# command, so it isn't changed)
+MINIFIED = [
+    '#program mintest\n',
+    '#autostart\n',
+    '10 REM\n',
+    '20 LET a=%10:LET a=a+VAL "1"\n',
+    '40 LET s=BIN 1010:LET t=BIN 10101010:PRINT #4;s\n',
+    '50 PRINT "a  b":GO TO 60\n',
+    '60 REM\n',
+    '70 IF a>VAL "1" THEN REM\n',
+    '80 LET total=a*VAL "2":.mycmd total\n',
+    '90 IF total THEN PRINT %1 ELSE REM\n',
+    '100 GO SUB 200:STOP\n',
+    '200 RETURN\n',
+]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Tests for zxn_program.py
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Run with: python3 -m unittest discover tests (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import txt2nextbasic  # noqa: E402
+import zxn_program  # noqa: E402
+
+
+def with_variables(bindata, b_vars):
+    """Adds variables to a +3DOS file, updating the lengths in the header"""
+
+    arr_bytes = bytearray(bindata + b_vars)
+    arr_bytes[11:15] = len(arr_bytes).to_bytes(4, 'little')
+    arr_bytes[16:18] = (len(arr_bytes) - 128).to_bytes(2, 'little')
+
+    return bytes(arr_bytes)
+
+
+class TestFromBytes(unittest.TestCase):
+    """Reading +3DOS files with Program.from_bytes()"""
+    def setUp(self):
+        self.bindata = txt2nextbasic.encode(PROGRAM)
+
+    def test_read(self):
+        program = zxn_program.Program.from_bytes(self.bindata)
+        self.assertEqual(list(program.numbers), [10, 20, 30])
+        self.assertEqual(program.autostart, 10)
+        self.assertEqual(program.variables, b'')
+        self.assertEqual(program.to_bytes(), self.bindata[128:])
+
+    def test_padding(self):
+        # Files read from a disk image can be padded to the sector size
+        for b_padding in (bytes(512), b'\x1a' * 100, b'\x00\x28\x05\x00'):
+            program = zxn_program.Program.from_bytes(self.bindata + b_padding)
+            self.assertEqual(program.variables, b'')
+            self.assertEqual(program.to_bytes(), self.bindata[128:])
+
+    def test_variables(self):
+        b_vars = b'\x61\x00\x00\x01\x00\x00\x80'  # a=1
+        bindata = with_variables(self.bindata, b_vars)
+        program = zxn_program.Program.from_bytes(bindata + bytes(128))
+        self.assertEqual(list(program.numbers), [10, 20, 30])
+        self.assertEqual(program.variables, b_vars)
+        self.assertEqual(program.to_bytes(), bindata[128:])
+
+    def test_line_cut_short(self):
+        # Length of the last line goes past the end of the program
+        bindata = bytearray(self.bindata)
+        bindata[-4:-2] = (1000).to_bytes(2, 'little')
+        bindata = bytes(bindata)
+        program = zxn_program.Program.from_bytes(bindata)
+        self.assertEqual(list(program.numbers), [10, 20])
+        self.assertEqual(program.to_bytes(), bindata[128:])
+
+    def test_no_header(self):
+        program = zxn_program.Program.from_bytes(self.bindata[128:])
+        self.assertEqual(list(program.numbers), [10, 20, 30])
+        self.assertEqual(program.to_bytes(), self.bindata[128:])
+
+
+PROGRAM = ['#autostart 10', '10 PRINT "HELLO"', '20 GO TO 10', '30 STOP']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Tests for rennextbasic.py
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Run with: python3 -m unittest discover tests (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rennextbasic  # noqa: E402
+import txt2nextbasic  # noqa: E402
+
+
+class TestReferences(unittest.TestCase):
+    """Line numbers found by find_references()"""
+    def test_references(self):
+        for str_text, arr_expected in REFERENCES:
+            arr_refs = rennextbasic.find_references(str_text)
+            self.assertEqual([ref[2] for ref in arr_refs], arr_expected,
+                             str_text)
+            for i_start, i_end, l_number in arr_refs:
+                if l_number is not None:
+                    self.assertEqual(str_text[i_start:i_end], str(l_number))
+
+
+class TestRenumber(unittest.TestCase):
+    """Whole program renumbering"""
+    def test_renumber(self):
+        self.assertEqual(rennextbasic.renumber(PROGRAM), RENUMBERED)
+
+    def test_step(self):
+        arr_lines = rennextbasic.renumber(['1 GO TO 2', '2 GO TO 1'], 5)
+        self.assertEqual(arr_lines, ['   5 GO TO 10\r\n', '  10 GO TO 5\r\n'])
+
+    def test_already_numbered(self):
+        arr_lines = ['  10 GO TO 20\r\n', '  20 GO TO 10\r\n']
+        self.assertEqual(rennextbasic.renumber(arr_lines), arr_lines)
+
+
+class TestRange(unittest.TestCase):
+    """Renumbering only some lines, and making room for new ones"""
+    def test_range(self):
+        self.assertEqual(rennextbasic.renumber(JUMPS, 1, 30, 32, 33), [
+            '10 GO TO 34\r\n', '20 PRINT\r\n', '33 GO TO 35\r\n',
+            '34 STOP\r\n', '35 GO TO 40\r\n', '40 GO TO 33\r\n'
+        ])
+
+    def test_range_numbers(self):
+        self.assertEqual(
+            rennextbasic.range_numbers(NUMBERS, 2, 30, 32, 33), {
+                30: 33,
+                31: 35,
+                32: 37
+            })
+        self.assertEqual(rennextbasic.range_numbers(NUMBERS, 1, 30, 32),
+                         {})  # Already numbered like that
+
+    def test_range_overlaps(self):
+        for step, first, last, start in ((10, 30, 32, 100), (10, 30, 32, 33),
+                                         (1, 30, 32, 20), (10, 33, 39, 33)):
+            with self.assertRaises(ValueError):
+                rennextbasic.range_numbers(NUMBERS, step, first, last, start)
+        with self.assertRaises(ValueError):
+            rennextbasic.renumber(JUMPS, 10, 30, 32, 100)
+
+    def test_room(self):
+        # Lines moved forwards or backwards, whatever moves fewer lines
+        self.assertEqual(rennextbasic.room_numbers(NUMBERS, 30), {30: 29})
+        self.assertEqual(rennextbasic.room_numbers(NUMBERS, 30, 3), {30: 27})
+        self.assertEqual(rennextbasic.room_numbers([10, 11, 12, 20], 10),
+                         {10: 9})
+        self.assertEqual(rennextbasic.room_numbers([10, 11, 12, 13, 20], 12),
+                         {13: 14})
+        self.assertEqual(rennextbasic.room_numbers(NUMBERS, 40), {})
+        self.assertEqual(rennextbasic.make_room(JUMPS, 30, 2), [
+            '10 GO TO 31\r\n', '20 PRINT\r\n', '28 GO TO 32\r\n',
+            '31 STOP\r\n', '32 GO TO 40\r\n', '40 GO TO 28\r\n'
+        ])
+
+    def test_no_room(self):
+        with self.assertRaises(ValueError):
+            rennextbasic.room_numbers([1, 2], 1, rennextbasic.MAX_LINE - 1)
+        with self.assertRaises(ValueError):
+            rennextbasic.room_numbers(NUMBERS, 35)  # Not a line
+
+
+class TestBinary(unittest.TestCase):
+    """Renumbering +3DOS files, compared with renumbering text"""
+    def test_bin_references(self):
+        for str_text, arr_expected in REFERENCES:
+            # The encoder only finds keywords with one space (e.g. GO SUB)
+            str_text = ' '.join(str_text.split())
+            b_line = txt2nextbasic.encode(['10 ' + str_text])[132:]
+            arr_refs = rennextbasic.find_bin_references(b_line)
+            self.assertEqual([ref[2] for ref in arr_refs], arr_expected,
+                             str_text)
+            for i_digits, i_number, l_number in arr_refs:
+                if l_number is not None:
+                    self.assertEqual(b_line[i_digits:i_number],
+                                     str(l_number).encode('ascii'))
+                    self.assertEqual(b_line[i_number], 0x0e)
+
+    def test_renumber_bin(self):
+        for arr_lines, arr_args in ((PROGRAM, ()), (PROGRAM, (5, )),
+                                    (JUMPS, ()), (JUMPS, (1, 30, 32, 33))):
+            self.assertEqual(
+                rennextbasic.renumber_bin(txt2nextbasic.encode(arr_lines),
+                                          *arr_args),
+                txt2nextbasic.encode(
+                    rennextbasic.renumber(arr_lines, *arr_args)))
+
+    def test_make_room_bin(self):
+        bindata = txt2nextbasic.encode(JUMPS)
+        self.assertEqual(
+            rennextbasic.renumber_binary(bindata, arr_room=(30, 2)),
+            txt2nextbasic.encode(rennextbasic.make_room(JUMPS, 30, 2)))
+
+    def test_not_changed(self):
+        bindata = txt2nextbasic.encode(RENUMBERED)
+        self.assertIsNone(rennextbasic.renumber_binary(bindata))
+        self.assertEqual(rennextbasic.renumber_bin(bindata), bindata)
+
+
+# Text of a line, and line numbers found (None if computed)
+REFERENCES = [
+    ('GO TO 15', [15]),
+    ('GO  SUB 30: RESTORE', [30]),
+    ('PRINT "GO TO 1": GO TO 2', [2]),
+    ('REM GO TO 3', []),
+    ('IF a THEN GO TO 4 ELSE GO TO 5', [4, 5]),
+    ('GO TO 10*a', [None]),
+    ('.cmd GO TO 7', []),
+    ('SAVE "x" LINE 10', [10]),
+    ('LOAD "x" LINE 10', []),
+    ('RUN AT 3: RUN', []),
+    ('RUN 20: LIST 40', [20, 40]),
+]
+
+PROGRAM = [
+    '#program t',
+    '#autostart 5',
+    '5 REM start',
+    '7 GO SUB 30: GO TO 15',
+    '15 RESTORE 40: IF a THEN GO TO 7 ELSE GO TO 30',
+    '16 PRINT "GO TO 7": REM GO TO 5',
+    '17 .cmd GO TO 15',
+    '20 SAVE "x" LINE 5: RUN 30: LIST 15',
+    '25 GO TO 10*a: RUN AT 3',
+    '30 RETURN',
+    '40 DATA 1',
+]
+
+# Only real references change (not strings, comments or dot commands)
+RENUMBERED = [
+    '#program t\r\n',
+    '#autostart 10\r\n',
+    '  10 REM start\r\n',
+    '  20 GO SUB 80: GO TO 30\r\n',
+    '  30 RESTORE 90: IF a THEN GO TO 20 ELSE GO TO 80\r\n',
+    '  40 PRINT "GO TO 7": REM GO TO 5\r\n',
+    '  50 .cmd GO TO 15\r\n',
+    '  60 SAVE "x" LINE 10: RUN 80: LIST 30\r\n',
+    '  70 GO TO 10*a: RUN AT 3\r\n',
+    '  80 RETURN\r\n',
+    '  90 DATA 1\r\n',
+]
+
+NUMBERS = [10, 20, 30, 31, 32, 40, 50]
+
+JUMPS = [
+    '10 GO TO 31', '20 PRINT', '30 GO TO 32', '31 STOP', '32 GO TO 40',
+    '40 GO TO 30'
+]
+
+if __name__ == '__main__':
+    unittest.main()
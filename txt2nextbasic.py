@@ -23,17 +23,18 @@ Text to NextBASIC File Converter for ZX Spectrum Next (+3e/ESXDOS compatible)
 
 import sys
 import os
-import argparse
 import logging
-import shlex
 import re
-import gettext
+import time
+import struct
 
 if sys.version_info > (3, 5):
     from pathlib import Path
 else:
     from pathlib2 import Path
 
+import zxn_codec  # Registers the zxnext codec
+
 __MY_NAME__ = 'txt2nextbasic.py'
 __MY_VERSION__ = '1.1.3'
 
@@ -43,18 +44,30 @@ LOG_FORMAT = logging.Formatter(
     '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
 LOG_STREAM = logging.StreamHandler(sys.stdout)
 LOG_STREAM.setFormatter(LOG_FORMAT)
-LOGGER.addHandler(LOG_STREAM)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
 
 path_locale = os.path.dirname(__file__)
 path_locale = os.path.join(path_locale, 'locale')
-gettext.bindtextdomain(__MY_NAME__, localedir=path_locale)
-gettext.textdomain(__MY_NAME__)
-_ = gettext.gettext
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
 
 
 def main():
     """Main Routine"""
 
+    LOGGER.addHandler(LOG_STREAM)
+
     # Check Python version
     arr_v = sys.version_info
     if arr_v[0] < 3 or (arr_v[0] == 3 and arr_v[1] < 6):
@@ -64,64 +77,518 @@ def main():
 
     arg_data = parse_args()
 
-    load_addr = 0x8000
+    if arg_data['output'] == STDIO or (not arg_data['output']
+                                       and arg_data['input'] == STDIO):
+        LOG_STREAM.stream = sys.stderr  # Keep stdout for the data
+
+    profiler = None
+    if arg_data['profile'] is not None:
+        profiler = Profiler(bool(arg_data['profile']))
+        profiler.start()
+
+    try:
+        if arg_data['batch']:
+            batch_main(arg_data)
+        else:
+            convert_main(arg_data)
+    finally:
+        if profiler:
+            profiler.stop()
+            profiler.log_summary()
+            if arg_data['profile']:
+                profiler.save(arg_data['profile'])
+
+
+def convert_main(arg_data):
+    """Converts one file (or stdin), as given in the command line"""
+
+    line_index = None
+    mapped = None
     if arg_data['is_binary']:
-        with open(arg_data['input'], 'rb') as f:
-            file_content = f.read()
+        if arg_data['input'] == STDIO:
+            file_content = sys.stdin.buffer.read()
+        else:
+            mapped = map_file(arg_data['input'])  # Not copied
+            file_content = mapped if mapped is not None else b''
+        dict_prog = {'load_addr': 0x8000}
+        it_content = [file_content]
     else:
-        if arg_data['input']:
+        if arg_data['input'] == STDIO:
+            code = sys.stdin  # Lines are read as they are needed
+        elif arg_data['input']:
             with open(arg_data['input'], 'r') as f:
                 code = f.readlines()
         else:
-            s_addr = arg_data['start_addr']
-            code = ['#autostart']
-            code += ['10 CLEAR {0}'.format(s_addr - 1)]
-            code += ['20 LOAD "{0}" CODE {1}'.format(arg_data['name'], s_addr)]
-            code += ['30 RANDOMIZE USR {0}'.format(s_addr)]
-
-        prev_line = -1
-        basic_data = []
-        for line in code:
-            line = line.strip()
-            arr_line = line.split(' ', -1)
-            if line:
-                # Comments and directives aren't parsed
-                if line[0] != '#':
-                    if load_addr == 0:  # Grab next line number for #autostart
-                        load_addr, _ = extract_linenumber(line)
-
-                    i_line, arr_line = proc_basic(line, arg_data['no_trim'],
-                                                  arg_data['remove_comments'])
-                    if i_line <= prev_line:
-                        str_msg = _('Wrong Line Number: {0}')
-                        LOGGER.error(str_msg.format(i_line))
-                        raise RuntimeError(str_msg.format(i_line))
-                    else:
-                        prev_line = i_line
-
-                    if arr_line:
-                        basic_data.append(arr_line)  # Parse BASIC
-                elif line.startswith('#program'):
-                    if not arg_data['output']:
-                        if len(arr_line) > 1:
-                            arg_data['output'] = arg_data['input'].with_name(
-                                arr_line[1] + '.bas')
-                elif line.startswith('#autostart'):
+            code = make_launcher(arg_data['name'], arg_data['start_addr'])
+
+        if not arg_data['output']:
+            if arg_data['input'] == STDIO:
+                arg_data['output'] = STDIO
+            else:
+                prog_name = get_program_name(code)
+                if prog_name is not None:
+                    arg_data['output'] = arg_data['input'].with_name(
+                        prog_name + '.bas')
+
+        if arg_data['minify']:
+            code = list(code)  # The whole program is needed first
+            line_index = Minifier(code)
+        elif arg_data['incremental'] and arg_data['output'] != STDIO:
+            line_index = LineIndex(arg_data['no_trim'],
+                                   arg_data['remove_comments'])
+            line_index.load(arg_data['output'])
+
+        jobs = 1
+        if arg_data['input'] != STDIO and arg_data['profile'] is None and (
+                not arg_data['minify']):
+            jobs = arg_data['jobs']  # Big files are encoded in parallel
+
+        dict_prog = {}
+        it_content = iter_encode_lines(code, arg_data['no_trim'],
+                                       arg_data['remove_comments'],
+                                       line_index, dict_prog, jobs)
+
+    # Save bytes to file, while converting
+    try:
+        if arg_data['output'] == STDIO:
+            write_plus3dos(sys.stdout.buffer, it_content, dict_prog)
+            sys.stdout.buffer.flush()
+        else:
+            try:
+                with open(arg_data['output'], 'wb') as f:
+                    write_plus3dos(f, it_content, dict_prog)
+            except Exception:
+                if arg_data['output'].exists():
+                    arg_data['output'].unlink()  # Don't leave half a file
+                raise
+
+            if isinstance(line_index, LineIndex):
+                line_index.save(arg_data['output'])
+        if isinstance(line_index, Minifier):
+            line_index.log_saved(arg_data['output'])
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def batch_main(arg_data):
+    """Batch mode: converts all files found, in parallel"""
+
+    import zxn_batch
+    zxn_batch.LOGGER.addHandler(LOG_STREAM)
+
+    arr_exclude = ['build']
+    if arg_data['output']:
+        arr_exclude.append(arg_data['output'].name)
+    arr_files = zxn_batch.find_files(arg_data['batch'],
+                                     arr_exclude=arr_exclude)
+
+    arr_jobs = []
+    for i_path, rel_path in arr_files:
+        if arg_data['output']:
+            o_path = arg_data['output'] / rel_path
+        else:
+            o_path = i_path.parent / 'build' / i_path.name
+        arr_jobs.append((i_path, o_path, arg_data['is_binary'],
+                         arg_data['no_trim'], arg_data['remove_comments'],
+                         arg_data['incremental'], arg_data['minify']))
+
+    jobs = arg_data['jobs']
+    if arg_data['profile'] is not None:
+        jobs = 1  # Profile all the conversions, in this process
+    arr_results, elapsed = zxn_batch.run(convert_file, arr_jobs, jobs)
+    if zxn_batch.report(arr_files, arr_results, elapsed):
+        sys.exit(1)
+
+
+def convert_file(arr_job):
+    """
+        Batch worker: converts one file as main() does, and returns the
+        number of lines and bytes read
+    """
+
+    (i_path, o_path, is_binary, no_trim, remove_comments, incremental,
+     minify) = arr_job
+
+    n_lines = 0
+    load_addr = 0x8000
+    line_index = None
+    mapped = None
+    if is_binary:
+        mapped = map_file(i_path)
+        file_content = mapped if mapped is not None else b''
+    else:
+        with open(i_path, 'r') as f:
+            code = f.readlines()
+        n_lines = len(code)
+        if minify:
+            line_index = Minifier(code)
+        elif incremental:
+            line_index = LineIndex(no_trim, remove_comments)
+            line_index.load(o_path)
+        file_content, load_addr, prog_name = encode_lines(
+            code, no_trim, remove_comments, line_index)
+
+    file_obj = Plus3DosFile(0, file_content, load_addr)
+    o_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(o_path, 'wb') as f:
+            file_obj.write(f)
+    finally:
+        if mapped is not None:
+            mapped.close()
+    if isinstance(line_index, LineIndex):
+        line_index.save(o_path)
+    elif line_index is not None:
+        line_index.log_saved(o_path)
+
+    return n_lines, os.path.getsize(i_path)
+
+
+# API
+# ---
+
+
+def encode(lines, no_trim=False, remove_comments=None):
+    """
+        Converts BASIC text lines (with directives) to a complete +3DOS file,
+        returned as bytes
+    """
+
+    file_content, load_addr, _prog_name = encode_lines(lines, no_trim,
+                                                       remove_comments)
+    file_obj = Plus3DosFile(0, file_content, load_addr)
+    return file_obj.make_bin()
+
+
+def encode_lines(lines,
+                 no_trim=False,
+                 remove_comments=None,
+                 line_index=None,
+                 jobs=1):
+    """
+        Converts BASIC text lines (with directives) to tokenized BASIC data.
+        Returns the data as bytes, the autostart line (or 0x8000 if none)
+        and the name in the first #program directive (or None).
+        With a LineIndex, lines already encoded before are not encoded again.
+        With a Minifier as line_index, the program is made smaller.
+        With jobs other than 1 (None for all the CPU cores), big programs
+        are encoded in parallel (see iter_encode_parallel())
+    """
+
+    dict_prog = {}
+    basic_data = b''.join(
+        iter_encode_lines(lines, no_trim, remove_comments, line_index,
+                          dict_prog, jobs))
+
+    return basic_data, dict_prog['load_addr'], dict_prog['name']
+
+
+def encode_program(lines, no_trim=False, remove_comments=None, jobs=1):
+    """
+        Same as encode_lines(), but the result is a zxn_program.Program (with
+        the autostart line), where lines can be found, changed or decoded
+        again one by one. It can be saved with
+        write_plus3dos(f, program.iter_chunks(), {'load_addr': ...})
+    """
+
+    import zxn_program
+
+    dict_prog = {}
+    program = zxn_program.Program()
+    for b_line in iter_encode_lines(lines, no_trim, remove_comments, None,
+                                    dict_prog, jobs):
+        view = memoryview(b_line)
+        i_pos = 0
+        while i_pos < len(view):  # Parallel encoding gives several lines
+            l_length = int.from_bytes(view[i_pos + 2:i_pos + 4], 'little')
+            program.append(int.from_bytes(view[i_pos:i_pos + 2], 'big'),
+                           view[i_pos + 4:i_pos + 4 + l_length])
+            i_pos += 4 + l_length
+    program.autostart = dict_prog['load_addr']
+
+    return program
+
+
+def iter_encode_lines(lines,
+                      no_trim=False,
+                      remove_comments=None,
+                      line_index=None,
+                      dict_prog=None,
+                      jobs=1):
+    """
+        Same as encode_lines(), but yields the tokenized data of each line
+        as soon as it is converted, so lines can be read from a stream.
+        If dict_prog is given, 'load_addr' and 'name' are updated there
+    """
+
+    if remove_comments is None:
+        remove_comments = []
+    if dict_prog is None:
+        dict_prog = {}
+
+    if jobs != 1 and line_index is None and isinstance(lines, list):
+        yield from iter_encode_parallel(lines, no_trim, remove_comments,
+                                        dict_prog, jobs)
+        return
+
+    dict_prog['load_addr'] = 0x8000
+    dict_prog['name'] = None
+    prev_line = -1
+    for line in lines:
+        line = line.strip()
+        arr_line = line.split(' ', -1)
+        if line:
+            # Comments and directives aren't parsed
+            if line[0] != '#':
+                if dict_prog['load_addr'] == 0:  # Next line for #autostart
+                    dict_prog['load_addr'], str_line = extract_linenumber(line)
+
+                if line_index is None:
+                    i_line, arr_line = proc_basic(line, no_trim,
+                                                  remove_comments)
+                else:
+                    i_line, arr_line = line_index.proc_basic(
+                        line, no_trim, remove_comments)
+                if i_line <= prev_line:
+                    str_msg = _('Wrong Line Number: {0}')
+                    LOGGER.error(str_msg.format(i_line))
+                    raise RuntimeError(str_msg.format(i_line))
+                else:
+                    prev_line = i_line
+
+                if arr_line:
+                    yield arr_line  # Parse BASIC
+            elif line.startswith('#program'):
+                if dict_prog['name'] is None:
                     if len(arr_line) > 1:
-                        load_addr = int(arr_line[1])
-                    else:
-                        load_addr = 0
+                        dict_prog['name'] = arr_line[1]
+            elif line.startswith('#autostart'):
+                if len(arr_line) > 1:
+                    dict_prog['load_addr'] = int(arr_line[1])
                 else:
-                    str_msg = _('Cannot parse line: {0}')
-                    LOGGER.error(str_msg.format(line))
-                    raise RuntimeError(str_msg.format(line))
+                    dict_prog['load_addr'] = 0
+            else:
+                str_msg = _('Cannot parse line: {0}')
+                LOGGER.error(str_msg.format(line))
+                raise RuntimeError(str_msg.format(line))
 
-        file_content = b''.join(basic_data)
 
-    # Save bytes to file
-    file_obj = Plus3DosFile(0, file_content, load_addr)
-    with open(arg_data['output'], 'wb') as f:
-        f.write(file_obj.make_bin())
+def iter_encode_parallel(lines,
+                         no_trim=False,
+                         remove_comments=None,
+                         dict_prog=None,
+                         jobs=None):
+    """
+        Same as iter_encode_lines(), but, for programs with at least
+        PARALLEL_LINES lines, the lines are encoded in chunks by a pool of
+        jobs processes (None for all the CPU cores), and then the line
+        numbers are checked in order. The result is always the same as
+        encoding serially, and, if there is any error, the program is encoded
+        again serially, so the same error is raised
+    """
+
+    if remove_comments is None:
+        remove_comments = []
+    if dict_prog is None:
+        dict_prog = {}
+
+    workers = jobs or os.cpu_count() or 1
+
+    # Directives are read here, so only BASIC lines go to the pool
+    load_addr = 0x8000
+    prog_name = None
+    arr_code = []
+    b_valid = True
+    for line in lines:
+        line = line.strip()
+        arr_line = line.split(' ', -1)
+        if not line:
+            continue
+        if line[0] != '#':
+            if load_addr == 0:  # Next line for #autostart
+                load_addr = extract_linenumber(line)[0]
+            arr_code.append(line)
+        elif line.startswith('#program'):
+            if prog_name is None and len(arr_line) > 1:
+                prog_name = arr_line[1]
+        elif line.startswith('#autostart'):
+            load_addr = int(arr_line[1]) if len(arr_line) > 1 else 0
+        else:
+            b_valid = False
+            break
+
+    arr_data = None
+    if b_valid and workers > 1 and len(arr_code) >= PARALLEL_LINES:
+        arr_data = encode_chunks(arr_code, no_trim, remove_comments,
+                                 workers)
+
+    if arr_data is None:
+        yield from iter_encode_lines(lines, no_trim, remove_comments, None,
+                                     dict_prog)
+        return
+
+    dict_prog['load_addr'] = load_addr
+    dict_prog['name'] = prog_name
+    for b_chunk in arr_data:
+        yield b_chunk
+
+
+def encode_chunks(arr_code, no_trim, remove_comments, workers):
+    """
+        Encodes BASIC lines (without directives) in chunks, using a pool of
+        processes. Returns the data of each chunk, or None if any line can't
+        be encoded or the line numbers are not in order
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunksize = -(-len(arr_code) // (workers * 4))
+    arr_args = [(arr_code[i_pos:i_pos + chunksize], no_trim, remove_comments)
+                for i_pos in range(0, len(arr_code), chunksize)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            arr_results = list(executor.map(encode_chunk, arr_args))
+    except Exception as error:
+        LOGGER.debug('Parallel encoding failed: {0}'.format(error))
+        return None
+
+    # Line numbers must grow from one chunk to the next one too
+    arr_data = []
+    prev_line = -1
+    for arr_lines, b_chunk in arr_results:
+        if arr_lines[0] <= prev_line:
+            return None
+        prev_line = arr_lines[-1]
+        arr_data.append(b_chunk)
+
+    return arr_data
+
+
+def encode_chunk(arr_args):
+    """
+        Pool worker: encodes a chunk of BASIC lines (without directives).
+        Returns the first and last line numbers, and the encoded data.
+        Raises RuntimeError if the line numbers are not in order
+    """
+
+    arr_code, no_trim, remove_comments = arr_args
+
+    arr_bin = []
+    i_first = prev_line = -1
+    for line in arr_code:
+        i_line, line_bin = proc_basic(line, no_trim, remove_comments)
+        if i_line <= prev_line:
+            str_msg = _('Wrong Line Number: {0}')
+            raise RuntimeError(str_msg.format(i_line))
+        if not arr_bin:
+            i_first = i_line
+        prev_line = i_line
+        arr_bin.append(line_bin)
+
+    return (i_first, prev_line), b''.join(arr_bin)
+
+
+def get_program_name(lines):
+    """Returns the name in the first #program directive (or None)"""
+
+    for line in lines:
+        line = line.strip()
+        arr_line = line.split(' ', -1)
+        if line.startswith('#program') and len(arr_line) > 1:
+            return arr_line[1]
+
+    return None
+
+
+def write_plus3dos(f, it_content, dict_prog):
+    """
+        Writes a +3DOS file with the data chunks from it_content, and the
+        autostart line in dict_prog (read after all the data). If f is
+        seekable, data is written as it comes, and then the header; if not,
+        data is kept in memory until the header can be written
+    """
+
+    if f.seekable():
+        i_start = f.tell()
+        f.write(b'\x00' * 128)  # Header placeholder
+        i_length = 0
+        for b_chunk in it_content:
+            f.write(b_chunk)
+            i_length += len(b_chunk)
+
+        file_obj = Plus3DosFile(0, None, dict_prog['load_addr'])
+        file_obj.set_length(i_length)
+        f.seek(i_start)
+        f.write(file_obj.make_header())
+        f.seek(0, os.SEEK_END)
+    else:
+        arr_chunks = list(it_content)
+        file_obj = Plus3DosFile(0, None, dict_prog['load_addr'])
+        file_obj.set_length(sum(len(b_chunk) for b_chunk in arr_chunks))
+        write_buffers(f, [file_obj.make_header()] + arr_chunks)
+
+
+def write_buffers(f, arr_buffers):
+    """
+        Writes several buffers (bytes, bytearray, memoryview or mmap) to f,
+        in order, without joining them first. If f is a real file, they are
+        given all at once to the OS with os.writev, where available
+    """
+
+    arr_views = [memoryview(b_data).cast('B') for b_data in arr_buffers]
+    arr_views = [view for view in arr_views if len(view)]
+
+    fd = None
+    if hasattr(os, 'writev'):
+        try:
+            fd = f.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None  # Not a real file (e.g. io.BytesIO)
+
+    if fd is None:
+        for view in arr_views:
+            f.write(view)
+        return
+
+    f.flush()
+    i_pos = f.tell() if f.seekable() else None
+    i_total = sum(len(view) for view in arr_views)
+    while arr_views:
+        i_written = os.writev(fd, arr_views[:WRITEV_BUFFERS])
+        while arr_views and i_written >= len(arr_views[0]):
+            i_written -= len(arr_views.pop(0))
+        if i_written:
+            arr_views[0] = arr_views[0][i_written:]
+
+    if i_pos is not None:
+        f.seek(i_pos + i_total)  # f doesn't know what was written
+
+
+def map_file(i_path):
+    """
+        Maps a file in memory, read only, so its content can be used without
+        reading it (or copying it). Returns None for empty files, that can't
+        be mapped. The result must be closed when not needed anymore
+    """
+
+    import mmap
+
+    with open(i_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def make_launcher(name, start_addr=32768):
+    """Returns BASIC text lines to load and run a machine code binary"""
+
+    code = ['#autostart']
+    code += ['10 CLEAR {0}'.format(start_addr - 1)]
+    code += ['20 LOAD "{0}" CODE {1}'.format(name, start_addr)]
+    code += ['30 RANDOMIZE USR {0}'.format(start_addr)]
+
+    return code
 
 
 # Functions
@@ -131,6 +598,8 @@ def main():
 def parse_args():
     """Command Line Parser"""
 
+    import argparse
+
     parser = argparse.ArgumentParser(description='Text to NextBASIC Converter')
     parser.add_argument('-v',
                         '--version',
@@ -145,7 +614,7 @@ def parse_args():
                         '--output',
                         action='store',
                         dest='output_path',
-                        help='Output path')
+                        help='Output path (- for stdout)')
     parser.add_argument('-s',
                         '--start',
                         action='store',
@@ -156,7 +625,7 @@ def parse_args():
                         required=False,
                         action='store',
                         dest='input_path',
-                        help='Input text file with BASIC code')
+                        help='Input text file with BASIC code (- for stdin)')
     parser.add_argument('-b',
                         '--binary',
                         action='store_true',
@@ -174,6 +643,34 @@ def parse_args():
                         const='-1:999999',
                         dest='remove_comments',
                         help='Remove comments')
+    parser.add_argument('-m',
+                        '--minify',
+                        action='store_true',
+                        dest='minify',
+                        help='Make the program as small as possible')
+    parser.add_argument('--batch',
+                        action='store',
+                        nargs='+',
+                        dest='batch',
+                        help='Directories or glob patterns to convert')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        dest='incremental',
+                        help='Only encode lines changed since last time')
+    parser.add_argument('--profile',
+                        action='store',
+                        nargs='?',
+                        const='',
+                        dest='profile_path',
+                        help='Show time used by each stage, and save it' +
+                        ' (with a Chrome trace) to a JSON file if given')
+    parser.add_argument('-j',
+                        '--jobs',
+                        action='store',
+                        type=int,
+                        dest='jobs',
+                        help='Number of parallel jobs for batch mode' +
+                        ' or big files')
 
     arguments = parser.parse_args()
 
@@ -186,10 +683,14 @@ def parse_args():
     i_path = None
     if arguments.input_path:
         i_path = Path(arguments.input_path)
+        if arguments.input_path == '-':
+            i_path = STDIO
 
     o_path = None
     if arguments.output_path:
         o_path = Path(arguments.output_path)
+        if arguments.output_path == '-':
+            o_path = STDIO
 
     s_addr = 32768
     if arguments.start_addr:
@@ -210,12 +711,12 @@ def parse_args():
             remove_comments.append(int(i_tmp))
 
     if i_path:
-        if not i_path.exists():
+        if i_path != STDIO and not i_path.exists():
             str_msg = _('Path not found: {0}')
             LOGGER.error(str_msg.format(i_path))
             str_msg = _('Input path does not exist!')
             raise IOError(str_msg)
-    else:
+    elif not arguments.batch:
         if not b_name:
             str_msg = _('A binary name is required!')
             LOGGER.error(str_msg)
@@ -229,10 +730,74 @@ def parse_args():
     values['is_binary'] = is_binary
     values['no_trim'] = dont_trim
     values['remove_comments'] = remove_comments
+    values['batch'] = arguments.batch or []
+    values['jobs'] = arguments.jobs
+    values['incremental'] = arguments.incremental
+    values['minify'] = arguments.minify
+    values['profile'] = None
+    if arguments.profile_path is not None:
+        values['profile'] = ''
+        if arguments.profile_path:
+            values['profile'] = Path(arguments.profile_path)
 
     return values
 
 
+def load_tables():
+    """
+        Compiles the regular expressions and builds the keyword tables used
+        to encode lines, the first time it is called. Expressions for tokens
+        with spaces are compiled (and cached by re) only when found
+    """
+
+    global RE_LINENUMBER, RE_COMMENT_START, RE_COMMENT_AFTER, RE_STATEMENTS
+    global RE_WORDS, RE_PARAMS, RE_NUMCHARS, RE_BINARY, RE_INTEGER
+    global RE_NUMLIST, RE_LISTITEM, RE_NAME, RE_THEN_COMMENT, RE_NO_RENAME
+    global PRENUM, KEYWORDS, SPACED_TOKENS
+    if KEYWORDS is not None:
+        return
+
+    RE_LINENUMBER = re.compile('\\s*([0-9]+)\\s*(.*)')
+    RE_COMMENT_START = re.compile('(\\s*\\d*\\s*(?:;|REM\\s?))(.*)',
+                                  re.MULTILINE | re.DOTALL)
+    RE_COMMENT_AFTER = re.compile('(.*:\\s*(?:;|REM\\s?))(.*)',
+                                  re.MULTILINE | re.DOTALL)
+    RE_STATEMENTS = re.compile('"[^"]*"?|:[^:"]*|[^:"]+')
+    RE_WORDS = re.compile('[A-Z$]+|[<>=]+')
+    RE_PARAMS = re.compile('(.*\xCE[^\\(]*\\()([^\\)]*)(\\).*)')
+    RE_NUMCHARS = re.compile('[0-9.]')
+    RE_BINARY = re.compile('^[01]{8}$')
+    RE_INTEGER = re.compile('[+-]?[0-9]+$')
+    # Statement that is only code without numbers and then a list of numbers
+    # (each number can only match in one way, or a statement that is not a
+    # list takes exponential time to fail)
+    RE_NUMLIST = re.compile('([^0-9.%\x8b]*)(?:[0-9]+(?:\\.[0-9]*)?|\\.[0-9]+)'
+                            '(?:,-?(?:[0-9]+(?:\\.[0-9]*)?|\\.[0-9]+))*')
+    RE_LISTITEM = re.compile('(,-?)?([0-9]+(?:\\.[0-9]*)?|\\.[0-9]+)')
+    # Names in code, with what is before (%, hexadecimal or binary number,
+    # PROC, DEFPROC) or after ($, array, FN or PROC) when it isn't a simple
+    # variable
+    RE_NAME = re.compile('(?<![A-Za-z0-9])([%$@\x91\x93]?)'
+                         '([A-Za-z][A-Za-z0-9]*)([$(]?)')
+    RE_THEN_COMMENT = re.compile('[\xcb\x98][\xea;]')  # THEN/ELSE and REM/;
+    RE_NO_RENAME = re.compile('[\xae\xb0\xd5]')  # VAL$, VAL, MERGE
+
+    str_prenum = ' =(,+-*/<>#;~'
+    dict_keywords = {}
+    arr_spaced = []
+    for str_tok in TOKENS:
+        if TOKENS[str_tok][1]:
+            str_prenum += chr(TOKENS[str_tok][0])
+        if ' ' in str_tok:
+            arr_spaced.append((str_tok, '(\\s*{0}\\s*)'.format(str_tok),
+                               chr(TOKENS[str_tok][0])))
+        else:
+            dict_keywords[str_tok.replace('\\', '')] = chr(TOKENS[str_tok][0])
+    PRENUM = str_prenum
+    SPACED_TOKENS = arr_spaced
+    KEYWORDS = dict_keywords  # Last, as it marks the tables as loaded
+
+
 def proc_basic(line, no_trim=False, remove_comments=[]):
     """
        Does processing on a BASIC line, replacing text tokens, params, numbers,
@@ -240,38 +805,23 @@ def proc_basic(line, no_trim=False, remove_comments=[]):
        Data is returned as bytes.
     """
 
-    i_line, line = extract_linenumber(line)  # Line number as int
-    line = convert_char(line)  # Replace all known UTF-8 characters
-    line, comment = extract_comment(line)  # REM comments won't be parsed
-    if remove_comments:
-        i_remove_c_end = 999999
-        if len(remove_comments) > 1:
-            i_remove_c_end = remove_comments[1]
-        if i_line >= remove_comments[0] and i_line <= i_remove_c_end:
-            comment = ''
-
-    arr_statements = extract_statements(line)  # Split quoted strings and ':'
-
-    line_bin = ''
-    dot_mode = False
-    for str_sttmnt in arr_statements:
-        if str_sttmnt:
-            chk_sttmnt = str_sttmnt.strip()
-            if chk_sttmnt and chk_sttmnt[0] == ':':
-                chk_sttmnt = chk_sttmnt[1:].strip()
-                dot_mode = False
-            if chk_sttmnt:
-                # Don't process quoted text or dot commands
-                if chk_sttmnt[0] == '.':
-                    dot_mode = True
-                if chk_sttmnt[0] != '"' and not dot_mode:
-                    str_sttmnt = process_tokens(str_sttmnt, no_trim)
-                    str_sttmnt = process_params(str_sttmnt)
-                    str_sttmnt = process_numbers(str_sttmnt)
-        line_bin += str_sttmnt
-    line_bin += comment + '\x0d'
-    line_bin = [ord(c) for c in line_bin]
-    line_bin = bytes(line_bin)
+    i_line = -1
+    line_bin = []
+    for tk_kind, tk_value in lex_line(line, no_trim):
+        if tk_kind == TK_LINE:
+            i_line = tk_value
+        elif tk_kind == TK_COMMENT:
+            if remove_comments:
+                i_remove_c_end = 999999
+                if len(remove_comments) > 1:
+                    i_remove_c_end = remove_comments[1]
+                if i_line >= remove_comments[0] and i_line <= i_remove_c_end:
+                    tk_value = ''
+            line_bin.append(tk_value)
+        else:
+            line_bin.append(tk_value)
+    line_bin.append('\x0d')
+    line_bin = ''.join(line_bin).encode('latin-1')
 
     line_number = i_line.to_bytes(2, byteorder='big')
     line_len = len(line_bin)
@@ -281,11 +831,81 @@ def proc_basic(line, no_trim=False, remove_comments=[]):
     return i_line, line_bin
 
 
+def tokens_length(arr_tokens):
+    """Length of the data of a list of lexer tokens (without line number)"""
+
+    return sum(len(tk_value) for tk_kind, tk_value in arr_tokens)
+
+
+def split_then_comment(arr_tokens):
+    """
+        Lexer tokens of a line, with a REM or ; just after THEN or ELSE (not
+        found by extract_comment()) and everything after it as the comment,
+        as the rest of the line is ignored after any REM
+    """
+
+    for i_tk, (tk_kind, tk_value) in enumerate(arr_tokens):
+        if tk_kind == TK_CODE:
+            match_rem = RE_THEN_COMMENT.search(tk_value)
+            if match_rem:
+                str_comment = tk_value[match_rem.end():] + ''.join(
+                    tk_rest for tk_kind, tk_rest in arr_tokens[i_tk + 1:])
+                return arr_tokens[:i_tk] + [
+                    (TK_CODE, tk_value[:match_rem.end()]),
+                    (TK_COMMENT, str_comment)
+                ]
+
+    return arr_tokens
+
+
+def lex_line(line, no_trim=False):
+    """
+        Single pass lexer for a BASIC line. Yields (kind, value) tuples: the
+        line number as int, and then quoted strings, dot commands, separators,
+        code (with keywords already as Sinclair ASCII), expanded numbers and
+        the comment, in order, so joining the values gives the line content
+    """
+
+    load_tables()
+    i_line, line = extract_linenumber(line)  # Line number as int
+    yield TK_LINE, i_line
+
+    line = convert_char(line)  # Replace all known UTF-8 characters
+    line, comment = extract_comment(line)  # REM comments won't be parsed
+
+    dot_mode = False
+    # Quoted strings and ':' split statements
+    for match_sttmnt in RE_STATEMENTS.finditer(line):
+        str_sttmnt = match_sttmnt.group()
+        chk_sttmnt = str_sttmnt.strip()
+        if chk_sttmnt and chk_sttmnt[0] == ':':
+            chk_sttmnt = chk_sttmnt[1:].strip()
+            dot_mode = False
+        if not chk_sttmnt:
+            yield TK_SEP, str_sttmnt
+        elif chk_sttmnt[0] == '"':  # Don't process quoted text
+            yield TK_STRING, str_sttmnt
+        else:
+            if chk_sttmnt[0] == '.':
+                dot_mode = True
+            if dot_mode:  # Dot commands are kept as is until next ':'
+                yield TK_DOT, str_sttmnt
+            else:
+                str_sttmnt = process_tokens(str_sttmnt, no_trim)
+                if '\xCE' in str_sttmnt:
+                    str_sttmnt = process_params(str_sttmnt)
+                for tk_number in lex_numbers(str_sttmnt):
+                    yield tk_number
+
+    if comment:
+        yield TK_COMMENT, comment
+
+
 def extract_linenumber(line):
     """Splits line into line number and line"""
 
-    det_line = re.compile('\\s*([0-9]+)\\s*(.*)')
-    match_det = det_line.match(line)
+    load_tables()
+    match_det = RE_LINENUMBER.match(line)
     if match_det:
         line_number = match_det.group(1)
         line = match_det.group(2)
@@ -295,34 +915,12 @@ def extract_linenumber(line):
 
 
 def convert_char(line):
-    """Converts non-ASCII characters from UTF-8 to Sinclair ASCII"""
-
-    # UTF Char conversion (Block Graphics, etc)
-    for s_char in CHARS:
-        line = line.replace(s_char, CHARS[s_char])
-
-    # Escape characters conversion
-    n_line = ''
-    arr_line = line.split('`')  # Split using escape ` char
-    if arr_line:
-        n_line = arr_line[0]
-        for p_line in arr_line[1:]:
-            # Integer between 0 and 255
-            str_i = '(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)'
-            str_x = '(x[0-9a-fA-F]{1,2})'  # Hex between 0 and FF
-            det_esc = re.compile('({0}|{1})(.*)'.format(str_i, str_x))
-            match_esc = det_esc.findall(p_line)
-            if match_esc:
-                match_esc = match_esc[0]
-                n_char = match_esc[1]
-                if match_esc[2]:
-                    n_char = match_esc[2].replace(u'x', u'0x')
-                n_line += chr(int(n_char, 0))
-                n_line += match_esc[3]
-            else:
-                n_line += p_line
-    line = n_line
-    return line
+    """
+        Converts non-ASCII characters from UTF-8 (Block Graphics, etc) and
+        ` escapes to Sinclair ASCII, using the zxnext codec tables
+    """
+
+    return zxn_codec.encode_chars(line)
 
 
 def extract_comment(line):
@@ -330,16 +928,12 @@ def extract_comment(line):
 
     # Detect ; and REM comments
     comment = ''
-    det_comm = re.compile('(\\s*\\d*\\s*(?:;|REM\\s?))(.*)', re.MULTILINE
-                          | re.DOTALL)  # Comments at start of line
-    match_comm = det_comm.match(line)
+    match_comm = RE_COMMENT_START.match(line)  # Comments at start of line
     if match_comm:
         line = match_comm.group(1)
         comment = match_comm.group(2)
     else:
-        det_comm = re.compile('(.*:\\s*(?:;|REM\\s?))(.*)',
-                              re.MULTILINE | re.DOTALL)  # Comments after :
-        match_comm = det_comm.match(line)
+        match_comm = RE_COMMENT_AFTER.match(line)  # Comments after :
         if match_comm:
             n_line = match_comm.group(1)
             if n_line.count(u'"') % 2 == 0:  # Not between quotes
@@ -349,125 +943,33 @@ def extract_comment(line):
     return line, comment
 
 
-def extract_statements(line):
-    """Converts line to array with quoted elements and statements as members"""
-
-    arr_line = []
-    # Split quoted elements
-    b_quote = False
-    elem_line = u''
-    for letter in line:
-        if letter == u'"':
-            if b_quote:
-                b_quote = False
-                elem_line += letter
-                arr_line.append(elem_line)  # End quote: Append to list
-                elem_line = u''
-                continue
-            else:
-                arr_line.append(elem_line)  # Start quote. Split and append
-                elem_line = u''
-                b_quote = True
-
-        elem_line += letter
-    if elem_line:
-        arr_line.append(elem_line)  # Add ending string if not empty
-
-    # Split statements using ':'
-    arr_statements = []
-    for elem_line in arr_line:
-        if elem_line:
-            if elem_line[0] == u'"':
-                arr_statements.append(elem_line)  # Quoted strings kept as is
-            else:
-                i = prev_i = 0
-                for str_char in elem_line:
-                    if str_char == u':':
-                        arr_statements.append(
-                            elem_line[prev_i:i])  # Split on :
-                        prev_i = i
-                    i += 1
-                if prev_i < i:
-                    arr_statements.append(
-                        elem_line[prev_i:i])  # Last statement
-
-    return arr_statements
-
-
 def process_tokens(str_statement, no_trim=False):
     """ Converts token strings in statement to Sinclair ASCII"""
 
     # Tokens with spaces are processed first
-    for token in TOKENS:
-        chr_token = chr(
-            TOKENS[token][0])  # Dictionaries are ordereded since 3.6
-        if ' ' in token:
-            det_t = re.compile('(\\s*{0}\\s*)'.format(token))
-            find_t = det_t.findall(str_statement)
-            if find_t:
-                for str_token in find_t:
-                    str_statement = str_statement.replace(str_token, chr_token)
+    for str_token, str_pattern, chr_token in SPACED_TOKENS:
+        if str_token in str_statement:
+            for str_found in re.findall(str_pattern, str_statement):
+                str_statement = str_statement.replace(str_found, chr_token)
 
     # Two kind of token "words", standard (e.g. INKEY$) and symbols (<=, etc.)
-    str_letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ$'
-    str_symbols = '<>='
-
-    str_result = ''
-    is_word = is_symbol = False
-    str_word = ''  # Temporary storage of word (possibly a token)
-    i = 0
-    # Compose a list of all possible words in statement, split accordingly
-    for str_char in str_statement:
-        if str_char in str_letters:  # Word
-            if is_symbol:
-                is_symbol = False
-                str_result += find_token(str_word)
-            if not is_word:
-                is_word = True
-                str_word = str_char
-            else:
-                str_word += str_char
-
-        elif str_char in str_symbols:  # Symbol
-            if is_word:
-                is_word = False
-                str_result += find_token(str_word)
-            if not is_symbol:
-                is_symbol = True
-                str_word = str_char
-            else:
-                str_word += str_char
-
-        else:  # Not a Word
-            if is_word or is_symbol:
-                is_word = is_symbol = False
-                str_result += find_token(str_word)
+    # and the longest run of each kind is looked up in the keyword index
+    if no_trim:
+        # Only words are kept
+        return ''.join(
+            KEYWORDS.get(str_word, str_word)
+            for str_word in RE_WORDS.findall(str_statement))
 
-            if str_char != ' ' and not no_trim:
-                str_result += str_char
+    str_result = RE_WORDS.sub(find_token, str_statement)
+    return str_result.replace(' ', '')
 
-    # Last remaining word
-    if is_word or is_symbol:
-        str_result += find_token(str_word)
 
-    return str_result
-
-
-def find_token(str_word):
+def find_token(match_word):
     """Checks if a word is token or symbol, and replaces with Sinclair ASCII
     character, if not, the original word is returned"""
 
-    str_result = str_word
-    for token in TOKENS:
-        str_token = token.replace('\\', '')
-        # Dictionaries are ordered since Python 3.6
-        chr_token = chr(TOKENS[token][0])
-        if str_word == str_token:
-            str_result = chr_token
-            b_token = True
-            break
-
-    return str_result
+    str_word = match_word.group()
+    return KEYWORDS.get(str_word, str_word)
 
 
 def process_params(str_statement):
@@ -478,8 +980,7 @@ def process_params(str_statement):
     """
 
     # Detect DEF FN parameters
-    det_params = re.compile('(.*\xCE[^\\(]*\\()([^\\)]*)(\\).*)')
-    match_det = det_params.match(str_statement)
+    match_det = RE_PARAMS.match(str_statement)
     if match_det:
         str_statement = match_det.group(1)
         str_params = match_det.group(2)
@@ -501,8 +1002,31 @@ def process_params(str_statement):
     return str_statement
 
 
-def process_numbers(str_statement):
-    """Parses statement and expands numbers to 5-byte format"""
+def lex_numbers(str_statement):
+    """
+        Parses statement and yields code and numbers, the latter already
+        expanded to 5-byte format
+    """
+
+    if not RE_NUMCHARS.search(str_statement):
+        yield TK_CODE, str_statement
+        return
+
+    # Fast path for lists of numbers (e.g. DATA), converted all at once
+    match_list = RE_NUMLIST.fullmatch(str_statement)
+    if match_list:
+        str_code = match_list.group(1)
+        if not str_code or (str_code[-1] in PRENUM
+                            and str_code[-1] != '\xc4'):  # Not BIN
+            if str_code:
+                yield TK_CODE, str_code
+            for str_sep, str_num in RE_LISTITEM.findall(str_statement,
+                                                        len(str_code)):
+                if str_sep:
+                    yield TK_CODE, str_sep
+                yield TK_NUMBER, '{0}\x0e{1}'.format(str_num,
+                                                     convert_number(str_num))
+            return
 
     # Standard tokens which are also functions with integer-only forms
     # (as stated in page 76 of ZX Spectrum Next manual)
@@ -515,10 +1039,10 @@ def process_numbers(str_statement):
     is_number = False
     is_intexpr = False  # Integer in int expression (NextBASIC)
     not_intexpr = False  # Non integer assignment
-    arr_numbers = []  # Number as string, position, previous char and previous
-    # part of statement
+    arr_numbers = []  # Start and end of each number found in statement
     chr_prev = ''
     n_prev = 0
+    n_pos = 0
     i = 0
     # Compose a list of all possible numbers in statement, split accordingly
     for str_char in str_statement:
@@ -530,10 +1054,10 @@ def process_numbers(str_statement):
 
         if str_char in '%\x8b':  # Int expression or MOD
             is_intexpr = True
-        elif str_char in ',' or ord(str_char) > 164:  # Standard token
+        elif str_char == ',' or str_char > '\xa4':  # Standard token
             if str_char not in arr_intfunc:  # Not an integer-only function
                 is_intexpr = False
-        elif str_char in '=' and not_intexpr:  # Looks like a LET assignment
+        elif str_char == '=' and not_intexpr:  # Looks like a LET assignment
             is_intexpr = False
             not_intexpr = False
 
@@ -543,88 +1067,75 @@ def process_numbers(str_statement):
                     if not chr_prev or chr_prev in PRENUM:
                         is_number = True
                         n_pos = i
-            else:
-                testfloat = str_statement[n_pos:i + 1]
-                if (str_char not in 'eE.') and not (str_char in '+-'
-                                                    and chr_prev in 'eE'):
+            elif (str_char not in 'eE.') and not (str_char in '+-'
+                                                  and chr_prev in 'eE'):
+                try:
+                    float(str_statement[n_pos:i + 1])
+                except ValueError:
+                    is_number = False
+                    # Previous iteration had a number?
                     try:
-                        testfloat = float(testfloat)
+                        float(str_statement[n_pos:i])
+                        arr_numbers.append((n_pos, i))
+                        n_prev = i
                     except ValueError:
-                        is_number = False
-                        # Previous iteration had a number?
-                        testfloat = str_statement[n_pos:i]
-                        try:
-                            testfloat = float(testfloat)
-                            inc_arr_numbers(str_statement, n_pos, i, n_prev,
-                                            arr_numbers)
-                            n_prev = i
-                        except ValueError:
-                            pass  # Not a number
+                        pass  # Not a number
         i += 1
 
     if is_number:
         # We may still have one remaining number to process
         try:
-            testfloat = float(str_statement[n_pos:i])
-            inc_arr_numbers(str_statement, n_pos, i, n_prev, arr_numbers)
+            float(str_statement[n_pos:i])
+            arr_numbers.append((n_pos, i))
             n_prev = i
         except ValueError:
             if len(str_statement) > 1:
-                inc_arr_numbers(str_statement, n_pos, i - 1, n_prev,
-                                arr_numbers)
+                arr_numbers.append((n_pos, i - 1))
                 n_prev = i
 
-    # Save remaining text of statement (without numbers inside)
-    str_post = str_statement[n_prev:]
+    # Text before each number, and then the expanded number
+    n_text = 0
+    for n_pos, n_end in arr_numbers:
+        if n_text < n_pos:
+            yield TK_CODE, str_statement[n_text:n_pos]
+        n_text = n_end
 
-    # Read list of numbers and compose the expanded statement
-    str_result = ''
-    for str_num, n_pos, chr_prev, str_prev in arr_numbers:
+        str_num = str_statement[n_pos:n_end]
         bin_num = str_num  # By default, the number is not expanded
-        str_result += str_prev  # Append text prepending number
-
-        if chr_prev == '\xc4':  # BIN number
+        if str_statement[n_pos - 1] == '\xc4':  # BIN number
             LOGGER.debug('bin: {0}'.format(str_num))
-            det_bin = re.compile('^[01]{8}$')
-            match_det = det_bin.match(str_num)
-            if match_det:
+            if RE_BINARY.match(str_num):
                 int_num = int(str_num, base=2)  # Binary text to int
                 bin_num = u'{0}\x0e'.format(
                     str_num)  # Sinclair BASIC number marker
                 # BIN numbers are saved using one byte surrounded by 0s?
                 bin_num += u'\x00\x00{0}\x00\x00'.format(chr(int_num))
         else:  # Other kind of number
-            # LOGGER.debug('Number: {0}'.format(str_num))
             if str_num != '.':  # Only valid floats allowed
                 bin_num = convert_number(str_num)  # Expand int or float
                 bin_num = '{0}\x0e{1}'.format(str_num, bin_num)
 
-        str_result += bin_num
-
-    str_result += str_post  # Recover remaining text of statement
-
-    return str_result
-
+        yield TK_NUMBER, bin_num
 
-def inc_arr_numbers(str_sttmnt, n_pos, i, n_prev, arr_numbers):
-    """Increments Number array slicing the required data from str_sttmnt"""
-
-    str_number = str_sttmnt[n_pos:i]
-    str_prevc = str_sttmnt[n_pos - 1]
-    str_prevp = str_sttmnt[n_prev:n_pos]
-    arr_numbers.append([str_number, n_pos, str_prevc, str_prevp])
+    # Remaining text of statement (without numbers inside)
+    if n_prev < len(str_statement):
+        yield TK_CODE, str_statement[n_prev:]
 
 
 def convert_number(strnum):
     """ Detect if string it's a number and then the type (int, float),
     then try to convert using Sinclair BASIC 5-byte number format
     (http://fileformats.archiveteam.org/wiki/Sinclair_BASIC_tokenized_file#5-byte_numeric_format)
+    Results are cached, as the same literals are usually found many times
     """
 
+    str_cached = NUMBER_CACHE.get(strnum)
+    if str_cached is not None:
+        return str_cached
+
     c = None
     # Integer
-    det_int = re.compile('[+-]?[0-9]+$')
-    match_int = det_int.match(strnum)
+    match_int = RE_INTEGER.match(strnum)
     if match_int:
         # LOGGER.debug('int: {0}'.format(strnum))
         newint = int(strnum)
@@ -641,8 +1152,9 @@ def convert_number(strnum):
     # Convert binary to string
     s = ''
     if c:
-        for b_char in c:
-            s += chr(b_char)
+        s = c.decode('latin-1')
+    if len(NUMBER_CACHE) < NUMBER_CACHE_SIZE:
+        NUMBER_CACHE[strnum] = s
 
     return s
 
@@ -670,68 +1182,56 @@ def convert_int(newint):
 
 
 def convert_float(newfloat):
-    """Convert float to bytes using 5-byte Sinclair format"""
+    """
+        Convert float to bytes using 5-byte Sinclair format. The exact value
+        of the float is used, as an integer fraction, to get the bits
+    """
 
     if newfloat != 0.0:
         LOGGER.debug('float->{0}'.format(newfloat))
 
         # Extract sign and absolute value
-        b_sign = '0'
-        normalized = False
+        i_sign = 0
         if newfloat < 0.0:
-            b_sign = '1'
+            i_sign = 1
             newfloat = abs(newfloat)
 
-        # Process integer part
-        intpart = int(newfloat)
-        mantissa = '{0:b}'.format(intpart)
-        if intpart == 0:
-            mantissa = ''
+        # Exact value as a fraction, denominator is a power of 2
+        i_num, i_den = newfloat.as_integer_ratio()
+        intpart, i_fract = divmod(i_num, i_den)
+
+        if intpart:
+            # Integer part bits and 33 bits of fractional part
+            newexp = intpart.bit_length()
+            n_bits = newexp + 33
+            mantissa = (intpart << 33) | ((i_fract << 33) // i_den)
         else:
-            normalized = True
-
-        # Base exponent, possibly not normalized yet
-        newexp = len(mantissa)
-
-        # Process fractional part
-        fractpart = newfloat - intpart
-        i = 0  # Bit counter
-        fractbin = ''
-        # Bit by bit, one extra bit for rounding reasons
-        while i < 33:
-            fractpart *= 2
-            if int(fractpart) > 0:
-                if not normalized:
-                    normalized = True
-                    fractbin = fractbin[i:]
-                    i = 0  # Normalizing, so more bits are needed
-                fractpart -= int(fractpart)
-                fractbin += '1'
+            # 33 bits from the first 1 in the fractional part
+            i_first = i_den.bit_length() - i_fract.bit_length()
+            n_bits = 33
+            if i_first > 33:
+                # Too small, no 1 found (same result as previous versions)
+                newexp = -33
+                mantissa = 1
             else:
-                if not normalized:
-                    newexp -= 1  # Normalizing
-                fractbin += '0'
-            i += 1
-        fractint = int(fractbin, 2)  # Convert binary string to int
-
-        if newexp < 0:  # Negative exponent, adjust fractional part
-            fractint -= 1
-
-        fractint = '{0:033b}'.format(fractint)  # To string again
+                newexp = 1 - i_first
+                mantissa = (i_fract << (i_first + 32)) // i_den
+                if newexp < 0:  # Negative exponent, adjust fractional part
+                    mantissa -= 1
 
-        # Compose mantisa
-        mantissa += fractint
-        mantissa = b_sign + mantissa[1:]
+        # First bit of mantissa is always 1, so it's replaced by the sign
+        mantissa &= (1 << (n_bits - 1)) - 1
+        mantissa |= i_sign << (n_bits - 1)
 
-        # Format exponent
-        b = '{0:08b}'.format(128 + newexp)  # To string
+        # Exponent, then mantissa
+        i_exp = 128 + newexp
+        b = (i_exp << n_bits) | mantissa
+        n_bits += max(8, i_exp.bit_length())
 
-        b += mantissa  # Final bits
-
-        # Rounding using bit #41
-        if b[40] == '1':
-            b = b[:39] + '1'
-        b = int(b[:40], 2)
+        # Keep 40 bits, rounding using bit #41
+        i_round = (b >> (n_bits - 41)) & 1
+        b >>= n_bits - 40
+        b |= i_round
 
         # To bytes
         b = b.to_bytes(5, byteorder='big', signed=False)
@@ -742,6 +1242,17 @@ def convert_float(newfloat):
         return convert_int(0)
 
 
+def iter_short_names():
+    """Yields new variable names, shortest first"""
+
+    import string
+
+    yield from string.ascii_lowercase
+    for str_first in string.ascii_lowercase:
+        for str_second in string.ascii_lowercase + string.digits:
+            yield str_first + str_second
+
+
 # Classes
 # -------
 class Plus3DosFile(object):
@@ -759,27 +1270,494 @@ class Plus3DosFile(object):
         if content:
             content_length = len(content)
 
+        self.set_length(content_length)
+
+    def set_length(self, content_length=0):
         self.header = Plus3DosFileHeader(self.filetype, content_length,
                                          self.load_addr)
 
         self.length = 128 + content_length
 
+    def make_header(self):
+        arr_bytes = bytearray(128)  # Reserved bytes are 0
+        struct.pack_into(PLUS3DOS_FORMAT, arr_bytes, 0, PLUS3DOS_SIGNATURE,
+                         self.issue, self.version, self.length)
+        arr_bytes[15:23] = self.header.make_bin()
+        arr_bytes[127] = sum(arr_bytes[:127]) % 256  # Checksum
+
+        return bytes(arr_bytes)
+
     def make_bin(self):
-        arr_bytes = b'PLUS3DOS'  # +3DOS signature - 'PLUS3DOS'
-        arr_bytes += b'\x1A'  # 1Ah (26) Soft-EOF (end of file)
-        arr_bytes += (self.issue).to_bytes(1, 'little')
-        arr_bytes += (self.version).to_bytes(1, 'little')
-        arr_bytes += (self.length).to_bytes(4, 'little')
-        arr_bytes += self.header.make_bin()
-        arr_bytes += b'\0' * 104  # Reserved (set to 0)
-        checksum = 0
-        for i in range(0, 126):
-            checksum += arr_bytes[i]
-        checksum %= 256
-        arr_bytes += (checksum).to_bytes(1, 'little')
-        arr_bytes += self.content
-
-        return arr_bytes
+        return self.make_header() + self.content
+
+    def write(self, f):
+        """
+            Writes the header and the content (bytes, bytearray or mmap)
+            to f, without copying the content
+        """
+
+        write_buffers(f, [self.make_header(), self.content or b''])
+
+
+class LineIndex(object):
+    """
+        Encoded lines of a previous conversion, so they can be reused.
+        Stored in a sidecar JSON file next to the +3DOS output (with .idx
+        added to its name), with the text hash, line number, offset and
+        length of each line in the output. If the options, the version of
+        this script or the output file don't match, nothing is reused
+    """
+    def __init__(self, no_trim=False, remove_comments=None):
+        self.options = [__MY_VERSION__, no_trim, list(remove_comments or [])]
+        self.content = memoryview(b'')
+        self.old_lines = {}
+        self.lines = []
+        self.length = 0
+        self.n_encoded = 0
+
+    def load(self, o_path):
+        import json
+        import hashlib
+
+        idx_path = o_path.with_name(o_path.name + '.idx')
+        try:
+            with open(idx_path, 'r') as f:
+                dict_index = json.load(f)
+            with open(o_path, 'rb') as f:
+                bin_data = f.read()
+        except (IOError, ValueError):
+            return
+
+        if dict_index.get('options') != self.options:
+            return
+        if dict_index.get('sha1') != hashlib.sha1(bin_data).hexdigest():
+            LOGGER.debug('{0} changed, not using index'.format(o_path))
+            return
+
+        self.content = memoryview(bin_data)[128:]
+        for str_hash, i_line, i_offset, i_length in dict_index['lines']:
+            self.old_lines[str_hash] = (i_line, i_offset, i_length)
+
+    def proc_basic(self, line, no_trim=False, remove_comments=[]):
+        """Same as proc_basic() function, but reusing old lines if possible"""
+
+        import hashlib
+
+        str_hash = hashlib.sha1(line.encode('utf-8')).hexdigest()
+        old_line = self.old_lines.get(str_hash)
+        if old_line:
+            i_line, i_offset, i_length = old_line
+            line_bin = self.content[i_offset:i_offset + i_length]
+        else:
+            i_line, line_bin = proc_basic(line, no_trim, remove_comments)
+            self.n_encoded += 1
+
+        self.lines.append([str_hash, i_line, self.length, len(line_bin)])
+        self.length += len(line_bin)
+        return i_line, line_bin
+
+    def save(self, o_path):
+        import json
+        import hashlib
+
+        with open(o_path, 'rb') as f:
+            bin_data = f.read()
+
+        LOGGER.debug('{0} lines encoded, {1} reused'.format(
+            self.n_encoded,
+            len(self.lines) - self.n_encoded))
+
+        dict_index = {
+            'options': self.options,
+            'sha1': hashlib.sha1(bin_data).hexdigest(),
+            'lines': self.lines
+        }
+        idx_path = o_path.with_name(o_path.name + '.idx')
+        with open(idx_path, 'w') as f:
+            json.dump(dict_index, f, separators=(',', ':'))
+
+
+class Minifier(object):
+    """
+        Encodes lines making the program as small as possible. All the lines
+        are read first (to find the targets of GO TO, etc. and the variable
+        names), and then it is used as a LineIndex:
+          minifier = Minifier(lines)
+          encode_lines(lines, line_index=minifier)
+        Comments are removed (and comment lines too, if they aren't a jump
+        target), as well as empty statements and spaces, long variable
+        names are changed to short ones (unless VAL, VAL$ or MERGE are used,
+        as names could then be in strings or in other programs), and
+        integer numbers get the shortest form allowed where they are: %
+        integer expression, VAL "..." or 5-byte number. The bytes saved by
+        each kind of change are kept in self.saved
+    """
+    def __init__(self, lines):
+        self.saved = dict((str_kind, 0) for str_kind in MINIFY_KINDS)
+        self.targets = set()  # Line numbers used by GO TO, RESTORE, etc.
+        self.all_targets = False  # A jump to an expression: keep all lines
+        self.names = {}  # Long variable name (lowercase) to short name
+        load_tables()
+        self.scan(lines)
+
+    def scan(self, lines):
+        """Finds the jump targets and the variable names to change"""
+
+        import rennextbasic
+
+        dict_count = {}  # Long variable names, and times found
+        set_used = set()  # Names (lowercase) found anywhere
+        set_keep = set()  # Names found in dot commands
+        b_rename = True
+        b_autostart = False
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '#':
+                if line.startswith('#autostart'):
+                    arr_line = line.split()
+                    if len(arr_line) > 1:
+                        self.targets.add(int(arr_line[1]))
+                    else:
+                        b_autostart = True  # Next line
+                continue
+
+            arr_tokens = split_then_comment(list(lex_line(line)))
+            if b_autostart:
+                self.targets.add(arr_tokens[0][1])
+                b_autostart = False
+
+            str_body = ''.join(tk_value for tk_kind, tk_value in arr_tokens
+                               if tk_kind != TK_LINE)
+            for i_digits, i_number, i_target in (
+                    rennextbasic.find_bin_references(
+                        str_body.encode('latin-1'))):
+                if i_target is None:
+                    self.all_targets = True
+                else:
+                    self.targets.add(i_target)
+
+            for tk_kind, tk_value in arr_tokens:
+                if tk_kind == TK_CODE:
+                    if RE_NO_RENAME.search(tk_value):
+                        b_rename = False
+                    for match_name in RE_NAME.finditer(tk_value):
+                        str_prefix, str_name, str_suffix = match_name.groups()
+                        str_name = str_name.lower()
+                        set_used.add(str_name)
+                        if len(str_name) > 1 and not (str_prefix
+                                                      or str_suffix):
+                            dict_count[str_name] = dict_count.get(
+                                str_name, 0) + 1
+                elif tk_kind == TK_DOT:
+                    for match_name in RE_NAME.finditer(tk_value):
+                        set_keep.add(match_name.group(2).lower())
+
+        if not b_rename:
+            return
+
+        # Most used names get the shortest new names
+        arr_free = [
+            str_new for str_new in iter_short_names()
+            if str_new not in set_used and str_new.upper() not in KEYWORDS
+        ]
+        i_free = 0
+        for str_name in sorted(dict_count, key=lambda s: -dict_count[s]):
+            if i_free >= len(arr_free):
+                break
+            if str_name in set_keep:
+                continue
+            if len(arr_free[i_free]) < len(str_name):
+                self.names[str_name] = arr_free[i_free]
+                LOGGER.debug('{0} -> {1}'.format(str_name, arr_free[i_free]))
+                i_free += 1
+
+    def proc_basic(self, line, no_trim=False, remove_comments=[]):
+        """
+            Same as proc_basic() function, but minifying the line (always
+            trimmed). If the whole line is removed, data is empty
+        """
+
+        import rennextbasic
+
+        arr_tokens = split_then_comment(list(lex_line(line)))
+        i_line = arr_tokens.pop(0)[1]
+        i_length = tokens_length(arr_tokens)
+
+        # Spaces and empty statements
+        arr_new = []
+        for i_tk, (tk_kind, tk_value) in enumerate(arr_tokens):
+            if tk_kind == TK_SEP:
+                continue
+            if tk_kind == TK_DOT:
+                if tk_value.lstrip()[:1] == ':':
+                    tk_value = ':' + tk_value.lstrip()[1:].lstrip()
+                arr_next = arr_tokens[i_tk + 1:i_tk + 2]
+                if not arr_next or arr_next[0][0] not in (TK_STRING, TK_DOT):
+                    tk_value = tk_value.rstrip()  # Not before its arguments
+            arr_new.append((tk_kind, tk_value))
+        if arr_new and arr_new[0][1][:1] == ':':
+            arr_new[0] = (arr_new[0][0], arr_new[0][1][1:].lstrip())
+        arr_tokens = self.count('spaces', i_length, arr_new)
+        i_length = tokens_length(arr_tokens)
+
+        # Comments
+        if arr_tokens and arr_tokens[-1][0] == TK_COMMENT:
+            arr_tokens.pop()
+            str_code = arr_tokens.pop()[1][:-1].rstrip()  # Without REM or ;
+            if str_code[-1:] == ':':
+                str_code = str_code[:-1]
+            if str_code:
+                arr_tokens.append((TK_CODE, str_code))
+            str_last = ''
+            if arr_tokens and arr_tokens[-1][0] == TK_CODE:
+                str_last = arr_tokens[-1][1]
+            if str_last and str_last[-1] in MINIFY_THEN:
+                arr_tokens[-1] = (TK_CODE, str_last + '\xea')  # Statement
+        if not arr_tokens:
+            if not self.all_targets and i_line not in self.targets:
+                self.saved['comments'] += i_length + 5  # Whole line
+                return i_line, b''
+            arr_tokens = [(TK_CODE, '\xea')]  # Empty REM
+        arr_tokens = self.count('comments', i_length, arr_tokens)
+
+        # Variable names
+        if self.names:
+            i_length = tokens_length(arr_tokens)
+            arr_tokens = self.count('names', i_length, [
+                (tk_kind, RE_NAME.sub(self.rename, tk_value)
+                 if tk_kind == TK_CODE else tk_value)
+                for tk_kind, tk_value in arr_tokens
+            ])
+
+        # Numbers, except line numbers of GO TO, etc.
+        i_length = tokens_length(arr_tokens)
+        str_body = ''.join(tk_value for tk_kind, tk_value in arr_tokens)
+        set_refs = set(i_digits for i_digits, i_number, i_target in
+                       rennextbasic.find_bin_references(
+                           str_body.encode('latin-1')))
+        arr_new = []
+        i_pos = 0
+        for i_tk, (tk_kind, tk_value) in enumerate(arr_tokens):
+            if tk_kind == TK_NUMBER and i_pos not in set_refs and i_tk:
+                str_next = '\r'
+                if i_tk + 1 < len(arr_tokens):
+                    str_next = arr_tokens[i_tk + 1][1][:1]
+                tk_value = self.shorten_number(tk_value,
+                                               arr_tokens[i_tk - 1][1][-1:],
+                                               str_next)
+            i_pos += len(arr_tokens[i_tk][1])
+            arr_new.append((tk_kind, tk_value))
+        arr_tokens = self.count('numbers', i_length, arr_new)
+
+        line_bin = ''.join(tk_value for tk_kind, tk_value in arr_tokens)
+        line_bin = (line_bin + '\x0d').encode('latin-1')
+
+        return i_line, b''.join([
+            i_line.to_bytes(2, byteorder='big'),
+            len(line_bin).to_bytes(2, byteorder='little'), line_bin
+        ])
+
+    def count(self, str_kind, i_length, arr_tokens):
+        """Adds the bytes saved by a kind of change, and returns the tokens"""
+
+        self.saved[str_kind] += i_length - tokens_length(arr_tokens)
+        return arr_tokens
+
+    def rename(self, match_name):
+        """Gives the new name of a variable, or the same text if none"""
+
+        str_prefix, str_name, str_suffix = match_name.groups()
+        if str_prefix or str_suffix:
+            return match_name.group()
+
+        return self.names.get(str_name.lower(), str_name) + str_suffix
+
+    def shorten_number(self, str_number, str_prev, str_next):
+        """
+            Gives the shortest form of an integer number, found between the
+            characters str_prev and str_next. Other numbers aren't changed
+        """
+
+        if str_prev in MINIFY_KEEP_AFTER or '\x0e' not in str_number:
+            return str_number  # BIN, stream or not expanded
+
+        str_num, str_5bytes = str_number.split('\x0e', 1)
+        if not str_num.isdigit() or int(str_num) > 65535:
+            return str_number
+
+        str_num = str(int(str_num))  # No leading zeros
+        arr_forms = [
+            '{0}\x0e{1}'.format(str_num, str_5bytes),
+            '\xb0"{0}"'.format(str_num)  # VAL "..."
+        ]
+        if str_prev in MINIFY_INT_BEFORE and str_next in MINIFY_INT_AFTER:
+            arr_forms.append('%' + str_num)  # Integer expression
+
+        return min(arr_forms, key=len)
+
+    def log_saved(self, str_name):
+        """Shows the bytes saved by each kind of change"""
+
+        str_msg = _('{0}: {1} bytes saved (comments: {2}, spaces: {3},'
+                    ' names: {4}, numbers: {5})')
+        LOGGER.info(
+            str_msg.format(str_name, sum(self.saved.values()),
+                           *[self.saved[str_kind]
+                             for str_kind in MINIFY_KINDS]))
+
+
+class Profiler(object):
+    """
+        Collects calls and time used by each stage of the encoder (the
+        functions in PROFILE_STAGES) and by each line. While started, those
+        functions are replaced with timed versions, so, when not profiling,
+        nothing is added to the conversion. Usage:
+
+        with Profiler() as profiler:
+            encode(lines)
+        profiler.log_summary()
+    """
+    def __init__(self, b_trace=True):
+        self.stats = {}  # Stage name: [calls, total time, self time]
+        self.lines = []  # Time, line number and text of each line
+        self.events = None  # Stage name, start and time of each call
+        if b_trace:
+            self.events = []
+        self.stack = []  # Time used by nested stages, for each open call
+        self.saved = []
+        self.t_start = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        if self.saved:
+            return
+
+        self.t_start = time.perf_counter()
+        module = sys.modules[__name__]
+        for str_name in PROFILE_STAGES:
+            owner = module
+            str_attr = str_name
+            if '.' in str_name:
+                str_class, str_attr = str_name.split('.')
+                owner = getattr(module, str_class)
+            func = getattr(owner, str_attr)
+            self.saved.append((owner, str_attr, func))
+            setattr(owner, str_attr, self.wrap(str_name, func))
+
+    def stop(self):
+        for owner, str_attr, func in reversed(self.saved):
+            setattr(owner, str_attr, func)
+        self.saved = []
+
+    def wrap(self, str_name, func):
+        """Returns a timed version of func"""
+
+        import inspect
+
+        b_generator = inspect.isgeneratorfunction(func)
+
+        def timed(*args, **kwargs):
+            self.stack.append(0.0)
+            t_call = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                if b_generator:
+                    result = list(result)  # Time all the work
+            finally:
+                elapsed = time.perf_counter() - t_call
+                t_nested = self.stack.pop()
+                if self.stack:
+                    self.stack[-1] += elapsed
+                arr_stat = self.stats.setdefault(str_name, [0, 0.0, 0.0])
+                arr_stat[0] += 1
+                arr_stat[1] += elapsed
+                arr_stat[2] += elapsed - t_nested
+                if self.events is not None:
+                    self.events.append((str_name, t_call, elapsed))
+
+            if str_name == 'proc_basic':
+                self.lines.append((elapsed, result[0], args[0].strip()))
+            if b_generator:
+                return iter(result)
+            return result
+
+        return timed
+
+    def summary(self, n_lines=10):
+        """Stage stats and slowest lines, as a dict"""
+
+        dict_stages = {}
+        for str_name, (i_calls, total, self_time) in self.stats.items():
+            dict_stages[str_name] = {
+                'calls': i_calls,
+                'total_s': total,
+                'self_s': self_time
+            }
+
+        arr_lines = []
+        for elapsed, i_line, str_line in sorted(self.lines,
+                                                reverse=True)[:n_lines]:
+            arr_lines.append({
+                'line': i_line,
+                'seconds': elapsed,
+                'text': str_line
+            })
+
+        return {'stages': dict_stages, 'slowest_lines': arr_lines}
+
+    def log_summary(self, n_lines=10):
+        dict_summary = self.summary(n_lines)
+
+        LOGGER.info('{0:26} {1:>8} {2:>10} {3:>10}'.format(
+            _('Stage'), _('Calls'), _('Total ms'), _('Self ms')))
+        for str_name in PROFILE_STAGES:
+            dict_stage = dict_summary['stages'].get(str_name)
+            if dict_stage:
+                LOGGER.info('{0:26} {1:>8} {2:>10.1f} {3:>10.1f}'.format(
+                    str_name, dict_stage['calls'],
+                    dict_stage['total_s'] * 1000,
+                    dict_stage['self_s'] * 1000))
+
+        if dict_summary['slowest_lines']:
+            LOGGER.info(_('Slowest lines:'))
+        for dict_line in dict_summary['slowest_lines']:
+            LOGGER.info('{0:>5} {1:>8.3f} ms  {2}'.format(
+                dict_line['line'], dict_line['seconds'] * 1000,
+                dict_line['text'][:60]))
+
+    def save(self, p_file, n_lines=10):
+        """
+            Saves the summary as JSON, with the calls as trace events, so it
+            can also be opened with chrome://tracing or Perfetto
+        """
+
+        import json
+
+        dict_profile = self.summary(n_lines)
+        dict_profile['displayTimeUnit'] = 'ms'
+        dict_profile['traceEvents'] = []
+        i_pid = os.getpid()
+        for str_name, t_call, elapsed in self.events or []:
+            dict_profile['traceEvents'].append({
+                'name': str_name,
+                'cat': 'txt2nextbasic',
+                'ph': 'X',
+                'ts': round((t_call - self.t_start) * 1e6, 3),
+                'dur': round(elapsed * 1e6, 3),
+                'pid': i_pid,
+                'tid': 1
+            })
+
+        with open(p_file, 'w') as f:
+            json.dump(dict_profile, f)
 
 
 class Plus3DosFileHeader(object):
@@ -827,12 +1805,8 @@ class Plus3DosFileHeader(object):
         self.offset = length
 
     def make_bin(self):
-        arr_bytes = (self.filetype).to_bytes(1, 'little')
-        arr_bytes += (self.length).to_bytes(2, 'little')
-        arr_bytes += (self.load_addr).to_bytes(2, 'little')
-        arr_bytes += (self.offset).to_bytes(2, 'little')
-        arr_bytes += b'\x00'
-        return arr_bytes
+        return struct.pack(BASIC_HEADER_FORMAT, self.filetype, self.length,
+                           self.load_addr, self.offset)
 
 
 # Constants
@@ -962,30 +1936,72 @@ TOKENS = {
     'TO': [204, True]
 }
 
-CHARS = {
-    '£': '`',
-    '©': '\x7f',
-    '\u259D': '\x81',  # Quadrant upper right
-    '\u2598': '\x82',  # Quadrant upper left
-    '\u2580': '\x83',  # Upper half block
-    '\u2597': '\x84',  # Quadrant lower right
-    '\u2590': '\x85',  # Right half block
-    '\u259A': '\x86',  # Quadrant upper left and lower right
-    '\u259C': '\x87',  # Quadrant upper left and upper right and lower right
-    '\u2596': '\x88',  # Quadrant lower left
-    '\u259E': '\x89',  # Quadrant upper right and lower left
-    '\u258C': '\x8a',  # Left half block
-    '\u259B': '\x8b',  # Quadrant upper left and upper right and lower left
-    '\u2584': '\x8c',  # Lower half block
-    '\u259F': '\x8d',  # Quadrant upper right and lower left and lower right
-    '\u2599': '\x8e',  # Quadrant upper left and lower left and lower right
-    '\u2588': '\x8f'  # Full block
-}
-
-PRENUM = ' =(,+-*/<>#;~'
-for str_tok in TOKENS:
-    if TOKENS[str_tok][1]:
-        PRENUM += chr(TOKENS[str_tok][0])
+# Lexer token kinds
+TK_LINE = 'line'
+TK_SEP = 'sep'
+TK_STRING = 'string'
+TK_DOT = 'dot'
+TK_CODE = 'code'
+TK_NUMBER = 'number'
+TK_COMMENT = 'comment'
+
+# Regular expressions and keyword tables, made by load_tables() when the
+# first line is encoded
+RE_LINENUMBER = None
+RE_COMMENT_START = None
+RE_COMMENT_AFTER = None
+RE_STATEMENTS = None
+RE_WORDS = None
+RE_PARAMS = None
+RE_NUMCHARS = None
+RE_BINARY = None
+RE_INTEGER = None
+RE_NUMLIST = None
+RE_LISTITEM = None
+RE_NAME = None
+RE_THEN_COMMENT = None
+RE_NO_RENAME = None
+PRENUM = None  # Characters after which a number can start
+KEYWORDS = None  # Keyword index, word to Sinclair ASCII
+SPACED_TOKENS = None  # Tokens with spaces, their regular expressions, etc.
+
+NUMBER_CACHE = {}  # Numbers already converted by convert_number()
+NUMBER_CACHE_SIZE = 4096
+
+STDIO = Path('-')  # Path for stdin or stdout
+
+# Encoder stages timed by Profiler, in pipeline order
+PROFILE_STAGES = [
+    'proc_basic', 'lex_line', 'extract_linenumber', 'convert_char',
+    'extract_comment', 'process_tokens', 'process_params', 'lex_numbers',
+    'convert_number', 'Plus3DosFile.make_header', 'Plus3DosFile.make_bin'
+]
+
+# +3DOS header: signature, soft-EOF, issue, version and file length
+PLUS3DOS_FORMAT = '<9sBBI'
+PLUS3DOS_SIGNATURE = b'PLUS3DOS\x1A'
+# +3 BASIC header: file type, length, autostart line, offset and a 0
+BASIC_HEADER_FORMAT = '<BHHHx'
+# Buffers given to each os.writev call (IOV_MAX on Linux and macOS)
+WRITEV_BUFFERS = 1024
+
+# Programs with fewer lines are always encoded serially, as starting a pool
+# of processes takes longer than encoding them
+PARALLEL_LINES = 2000
+
+# Kinds of changes made by Minifier, in the order shown
+MINIFY_KINDS = ['comments', 'spaces', 'names', 'numbers']
+# THEN, ELSE (a statement must follow)
+MINIFY_THEN = '\xcb\x98'
+# Numbers not changed after: #, OPEN #, CLOSE #, BIN
+MINIFY_KEEP_AFTER = '#\xd3\xd4\xc4'
+# A number can be an integer expression (e.g. %10) after =, (, etc., TO,
+# STEP or a standard statement, and if followed by the end of statement, an
+# item separator, TO, STEP, THEN, ELSE or the end of line
+MINIFY_INT_BEFORE = '=(,;\'\xcc\xcd' + ''.join(
+    chr(i_token) for i_token in range(0xce, 0x100) if i_token not in (0xd3,
+                                                                      0xd4))
+MINIFY_INT_AFTER = ':,);\'\r\xcb\xcc\xcd\x98'
 
 if __name__ == '__main__':
     main()
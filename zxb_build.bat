@@ -42,33 +42,35 @@ IF NOT %RETVAL% EQU 0 (
     exit /b %RETVAL%
 )
 
+SET CACHEFILE=%FILEDIR%build\.zxb_cache.json
+
+IF /I "%4"=="--watch" (
+	py -3 "%MYPATH%\zxb_watch.py" %MODE% %ACTION% "%FULLFILE%"
+	exit /b !ERRORLEVEL!
+)
+
 IF /I "%MODE%"=="zxbasic" (
-	ECHO Compiling %FILENAME%.bas...
-	mkdir "%FILEDIR%\build" 2>NUL
-	py -3 "%MYPATH%\zxbasic\zxb.py" -O 2 "%FULLFILE%" -o "%FILEDIR%\build\%FILENAME%.bin"
-	SET RETVAL=%ERRORLEVEL%
-	IF NOT %RETVAL% EQU 0 (
+	py -3 "%MYPATH%\zxb_cache.py" build -c "%CACHEFILE%" -o "%FILEDIR%\build\%FILENAME%.bin" -t "%MYPATH%\zxbasic\zxb.py" -O "-O 2" -I "%MYPATH%\zxbasic\library" -I "%MYPATH%\zxbasic\library-asm" -u "%FILENAME%.bin is up to date" -b "Compiling %FILENAME%.bas..." "%FULLFILE%" -- py -3 "%MYPATH%\zxbasic\zxb.py" -O 2 "%FULLFILE%" -o "%FILEDIR%\build\%FILENAME%.bin"
+	SET RETVAL=!ERRORLEVEL!
+	IF NOT !RETVAL! EQU 0 (
 		ECHO Compilation Error^^!^^!^^!
-		exit /b %RETVAL%
+		exit /b !RETVAL!
 	)
 
-	ECHO Creating Launcher...
-	py -3 "%MYPATH%\txt2nextbasic.py" -n "%FILENAME%.bin" -o "%FILEDIR%\build\%FILENAME%.bas"
-	SET RETVAL=%ERRORLEVEL%
-	IF NOT %RETVAL% EQU 0 (
+	py -3 "%MYPATH%\zxb_cache.py" build -c "%CACHEFILE%" -o "%FILEDIR%\build\%FILENAME%.bas" -t "%MYPATH%\txt2nextbasic.py" -t "%MYPATH%\zxn_codec.py" -O "-n %FILENAME%.bin" -u "%FILENAME%.bas is up to date" -b "Creating Launcher..." -- py -3 "%MYPATH%\txt2nextbasic.py" -n "%FILENAME%.bin" -o "%FILEDIR%\build\%FILENAME%.bas"
+	SET RETVAL=!ERRORLEVEL!
+	IF NOT !RETVAL! EQU 0 (
 		ECHO Launcher Creation Error^^!^^!^^!
-		exit /b %RETVAL%
+		exit /b !RETVAL!
 	)
 )
 
 IF /I "%MODE%"=="nextbasic" (
-	ECHO Converting %FILENAME%.bas...
-	mkdir "%FILEDIR%\build" 2>NUL
-	py -3 "%MYPATH%\txt2nextbasic.py" -i "%FULLFILE%" -o "%FILEDIR%\build\%FILENAME%.bas"
-	SET RETVAL=%ERRORLEVEL%
-	IF NOT %RETVAL% EQU 0 (
+	py -3 "%MYPATH%\zxb_cache.py" build -c "%CACHEFILE%" -o "%FILEDIR%\build\%FILENAME%.bas" -t "%MYPATH%\txt2nextbasic.py" -t "%MYPATH%\zxn_codec.py" -u "%FILENAME%.bas is up to date" -b "Converting %FILENAME%.bas..." "%FULLFILE%" -- py -3 "%MYPATH%\txt2nextbasic.py" -i "%FULLFILE%" -o "%FILEDIR%\build\%FILENAME%.bas"
+	SET RETVAL=!ERRORLEVEL!
+	IF NOT !RETVAL! EQU 0 (
 		ECHO Conversion Error^^!^^!^^!
-		exit /b %RETVAL%
+		exit /b !RETVAL!
 	)
 )
 
@@ -80,39 +82,41 @@ IF /I "%ACTION%"=="runZEsarUX" (
 	SET IMAGEPATH=%MYPATH%\ZEsarUX\tbblue.mmc
 	GOTO CopyFiles 
 )
+IF /I "%ACTION%"=="reloadZEsarUX" (
+	SET IMAGEPATH=%MYPATH%\ZEsarUX\tbblue.mmc
+	GOTO CopyFiles 
+)
 GOTO End
 
 IF /I "%ACTION%"=="runCspect" (
 
 :CopyFiles
 	ECHO Copying files...
-	"%MYPATH%\hdfmonkey.exe" put "%IMAGEPATH%" "%FILEDIR%\build\%FILENAME%.bas" /devel/test.bas
-	SET RETVAL=%ERRORLEVEL%
-	IF NOT %RETVAL% EQU 0 (
-		ECHO Copy Error^^!^^!^^! "(%FILENAME%.bin)"
-		exit /b %RETVAL%
-	)
-
+	SET PUTARGS=-a "%FILEDIR%\build\%FILENAME%.bas" /devel/test.bas
 	IF /I "%MODE%"=="zxbasic" (
-		"%MYPATH%\hdfmonkey.exe" put "%IMAGEPATH%" "%FILEDIR%\build\%FILENAME%.bin" /devel/
-		SET RETVAL=%ERRORLEVEL%
-		IF NOT %RETVAL% EQU 0 (
-			ECHO Copy Error^^!^^!^^! "(%FILENAME%.bin)"
-			exit /b %RETVAL%
-		)
+		SET PUTARGS=!PUTARGS! -a "%FILEDIR%\build\%FILENAME%.bin" /devel/
 	)
-
-
 	IF EXIST "%FILEDIR%%FILENAME%.filelist" (
-		FOR /f "tokens=*" %%F IN (%FILEDIR%%FILENAME%.filelist) DO (
-			"%MYPATH%\hdfmonkey.exe" put "%IMAGEPATH%" "%FILEDIR%\%%F" /devel/
-			SET RETVAL=%ERRORLEVEL%
-			IF NOT %RETVAL% EQU 0 (
-				ECHO Copy Error^^!^^!^^! "(%%F)"
-				exit /b %RETVAL%
-			)
-		)
+		SET PUTARGS=!PUTARGS! -d /devel/ -f "%FILEDIR%%FILENAME%.filelist"
+	)
+	py -3 "%MYPATH%\zxb_cache.py" put -c "%CACHEFILE%" -k "%MYPATH%\hdfmonkey.exe" -m "%IMAGEPATH%" !PUTARGS!
+	SET RETVAL=!ERRORLEVEL!
+	IF NOT !RETVAL! EQU 0 (
+		ECHO Copy Error^^!^^!^^!
+		exit /b !RETVAL!
+	)
+
+IF /I "%ACTION%"=="reloadZEsarUX" (
+	ECHO Reloading ZEsarUX...
+	py -3 "%MYPATH%\zxn_remote.py" reload -s "%FULLFILE%"
+	SET RETVAL=!ERRORLEVEL!
+	IF !RETVAL! EQU 2 (
+		SET ACTION=runZEsarUX
+	) ELSE IF NOT !RETVAL! EQU 0 (
+		ECHO Emulator Error^^!^^!^^!
+		exit /b !RETVAL!
 	)
+)
 
 IF /I "%ACTION%"=="runCspect" (
 	ECHO Running Cspect...
@@ -26,6 +26,7 @@ filename="${filename%.*}"
 filedir=`dirname "$fullfile"`
 
 python3bin=python3
+cachefile="$filedir/build/.zxb_cache.json"
 
 if [ -x "$(command -v gettext)" ]; then
     . gettext.sh
@@ -56,33 +57,32 @@ if [ $retval != 0 ]; then
     exit $retVal
 fi
 
+if [[ $4 == "--watch" ]]; then
+    exec "$python3bin" "$mypath/zxb_watch.py" "$mode" "$action" "$fullfile"
+fi
+
 if [[ $mode == "zxbasic" ]]; then
-    echo $(eval_gettext "Compiling \$filename")
-    mkdir -p "$filedir/build"
-    "$python3bin" "$mypath/zxbasic/zxb.py" -O 2 "$fullfile" -o "$filedir/build/$filename.bin"
+    "$python3bin" "$mypath/zxb_cache.py" build -c "$cachefile" -o "$filedir/build/$filename.bin" -t "$mypath/zxbasic/zxb.py" -O "-O 2" -I "$mypath/zxbasic/library" -I "$mypath/zxbasic/library-asm" -u "$(eval_gettext "\$filename.bin is up to date")" -b "$(eval_gettext "Compiling \$filename")" "$fullfile" -- "$python3bin" "$mypath/zxbasic/zxb.py" -O 2 "$fullfile" -o "$filedir/build/$filename.bin"
     retval=$?
     if [ $retval != 0 ]; then
         echo $(gettext "Error while compiling")
-        exit $retVal
+        exit $retval
     fi
-    
-    echo $(gettext "Creating Launcher")
-    "$python3bin" "$mypath/txt2nextbasic.py" -n "$filename.bin" -o "$filedir/build/$filename.bas"
+
+    "$python3bin" "$mypath/zxb_cache.py" build -c "$cachefile" -o "$filedir/build/$filename.bas" -t "$mypath/txt2nextbasic.py" -t "$mypath/zxn_codec.py" -O "-n $filename.bin" -u "$(eval_gettext "\$filename.bas is up to date")" -b "$(gettext "Creating Launcher")" -- "$python3bin" "$mypath/txt2nextbasic.py" -n "$filename.bin" -o "$filedir/build/$filename.bas"
     retval=$?
     if [ $retval != 0 ]; then
         echo $(gettext "Error while creating launcher")
-        exit $retVal
+        exit $retval
     fi
 fi
 
 if [[ $mode == "nextbasic" ]]; then
-    echo $(eval_gettext "Converting \$filename")
-    mkdir -p "$filedir/build"
-    "$python3bin" "$mypath/txt2nextbasic.py" -i "$fullfile" -o "$filedir/build/$filename.bas"
+    "$python3bin" "$mypath/zxb_cache.py" build -c "$cachefile" -o "$filedir/build/$filename.bas" -t "$mypath/txt2nextbasic.py" -t "$mypath/zxn_codec.py" -u "$(eval_gettext "\$filename.bas is up to date")" -b "$(eval_gettext "Converting \$filename")" "$fullfile" -- "$python3bin" "$mypath/zxn_daemon.py" build -i "$fullfile" -o "$filedir/build/$filename.bas"
     retval=$?
     if [ $retval != 0 ]; then
         echo $(gettext "Error while converting")
-        exit $retVal
+        exit $retval
     fi
 fi
 
@@ -93,7 +93,7 @@ fi
 shopt -u nocasematch
 
 shopt -s nocasematch
-if [[ $action == "runZEsarUX" ]]; then
+if [[ $action == "runZEsarUX" ]] || [[ $action == "reloadZEsarUX" ]]; then
     if [[ "$OSTYPE" == "darwin"* ]]; then
         imagepath="$mypath/ZEsarUX.app/Contents/Resources/tbblue.mmc"
     else
@@ -103,33 +103,34 @@ fi
 shopt -u nocasematch
 
 shopt -s nocasematch
-if [[ $action == "runCspect" ]] || [[ $action == "runZEsarUX" ]]; then
+if [[ $action == "runCspect" ]] || [[ $action == "runZEsarUX" ]] || [[ $action == "reloadZEsarUX" ]]; then
     echo $(gettext "Copying files")
-    "$mypath/hdfmonkey" put "$imagepath" "$filedir/build/$filename.bas" /devel/test.bas
-    retval=$?
-    if [ $retval -ne 0 ]; then
-        echo $(eval_gettext "Copy Error (\$filename.bas)")
-        exit $retVal
-    fi
-    
+    putargs=(-a "$filedir/build/$filename.bas" /devel/test.bas)
     if [[ $mode == "zxbasic" ]]; then
-        "$mypath/hdfmonkey" put "$imagepath" "$filedir/build/$filename.bin" /devel/
-        retval=$?
-        if [ $retval -ne 0 ]; then
-            echo $(eval_gettext "Copy Error (\$filename.bin)")
-            exit $retVal
-        fi
+        putargs+=(-a "$filedir/build/$filename.bin" /devel/)
     fi
-    
     if [[ -f "$filedir/$filename.filelist" ]]; then
-        while read line; do
-            "$mypath/hdfmonkey" put "$imagepath" "$filedir/${line%$'\r'}" /devel/
-            retval=$?
-            if [ $retval -ne 0 ]; then
-                echo $(eval_gettext "Copy Error (\$line)")
-                exit $retVal
-            fi
-        done < "$filedir/$filename.filelist"
+        putargs+=(-d /devel/ -f "$filedir/$filename.filelist")
+    fi
+    "$python3bin" "$mypath/zxb_cache.py" put -c "$cachefile" -k "$mypath/hdfmonkey" -m "$imagepath" "${putargs[@]}"
+    retval=$?
+    if [ $retval -ne 0 ]; then
+        echo $(gettext "Copy Error")
+        exit $retval
+    fi
+fi
+shopt -u nocasematch
+
+shopt -s nocasematch
+if [[ $action == "reloadZEsarUX" ]]; then
+    echo $(gettext "Reloading ZEsarUX")
+    "$python3bin" "$mypath/zxn_remote.py" reload -s "$fullfile"
+    retval=$?
+    if [ $retval -eq 2 ]; then
+        action=runZEsarUX
+    elif [ $retval -ne 0 ]; then
+        echo $(gettext "Emulator Error")
+        exit $retval
     fi
 fi
 shopt -u nocasematch
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Incremental Build Cache for zxb_build scripts
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Commands:
+      check: exit code is 0 if the output is up to date, 1 if not
+      store: saves the state of an output after it has been built
+      build: runs the command given after --, unless the output is up to
+             date, and then saves its state (check and store in one go, so
+             each build stage only starts Python once when nothing changed)
+      put:   copies files to a disk image, skipping the files already
+             copied and not changed since then. FAT16 and FAT32 images are
+             written directly, all the files at once (zxn_image), and any
+             other image with hdfmonkey
+"""
+
+import sys
+import os
+import logging
+import hashlib
+import json
+import re
+import subprocess
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxb_cache.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    build_cache = BuildCache(arg_data['cache'])
+    if arg_data['command'] == 'put':
+        retval = put_files(build_cache, arg_data['hdfmonkey'],
+                           arg_data['image'], arg_data['copies'])
+    else:
+        str_key = build_cache.make_key(arg_data['options'], arg_data['tools'],
+                                       arg_data['sources'],
+                                       arg_data['include_dirs'])
+        if arg_data['command'] == 'check':
+            retval = 0
+            if not build_cache.is_built(arg_data['output'], str_key):
+                retval = 1
+        elif arg_data['command'] == 'build':
+            retval = build_output(build_cache, arg_data['output'], str_key,
+                                  arg_data['build_command'],
+                                  arg_data['uptodate'], arg_data['building'])
+        else:
+            build_cache.set_built(arg_data['output'], str_key)
+            retval = 0
+
+    build_cache.save()
+    sys.exit(retval)
+
+
+# Functions
+# ---------
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='zxb_build Build Cache')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-c',
+                        '--cache',
+                        required=True,
+                        action='store',
+                        dest='cache_path',
+                        help='Cache file path')
+    common.add_argument('sources',
+                        nargs='*',
+                        help='Source files (or files to copy)')
+
+    build = argparse.ArgumentParser(add_help=False)
+    build.add_argument('-o',
+                       '--output',
+                       required=True,
+                       action='store',
+                       dest='output_path',
+                       help='Output file to check or store')
+    build.add_argument('-t',
+                       '--tool',
+                       action='append',
+                       dest='tools',
+                       help='Script used to build the output')
+    build.add_argument('-O',
+                       '--options',
+                       action='store',
+                       dest='options',
+                       help='Options used to build the output')
+    build.add_argument('-I',
+                       '--include',
+                       action='append',
+                       dest='include_dirs',
+                       help='Directory to search for #include files')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('check',
+                        parents=[common, build],
+                        help='Exit code is 0 if output is up to date')
+    commands.add_parser('store',
+                        parents=[common, build],
+                        help='Save the state of a built output')
+    build_cmd = commands.add_parser(
+        'build',
+        parents=[common, build],
+        help='Run the command after --, unless output is up to date')
+    build_cmd.add_argument('-u',
+                           '--uptodate',
+                           action='store',
+                           dest='uptodate',
+                           help='Message shown if output is up to date')
+    build_cmd.add_argument('-b',
+                           '--building',
+                           action='store',
+                           dest='building',
+                           help='Message shown before building')
+    put = commands.add_parser('put',
+                              parents=[common],
+                              help='Copy changed files to a disk image')
+    put.add_argument('-k',
+                     '--hdfmonkey',
+                     required=True,
+                     action='store',
+                     dest='hdfmonkey',
+                     help='hdfmonkey path')
+    put.add_argument('-m',
+                     '--image',
+                     required=True,
+                     action='store',
+                     dest='image_path',
+                     help='Disk image path')
+    put.add_argument('-d',
+                     '--dest',
+                     action='store',
+                     dest='dest',
+                     help='Destination path inside the image')
+    put.add_argument('-f',
+                     '--filelist',
+                     action='append',
+                     dest='filelists',
+                     help='File with a list of more files to copy')
+    put.add_argument('-a',
+                     '--add',
+                     action='append',
+                     nargs=2,
+                     metavar=('SOURCE', 'DEST'),
+                     dest='additions',
+                     help='Another file to copy, and its destination')
+
+    # The build command goes after --, as it is
+    arr_argv = sys.argv[1:]
+    arr_command = []
+    if '--' in arr_argv:
+        i_split = arr_argv.index('--')
+        arr_command = arr_argv[i_split + 1:]
+        arr_argv = arr_argv[:i_split]
+
+    arguments = parser.parse_args(arr_argv)
+
+    values = {}
+    values['command'] = arguments.command
+    values['cache'] = Path(arguments.cache_path)
+    arr_sources = [Path(s_path) for s_path in arguments.sources]
+
+    if arguments.command == 'put':
+        values['hdfmonkey'] = arguments.hdfmonkey
+        values['image'] = Path(arguments.image_path)
+        for s_filelist in arguments.filelists or []:
+            arr_sources += read_filelist(Path(s_filelist))
+        if arr_sources and not arguments.dest:
+            parser.error('the following arguments are required: -d/--dest')
+        values['copies'] = [(s_dest, [Path(s_source)])
+                            for s_source, s_dest in arguments.additions or []]
+        values['copies'].append((arguments.dest, arr_sources))
+    else:
+        values['output'] = Path(arguments.output_path)
+        values['tools'] = [Path(s_path) for s_path in arguments.tools or []]
+        values['options'] = arguments.options or ''
+        values['include_dirs'] = [
+            Path(s_path) for s_path in arguments.include_dirs or []
+        ]
+    if arguments.command == 'build':
+        if not arr_command:
+            parser.error('a build command is required after --')
+        values['build_command'] = arr_command
+        values['uptodate'] = arguments.uptodate
+        values['building'] = arguments.building
+
+    values['sources'] = arr_sources
+
+    return values
+
+
+def read_filelist(p_filelist):
+    """Returns the paths of the files named (one per line) in a .filelist"""
+
+    arr_paths = []
+    if p_filelist.is_file():
+        with open(p_filelist, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    arr_paths.append(p_filelist.parent / line)
+
+    return arr_paths
+
+
+def build_output(build_cache,
+                 p_output,
+                 str_key,
+                 arr_command,
+                 str_uptodate=None,
+                 str_building=None):
+    """
+        Runs a command to build an output, unless it is up to date, and then
+        saves the state of the output. Returns 0 or an error code
+    """
+
+    if build_cache.is_built(p_output, str_key):
+        if str_uptodate:
+            print(str_uptodate, flush=True)
+        return 0
+
+    if str_building:
+        print(str_building, flush=True)
+    p_output.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        retval = subprocess.call(arr_command)
+        if not retval:
+            build_cache.set_built(p_output, str_key)
+    except OSError as error:
+        str_msg = _('Build Error ({0})')
+        LOGGER.error(str_msg.format(error))
+        return 1
+
+    return retval
+
+
+def put_files(build_cache, hdfmonkey, p_image, arr_copies):
+    """
+        Copies (destination, files) pairs to an image, unless already there
+        and not changed. FAT16 and FAT32 images are opened once and written
+        directly, else each file is copied with hdfmonkey. Returns 0 or an
+        error code
+    """
+
+    try:
+        build_cache.check_image(p_image)
+    except OSError as error:
+        str_msg = _('Copy Error ({0})')
+        LOGGER.error(str_msg.format(error))
+        return 1
+
+    arr_pending = []
+    try:
+        for str_dest, arr_sources in arr_copies:
+            for p_source in arr_sources:
+                if build_cache.is_copied(p_image, str_dest, p_source):
+                    LOGGER.debug('Not changed: {0}'.format(p_source))
+                    continue
+                arr_pending.append((str_dest, p_source))
+    except OSError as error:
+        str_msg = _('Copy Error ({0})')
+        LOGGER.error(str_msg.format(error))
+        return 1
+
+    if not arr_pending:
+        return 0
+
+    import zxn_image
+
+    try:
+        fat_image = zxn_image.FatImage(p_image, b_write=True)
+    except (RuntimeError, ValueError):
+        fat_image = None  # Not a FAT image (e.g. HDF)
+    except OSError as error:
+        str_msg = _('Copy Error ({0})')
+        LOGGER.error(str_msg.format(error))
+        return 1
+
+    if fat_image is None:
+        for str_dest, p_source in arr_pending:
+            retval = subprocess.call(
+                [hdfmonkey, 'put',
+                 str(p_image),
+                 str(p_source), str_dest])
+            if retval:
+                str_msg = _('Copy Error ({0})')
+                LOGGER.error(str_msg.format(p_source))
+                return retval
+
+            build_cache.set_copied(p_image, str_dest, p_source)
+
+        build_cache.set_image(p_image)
+        return 0
+
+    with fat_image:
+        arr_files = []
+        try:
+            for str_dest, p_source in arr_pending:
+                if str_dest.endswith('/'):
+                    str_dest += p_source.name
+                with open(p_source, 'rb') as f:
+                    arr_files.append((str_dest, f.read()))
+        except OSError as error:
+            str_msg = _('Copy Error ({0})')
+            LOGGER.error(str_msg.format(error))
+            return 1
+
+        try:
+            for str_path in fat_image.put_files(arr_files):
+                LOGGER.debug('Copied: {0}'.format(str_path))
+        except RuntimeError as error:
+            str_msg = _('Copy Error ({0})')
+            LOGGER.error(str_msg.format(error))
+            return 1
+
+    for str_dest, p_source in arr_pending:
+        build_cache.set_copied(p_image, str_dest, p_source)
+    build_cache.set_image(p_image)
+
+    return 0
+
+
+def tool_version(p_tool):
+    """Reads __MY_VERSION__ from a script, without importing it"""
+
+    with open(p_tool, 'rb') as f:
+        match_ver = RE_VERSION.search(f.read())
+    if match_ver:
+        return match_ver.group(1).decode('latin-1')
+    return ''
+
+
+# Classes
+# -------
+class BuildCache(object):
+    """
+        Persistent build state, stored as JSON. Keeps the content hashes of
+        files (trusted while size and modification time don't change), the
+        key used to build each output, and the files copied to each image
+        (trusted while the image file isn't changed by anything else)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        self.data = {
+            'version': 2,
+            'files': {},
+            'outputs': {},
+            'copies': {},
+            'images': {}
+        }
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.data['version']:
+                self.data = data
+        except (IOError, ValueError):
+            pass
+
+    def save(self):
+        if self.changed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+            os.replace(str(tmp_path), str(self.path))
+            self.changed = False
+
+    def file_info(self, path):
+        """Returns content hash and #include names of a file"""
+
+        str_path = str(Path(path).resolve())
+        st = os.stat(str_path)
+        arr_stat = [st.st_size, st.st_mtime_ns]
+        arr_info = self.data['files'].get(str_path)
+        if arr_info and arr_info[0] == arr_stat:
+            return arr_info[1], arr_info[2]
+
+        with open(str_path, 'rb') as f:
+            bindata = f.read()
+        str_hash = hashlib.sha1(bindata).hexdigest()
+        arr_includes = [
+            b_name.decode('latin-1') for b_name in RE_INCLUDE.findall(bindata)
+        ]
+        self.data['files'][str_path] = [arr_stat, str_hash, arr_includes]
+        self.changed = True
+        return str_hash, arr_includes
+
+    def make_key(self, options, arr_tools, arr_sources, arr_include_dirs=()):
+        """
+            Build key from options, tool versions and hashes, and hashes of
+            sources and the files they #include
+        """
+
+        arr_key = ['options', options]
+        for p_tool in arr_tools:
+            str_hash, _arr_includes = self.file_info(p_tool)
+            arr_key += ['tool', p_tool.name, tool_version(p_tool), str_hash]
+
+        for p_source in self.find_sources(arr_sources, arr_include_dirs):
+            str_hash, _arr_includes = self.file_info(p_source)
+            arr_key += ['source', str(p_source.resolve()), str_hash]
+
+        return hashlib.sha1('\0'.join(arr_key).encode('utf-8')).hexdigest()
+
+    def find_sources(self, arr_sources, arr_include_dirs=()):
+        """Returns the sources and the files they #include, recursively"""
+
+        arr_found = []
+        arr_pending = list(arr_sources)
+        arr_done = set()
+        while arr_pending:
+            p_source = arr_pending.pop(0)
+            str_path = str(p_source.resolve())
+            if str_path in arr_done:
+                continue
+            arr_done.add(str_path)
+            arr_found.append(p_source)
+
+            _str_hash, arr_includes = self.file_info(p_source)
+            for str_name in arr_includes:
+                for p_dir in [p_source.parent] + list(arr_include_dirs):
+                    p_include = p_dir / str_name
+                    if p_include.is_file():
+                        arr_pending.append(p_include)
+                        break
+
+        return arr_found
+
+    def is_built(self, p_output, str_key):
+        """True if output exists and was built with the same key"""
+
+        arr_entry = self.data['outputs'].get(str(p_output.resolve()))
+        if not arr_entry or arr_entry[0] != str_key:
+            return False
+        try:
+            st = os.stat(str(p_output))
+        except OSError:
+            return False
+        return arr_entry[1] == [st.st_size, st.st_mtime_ns]
+
+    def set_built(self, p_output, str_key):
+        st = os.stat(str(p_output))
+        self.data['outputs'][str(p_output.resolve())] = [
+            str_key, [st.st_size, st.st_mtime_ns]
+        ]
+        self.changed = True
+
+    def copy_key(self, p_image, str_dest, p_source):
+        # The same image and the same destination
+        return '{0}|{1}'.format(
+            p_image.resolve(),
+            str_dest + ('/' + p_source.name if str_dest.endswith('/') else ''))
+
+    def image_state(self, p_image):
+        """Device, inode, size and modification time of an image file"""
+
+        st = os.stat(str(p_image))
+        return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def check_image(self, p_image):
+        """
+            Forgets the files copied to an image if it has changed since
+            the last copy (e.g. written by an emulator, restored or replaced)
+        """
+
+        str_image = str(p_image.resolve())
+        if self.data['images'].get(str_image) == self.image_state(p_image):
+            return
+
+        str_prefix = str_image + '|'
+        for str_copy in list(self.data['copies']):
+            if str_copy.startswith(str_prefix):
+                del self.data['copies'][str_copy]
+        self.data['images'].pop(str_image, None)
+        self.changed = True
+
+    def set_image(self, p_image):
+        """Saves the state of an image after copying files to it"""
+
+        self.data['images'][str(p_image.resolve())] = self.image_state(
+            p_image)
+        self.changed = True
+
+    def is_copied(self, p_image, str_dest, p_source):
+        """True if this same content was copied before to the image"""
+
+        str_copy = self.copy_key(p_image, str_dest, p_source)
+        str_hash, _arr_includes = self.file_info(p_source)
+        return self.data['copies'].get(str_copy) == str_hash
+
+    def set_copied(self, p_image, str_dest, p_source):
+        str_copy = self.copy_key(p_image, str_dest, p_source)
+        str_hash, _arr_includes = self.file_info(p_source)
+        self.data['copies'][str_copy] = str_hash
+        self.changed = True
+
+
+# Constants
+# ---------
+
+RE_INCLUDE = re.compile(
+    b'^[ \\t]*#[ \\t]*include[ \\t]+(?:once[ \\t]+)?[<"]([^>"\\r\\n]+)[>"]',
+    re.MULTILINE | re.IGNORECASE)
+RE_VERSION = re.compile(b'__MY_VERSION__\\s*=\\s*[\'"]([^\'"]*)[\'"]')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Watch Mode for zxb_build scripts
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Runs the same steps as zxb_build (compile with zxb, convert with
+    txt2nextbasic or create the launcher, and copy the results and the
+    files in the .filelist to the SD image), and then runs them again
+    every time the source, the files it #includes, its .filelist or the
+    files listed there change. Steps that are up to date (according to
+    the zxb_cache build cache) are skipped. The emulator is not started,
+    but, with the reloadZEsarUX action, a ZEsarUX that is already running
+    is told to reload the SD image and run the program after each copy
+    (zxn_remote).
+
+    Changes are found with inotify on Linux, and checking the size and
+    modification time of the files every few moments on other systems.
+"""
+
+import sys
+import os
+import logging
+import subprocess
+import select
+import struct
+import json
+import time
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxb_watch.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    builder = WatchBuild(arg_data['mode'], arg_data['action'],
+                         arg_data['input'])
+    watcher = make_watcher(arg_data['poll'], arg_data['interval'])
+    try:
+        watch(builder, watcher, arg_data['debounce'], arg_data['log'])
+    except KeyboardInterrupt:
+        LOGGER.info(_('Stopped'))
+
+
+# Functions
+# ---------
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='zxb_build Watch Mode')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+    parser.add_argument('mode',
+                        choices=['zxbasic', 'nextbasic'],
+                        help='Kind of source (as in zxb_build)')
+    parser.add_argument('action',
+                        help='build, or runCspect or runZEsarUX to copy' +
+                        ' the files to the SD image of the emulator, or' +
+                        ' reloadZEsarUX to also reload it')
+    parser.add_argument('input_path', help='Source .bas file')
+    parser.add_argument('-d',
+                        '--debounce',
+                        action='store',
+                        type=float,
+                        default=0.2,
+                        dest='debounce',
+                        help='Seconds without changes before building')
+    parser.add_argument('-p',
+                        '--poll',
+                        action='store_true',
+                        dest='poll',
+                        help='Check files periodically instead of inotify')
+    parser.add_argument('-P',
+                        '--interval',
+                        action='store',
+                        type=float,
+                        default=0.5,
+                        dest='interval',
+                        help='Seconds between checks when polling')
+    parser.add_argument('-l',
+                        '--log',
+                        action='store',
+                        dest='log_path',
+                        help='Append a JSON line per build to this file')
+
+    arguments = parser.parse_args()
+
+    values = {}
+    values['mode'] = arguments.mode
+    values['action'] = arguments.action
+    values['input'] = Path(arguments.input_path)
+    values['debounce'] = arguments.debounce
+    values['poll'] = arguments.poll
+    values['interval'] = arguments.interval
+    values['log'] = None
+    if arguments.log_path:
+        values['log'] = Path(arguments.log_path)
+
+    if not values['input'].is_file():
+        str_msg = _('Path not found: {0}')
+        LOGGER.error(str_msg.format(values['input']))
+        str_msg = _('Input path does not exist!')
+        raise IOError(str_msg)
+
+    return values
+
+
+def make_watcher(b_poll=False, interval=0.5):
+    """Returns an inotify watcher if possible, or else a polling one"""
+
+    if not b_poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as error:
+            str_msg = _('inotify not available ({0}), polling files')
+            LOGGER.warning(str_msg.format(error))
+
+    return PollWatcher(interval)
+
+
+def image_path(action):
+    """SD image used by an emulator, as in zxb_build, or None"""
+
+    if action.lower() == 'runcspect':
+        return MY_DIR / 'CSpect' / 'systemnext.img'
+    if action.lower() in ('runzesarux', 'reloadzesarux'):
+        if sys.platform == 'darwin':
+            return MY_DIR / 'ZEsarUX.app' / 'Contents' / 'Resources' / \
+                'tbblue.mmc'
+        return MY_DIR / 'ZEsarUX' / 'tbblue.mmc'
+    return None
+
+
+def watch(builder, watcher, debounce=0.2, p_log=None):
+    """
+        Builds, and then builds again each time that the watched files
+        change, reporting the time from the change to the finished build
+    """
+
+    str_msg = _('Building {0}')
+    LOGGER.info(str_msg.format(builder.p_source.name))
+    builder.build()
+    t_last = time.time()
+    arr_paths = builder.watched_paths()
+    watcher.set_paths(arr_paths)
+    str_msg = _('Watching {0} files (Ctrl+C to stop)')
+    LOGGER.info(str_msg.format(len(arr_paths)))
+
+    while True:
+        set_changed = watcher.wait()
+        t_detect = time.time()
+        while True:  # Wait until saving has finished
+            set_more = watcher.wait(debounce)
+            if not set_more:
+                break
+            set_changed |= set_more
+
+        t_change = change_time(set_changed, t_detect, t_last)
+        for str_path in sorted(set_changed):
+            str_msg = _('Changed: {0}')
+            LOGGER.info(str_msg.format(str_path))
+
+        t_start = time.time()
+        arr_stages = builder.build()
+        t_last = time.time()
+        arr_paths = builder.watched_paths()
+        watcher.set_paths(arr_paths)
+
+        latency = int((t_last - t_change) * 1000)
+        if arr_stages is None:
+            str_msg = _('Build failed, {0} ms after the change')
+            LOGGER.error(str_msg.format(latency))
+        elif arr_stages:
+            str_msg = _('Rebuilt ({0}) in {1} ms, {2} ms after the change')
+            LOGGER.info(
+                str_msg.format(', '.join(arr_stages),
+                               int((t_last - t_start) * 1000), latency))
+        else:
+            LOGGER.info(_('Nothing to rebuild'))
+
+        if p_log:
+            dict_log = {
+                'time': round(t_last, 3),
+                'changed': sorted(set_changed),
+                'stages': arr_stages,
+                'ok': arr_stages is not None,
+                'build_ms': int((t_last - t_start) * 1000),
+                'latency_ms': latency
+            }
+            with open(p_log, 'a') as f:
+                f.write(json.dumps(dict_log) + '\n')
+
+
+def change_time(set_changed, t_detect, t_last):
+    """
+        Time of the first change: the oldest modification time of the
+        changed files, if it is before the change was detected (polling)
+        but after the previous build finished
+    """
+
+    t_change = t_detect
+    for str_path in set_changed:
+        try:
+            t_change = min(t_change, os.stat(str_path).st_mtime)
+        except OSError:
+            pass
+
+    return max(t_change, t_last)
+
+
+# Classes
+# -------
+class WatchBuild(object):
+    """
+        The zxb_build steps for one source file, run in-process and using
+        the same build cache, so each one only runs if it is not up to date
+    """
+    def __init__(self, mode, action, p_source):
+        import zxb_cache
+
+        self.zxb_cache = zxb_cache
+        self.mode = mode
+        self.p_source = p_source
+        self.name = p_source.stem
+        self.p_build = p_source.parent / 'build'
+        self.p_filelist = p_source.with_suffix('.filelist')
+        self.p_image = image_path(action)
+        self.b_reload = action.lower() == 'reloadzesarux'
+        self.cache = zxb_cache.BuildCache(self.p_build / '.zxb_cache.json')
+
+    def watched_paths(self):
+        """Files that trigger a new build when changed"""
+
+        arr_paths = [self.p_source]
+        if self.mode == 'zxbasic':
+            try:
+                arr_paths = self.cache.find_sources([self.p_source],
+                                                    ZXB_INCLUDE_DIRS)
+            except OSError:
+                pass  # Source is being replaced, watch it alone by now
+        arr_paths.append(self.p_filelist)
+        arr_paths += self.zxb_cache.read_filelist(self.p_filelist)
+
+        return arr_paths
+
+    def build(self):
+        """Runs the steps needed. Returns their names, or None on error"""
+
+        arr_stages = []
+        p_bas = self.p_build / (self.name + '.bas')
+        p_bin = self.p_build / (self.name + '.bin')
+        try:
+            self.p_build.mkdir(parents=True, exist_ok=True)
+            if self.mode == 'zxbasic':
+                if self.run_stage(p_bin, '-O 2', [ZXB_PATH], [self.p_source],
+                                  ZXB_INCLUDE_DIRS, self.compile):
+                    arr_stages.append('compile')
+                str_options = '-n {0}.bin'.format(self.name)
+                if self.run_stage(p_bas, str_options, CONVERTER_PATHS, [], [],
+                                  self.make_launcher):
+                    arr_stages.append('launcher')
+            elif self.run_stage(p_bas, '', CONVERTER_PATHS, [self.p_source],
+                                [], self.convert):
+                arr_stages.append('convert')
+
+            if self.p_image:
+                arr_copies = [('/devel/test.bas', [p_bas])]
+                if self.mode == 'zxbasic':
+                    arr_copies.append(('/devel/', [p_bin]))
+                arr_copies.append(
+                    ('/devel/',
+                     self.zxb_cache.read_filelist(self.p_filelist)))
+                if self.copy(arr_copies):
+                    arr_stages.append('copy')
+                    if self.b_reload and self.reload():
+                        arr_stages.append('reload')
+        except Exception as error:
+            LOGGER.error(error)
+            arr_stages = None
+        finally:
+            self.cache.save()
+
+        return arr_stages
+
+    def run_stage(self, p_output, options, arr_tools, arr_sources,
+                  arr_include_dirs, func_build):
+        """Builds p_output with func_build, if not up to date"""
+
+        str_key = self.cache.make_key(options, arr_tools, arr_sources,
+                                      arr_include_dirs)
+        if self.cache.is_built(p_output, str_key):
+            return False
+
+        func_build(p_output)
+        self.cache.set_built(p_output, str_key)
+        return True
+
+    def compile(self, p_output):
+        str_msg = _('Compiling {0}')
+        LOGGER.info(str_msg.format(self.name))
+        retval = subprocess.call([
+            sys.executable,
+            str(ZXB_PATH), '-O', '2',
+            str(self.p_source), '-o',
+            str(p_output)
+        ])
+        if retval:
+            raise RuntimeError(_('Error while compiling'))
+
+    def make_launcher(self, p_output):
+        import txt2nextbasic
+
+        LOGGER.info(_('Creating Launcher'))
+        code = txt2nextbasic.make_launcher(self.name + '.bin')
+        with open(p_output, 'wb') as f:
+            f.write(txt2nextbasic.encode(code))
+
+    def convert(self, p_output):
+        import txt2nextbasic
+
+        str_msg = _('Converting {0}')
+        LOGGER.info(str_msg.format(self.name))
+        with open(self.p_source, 'r') as f:
+            code = f.readlines()
+        bin_data = txt2nextbasic.encode(code, False, [])
+        with open(p_output, 'wb') as f:
+            f.write(bin_data)
+
+    def copy(self, arr_copies):
+        """
+            Copies (destination, files) pairs not already in the image, all
+            at once
+        """
+
+        b_copied = any(not self.cache.is_copied(self.p_image, str_dest,
+                                                p_source)
+                       for str_dest, arr_sources in arr_copies
+                       for p_source in arr_sources)
+        if b_copied and self.zxb_cache.put_files(
+                self.cache, str(HDFMONKEY_PATH), self.p_image, arr_copies):
+            raise RuntimeError(_('Copy Error'))
+
+        return b_copied
+
+    def reload(self):
+        """Reloads the SD image in ZEsarUX, if it is running"""
+
+        import zxn_remote
+
+        retval = zxn_remote.reload(p_source=self.p_source)
+        if retval == 1:
+            raise RuntimeError(_('Reload Error'))
+        if retval == 2:
+            LOGGER.warning(_('ZEsarUX is not running'))
+
+        return retval == 0
+
+
+class PollWatcher(object):
+    """Finds changes comparing the size and modification time of files"""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.dict_stat = {}
+
+    @staticmethod
+    def stat(str_path):
+        try:
+            st = os.stat(str_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def set_paths(self, arr_paths):
+        """Files to watch. Already watched files keep their known state"""
+
+        dict_stat = {}
+        for path in arr_paths:
+            str_path = os.path.abspath(str(path))
+            if str_path in self.dict_stat:
+                dict_stat[str_path] = self.dict_stat[str_path]
+            else:
+                dict_stat[str_path] = self.stat(str_path)
+        self.dict_stat = dict_stat
+
+    def wait(self, timeout=None):
+        """Returns the files changed, or an empty set after timeout"""
+
+        t_end = None
+        if timeout is not None:
+            t_end = time.time() + timeout
+
+        while True:
+            set_changed = set()
+            for str_path, arr_stat in self.dict_stat.items():
+                arr_new = self.stat(str_path)
+                if arr_new != arr_stat:
+                    self.dict_stat[str_path] = arr_new
+                    set_changed.add(str_path)
+            if set_changed:
+                return set_changed
+
+            wait_time = self.interval
+            if t_end is not None:
+                wait_time = min(wait_time, t_end - time.time())
+                if wait_time <= 0:
+                    return set_changed
+            time.sleep(wait_time)
+
+
+class InotifyWatcher(object):
+    """
+        Finds changes with Linux inotify. Directories are watched, instead
+        of files, because many editors save by replacing the file
+    """
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            i_errno = ctypes.get_errno()
+            raise OSError(i_errno, os.strerror(i_errno))
+        self.dict_dirs = {}  # Watch descriptor -> directory
+        self.set_files = set()
+
+    def set_paths(self, arr_paths):
+        """Files to watch"""
+
+        self.set_files = set(
+            os.path.abspath(str(path)) for path in arr_paths)
+        set_dirs = set(
+            os.path.dirname(str_path) for str_path in self.set_files)
+
+        for wd, str_dir in list(self.dict_dirs.items()):
+            if str_dir not in set_dirs:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dict_dirs[wd]
+
+        set_watched = set(self.dict_dirs.values())
+        for str_dir in set_dirs - set_watched:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str_dir),
+                                             IN_MASK)
+            if wd < 0:
+                str_msg = 'Cannot watch {0}'
+                LOGGER.debug(str_msg.format(str_dir))
+            else:
+                self.dict_dirs[wd] = str_dir
+
+    def wait(self, timeout=None):
+        """Returns the files changed, or an empty set after timeout"""
+
+        t_end = None
+        if timeout is not None:
+            t_end = time.time() + timeout
+
+        while True:
+            wait_time = None
+            if t_end is not None:
+                wait_time = max(0, t_end - time.time())
+            arr_ready, _arr_w, _arr_x = select.select([self.fd], [], [],
+                                                      wait_time)
+            if not arr_ready:
+                return set()
+
+            set_changed = self.read_events()
+            if set_changed:
+                return set_changed
+
+    def read_events(self):
+        """Reads the pending events, returns the watched files changed"""
+
+        try:
+            b_data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        set_changed = set()
+        i_pos = 0
+        while i_pos + EVENT_LEN <= len(b_data):
+            wd, mask, _cookie, i_len = struct.unpack_from(
+                EVENT_FORMAT, b_data, i_pos)
+            b_name = b_data[i_pos + EVENT_LEN:i_pos + EVENT_LEN + i_len]
+            i_pos += EVENT_LEN + i_len
+
+            if mask & IN_Q_OVERFLOW:
+                set_changed |= self.set_files  # Events lost, check all
+            elif mask & IN_IGNORED:
+                self.dict_dirs.pop(wd, None)  # Directory was removed
+            elif wd in self.dict_dirs:
+                str_path = os.path.join(self.dict_dirs[wd],
+                                        os.fsdecode(b_name.rstrip(b'\0')))
+                if str_path in self.set_files:
+                    set_changed.add(str_path)
+
+        return set_changed
+
+
+# Constants
+# ---------
+
+MY_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+ZXB_PATH = MY_DIR / 'zxbasic' / 'zxb.py'
+ZXB_INCLUDE_DIRS = [
+    MY_DIR / 'zxbasic' / 'library', MY_DIR / 'zxbasic' / 'library-asm'
+]
+CONVERTER_PATHS = [MY_DIR / 'txt2nextbasic.py', MY_DIR / 'zxn_codec.py']
+HDFMONKEY_PATH = MY_DIR / 'hdfmonkey'
+if sys.platform == 'win32':
+    HDFMONKEY_PATH = MY_DIR / 'hdfmonkey.exe'
+
+# inotify event header (struct inotify_event) and flags
+EVENT_FORMAT = 'iIII'
+EVENT_LEN = struct.calcsize(EVENT_FORMAT)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_ATTRIB
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+NextBASIC Tools (single entry point)
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Usage:
+      zxn.py encode INPUT OUTPUT    text to NextBASIC (txt2nextbasic)
+      zxn.py decode INPUT OUTPUT    NextBASIC to text (nextbasic2txt)
+      zxn.py renumber INPUT [OUTPUT]
+                                    renumbers a text or NextBASIC file,
+                                    keeping a .bak copy if there is no
+                                    OUTPUT (rennextbasic)
+      zxn.py format INPUT [NAME]    formats a text file, keeping a .bak
+                                    copy (NAME is used for #program)
+      zxn.py COMMAND OPTIONS...     any other options are given to the
+                                    script of the command (e.g. zxn.py
+                                    encode -h, zxn.py decode -i a -o -)
+
+    Starting Python and loading modules takes most of the time when
+    converting small files, so only the script needed for the command is
+    loaded, and only when the command is known. Command line parsing,
+    translations and log output are only loaded when needed.
+"""
+
+import sys
+
+__MY_NAME__ = 'zxn.py'
+__MY_VERSION__ = '1.0.0'
+
+
+def main():
+    """Main Routine"""
+
+    arr_args = sys.argv[1:]
+    if not arr_args or arr_args[0] in ('-h', '--help'):
+        str_usage = __doc__.split('Usage:')[1].split('\n\n')[0]
+        print('Usage:{0}'.format(str_usage.rstrip()))
+        sys.exit(0 if arr_args else 2)
+    if arr_args[0] in ('-v', '--version'):
+        print('{0} {1}'.format(__MY_NAME__, __MY_VERSION__))
+        sys.exit(0)
+
+    str_command = arr_args.pop(0)
+    if str_command not in COMMANDS:
+        sys.stderr.write('{0}: unknown command: {1}\n'.format(
+            __MY_NAME__, str_command))
+        sys.exit(2)
+
+    i_min, i_max, str_module, arr_prefix = COMMANDS[str_command]
+    if i_min <= len(arr_args) <= i_max and not [
+            s_arg for s_arg in arr_args if s_arg.startswith('-')
+    ]:
+        sys.exit(run_command(str_command, arr_args))
+
+    # Anything else is done by the script of the command, as it is
+    module = __import__(str_module)
+    sys.argv = [module.__file__] + arr_prefix + arr_args
+    module.main()
+
+
+# Functions
+# ---------
+
+
+def run_command(str_command, arr_args):
+    """
+        Runs a command given only with paths, in this process. Returns the
+        exit code
+    """
+
+    from pathlib import Path
+
+    i_path = Path(arr_args[0])
+    str_arg = arr_args[1] if len(arr_args) > 1 else None
+
+    if str_command == 'encode':
+        import txt2nextbasic as module
+        func = module.convert_file
+        job = (i_path, Path(str_arg), False, False, [], False, False)
+    elif str_command == 'decode':
+        import nextbasic2txt as module
+        func = module.convert_file
+        job = (i_path, Path(str_arg), None)
+    elif str_command == 'renumber':
+        import rennextbasic as module
+        func = module.convert_file
+        job = (i_path, Path(str_arg) if str_arg else None, 10, False, None,
+               None)
+    else:
+        import nextbasic2txt as module
+        func = module.format_file
+        job = (i_path, str_arg)
+
+    module.LOGGER.addHandler(module.LOG_STREAM)
+    try:
+        func(job)
+    except Exception as error:
+        module.LOGGER.error('{0}: {1}'.format(i_path, error))
+        return 1
+
+    return 0
+
+
+# Constants
+# ---------
+
+# Command: paths allowed (min, max), script and options for its command line
+COMMANDS = {
+    'encode': (2, 2, 'txt2nextbasic', []),
+    'decode': (2, 2, 'nextbasic2txt', []),
+    'renumber': (1, 2, 'rennextbasic', []),
+    'format': (1, 2, 'zxn_daemon', ['format'])
+}
+
+if __name__ == '__main__':
+    main()
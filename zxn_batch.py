@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Batch Processing for NextBASIC Converters
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import os
+import logging
+import glob
+import time
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxn_batch.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+# Functions
+# ---------
+
+
+def find_files(arr_patterns, arr_ext=('.bas', ), arr_exclude=('build', )):
+    """
+        Expands directories (recursively) and glob patterns. Returns a sorted
+        list of (path, path relative to the pattern base) for each file found.
+        Only files with one of the extensions in arr_ext are taken from
+        directories, and directories with a name in arr_exclude are skipped
+    """
+
+    dict_files = {}
+    for str_pattern in arr_patterns:
+        p_pattern = Path(str_pattern)
+        if p_pattern.is_dir():
+            for str_dir, arr_dirs, arr_names in os.walk(str(p_pattern)):
+                arr_dirs[:] = [d for d in arr_dirs if d not in arr_exclude]
+                for str_name in arr_names:
+                    if os.path.splitext(str_name)[1].lower() in arr_ext:
+                        i_path = Path(str_dir) / str_name
+                        dict_files.setdefault(
+                            i_path, i_path.relative_to(p_pattern))
+        else:
+            # Base is the part of the pattern without wildcards
+            arr_parts = []
+            for str_part in p_pattern.parts:
+                if any(s_char in str_part for s_char in '*?['):
+                    break
+                arr_parts.append(str_part)
+            p_base = Path(*arr_parts) if arr_parts else Path('.')
+            if len(arr_parts) == len(p_pattern.parts):
+                p_base = p_pattern.parent  # A plain file name
+
+            for str_path in glob.glob(str_pattern, recursive=True):
+                i_path = Path(str_path)
+                if i_path.is_file():
+                    rel_path = i_path.relative_to(p_base)
+                    if not set(rel_path.parts[:-1]) & set(arr_exclude):
+                        dict_files.setdefault(i_path, rel_path)
+
+    return sorted(dict_files.items(), key=lambda item: str(item[0]))
+
+
+def run(func, arr_jobs, workers=None):
+    """
+        Calls func with each job, using a pool of processes. Returns a list
+        of (result, error message, log messages) with the same order as
+        arr_jobs, and the elapsed time. func must be a module level function
+        that returns the number of lines and bytes processed
+    """
+
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(arr_jobs))
+
+    arr_args = [(func, job) for job in arr_jobs]
+    t_start = time.perf_counter()
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = max(1, len(arr_jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            arr_results = list(
+                executor.map(run_job, arr_args, chunksize=chunksize))
+    else:
+        arr_results = [run_job(args) for args in arr_args]
+    elapsed = time.perf_counter() - t_start
+
+    return arr_results, elapsed
+
+
+def run_job(arr_args):
+    """
+        Runs one job, catching any error so the rest of the batch goes on.
+        Log messages of the job are kept, so they can be reported in order
+    """
+
+    func, job = arr_args
+
+    job_logger = logging.getLogger(func.__module__)
+    arr_handlers = job_logger.handlers
+    log_handler = ListHandler()
+    job_logger.handlers = [log_handler]
+    try:
+        return func(job), None, log_handler.records
+    except Exception as error:
+        str_error = '{0}: {1}'.format(type(error).__name__, error)
+        return None, str_error, log_handler.records
+    finally:
+        job_logger.handlers = arr_handlers
+
+
+def report(arr_files, arr_results, elapsed):
+    """
+        Logs errors for each file, always in the same order, and aggregate
+        throughput. Returns the number of files with errors
+    """
+
+    n_files = n_lines = n_bytes = n_errors = 0
+    for (i_path, _rel_path), (result, str_error,
+                              arr_records) in zip(arr_files, arr_results):
+        for i_level, str_record in arr_records:
+            LOGGER.log(i_level, '{0}: {1}'.format(i_path, str_record))
+        if str_error:
+            n_errors += 1
+            LOGGER.error('{0}: {1}'.format(i_path, str_error))
+        else:
+            n_files += 1
+            n_lines += result[0]
+            n_bytes += result[1]
+
+    elapsed = max(elapsed, 1e-9)
+    str_msg = _('{0} files ({1} lines, {2} bytes) in {3:.3f} s')
+    LOGGER.info(str_msg.format(n_files, n_lines, n_bytes, elapsed))
+    str_msg = _('{0:.1f} files/s, {1:.0f} lines/s, {2:.0f} bytes/s')
+    LOGGER.info(
+        str_msg.format(n_files / elapsed, n_lines / elapsed,
+                       n_bytes / elapsed))
+    if n_errors:
+        str_msg = _('{0} files with errors')
+        LOGGER.error(str_msg.format(n_errors))
+
+    return n_errors
+
+
+# Classes
+# -------
+class ListHandler(logging.Handler):
+    """Logging handler that keeps level and message of each record"""
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
@@ -0,0 +1,667 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Benchmarks for NextBASIC Converters
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Generates synthetic NextBASIC programs (always the same for a given
+    kind, size and seed) and times, using the Python API of the scripts:
+      encode:    txt2nextbasic.encode_lines()
+      decode:    nextbasic2txt.procbin()
+      renumber:  rennextbasic.renumber()
+      roundtrip: encode, decode and encode again (both results must match)
+
+    Programs with many lines can be bigger than what a +3DOS file allows
+    (64K), so encode and decode are measured without the +3DOS header.
+
+    Results can be saved as JSON, and compared with a previous run.
+
+    With --startup, it times instead running zxn.py (in a new Python
+    process) with a tiny program for each command. As most of that time is
+    the interpreter starting, what is measured (and compared with the
+    budget) is how much longer it takes than running an empty program.
+    The scripts are compiled first, so the time to compile them (only done
+    once, unless PYTHONDONTWRITEBYTECODE is set) isn't measured. The time
+    to load the standard modules that every command needs (pathlib and
+    logging) is shown too: it is part of the measured time but it can't be
+    made shorter by the scripts, and on some systems (e.g. Python 3.11 on a
+    slow machine) it's already near, or over, the default budget of 40 ms.
+"""
+
+import sys
+import os
+import logging
+import random
+import hashlib
+import platform
+import tracemalloc
+import json
+import time
+import gc
+import subprocess
+import tempfile
+import shutil
+import compileall
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+import txt2nextbasic
+import nextbasic2txt
+import rennextbasic
+import zxn_codec
+import zxn_program
+
+__MY_NAME__ = 'zxn_bench.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    if arg_data['startup']:
+        dict_run = run_startup(arg_data['repeat'], arg_data['seed'],
+                               arg_data['budget'])
+    else:
+        dict_run = run_benchmarks(arg_data['kinds'], arg_data['sizes'],
+                                  arg_data['stages'], arg_data['repeat'],
+                                  arg_data['seed'], arg_data['jobs'])
+    dict_run['label'] = arg_data['label']
+
+    retval = 0
+    if [r for r in dict_run['results'] if not r['ok']]:
+        retval = 1
+
+    if arg_data['output']:
+        with open(arg_data['output'], 'w') as f:
+            json.dump(dict_run, f, indent=1, sort_keys=True)
+
+    if arg_data['compare']:
+        with open(arg_data['compare'], 'r') as f:
+            dict_old = json.load(f)
+        if compare(dict_old, dict_run, arg_data['threshold']):
+            retval = 1
+
+    sys.exit(retval)
+
+
+# Functions
+# ---------
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='NextBASIC Benchmarks')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+    parser.add_argument('-k',
+                        '--kinds',
+                        action='store',
+                        dest='kinds',
+                        default=','.join(KINDS),
+                        help='Comma separated kinds of program ({0})'.format(
+                            ', '.join(KINDS)))
+    parser.add_argument('-n',
+                        '--lines',
+                        action='store',
+                        dest='sizes',
+                        default='100,1000,9999',
+                        help='Comma separated program sizes, in lines')
+    parser.add_argument('-s',
+                        '--stages',
+                        action='store',
+                        dest='stages',
+                        default=','.join(STAGES),
+                        help='Comma separated stages to time ({0})'.format(
+                            ', '.join(STAGES)))
+    parser.add_argument('-r',
+                        '--repeat',
+                        action='store',
+                        type=int,
+                        default=3,
+                        dest='repeat',
+                        help='Times to run each stage (best is kept)')
+    parser.add_argument('-S',
+                        '--seed',
+                        action='store',
+                        type=int,
+                        default=0,
+                        dest='seed',
+                        help='Seed for the generated programs')
+    parser.add_argument('-o',
+                        '--output',
+                        action='store',
+                        dest='output_path',
+                        help='Save results to this JSON file')
+    parser.add_argument('-c',
+                        '--compare',
+                        action='store',
+                        dest='compare_path',
+                        help='Compare with results in this JSON file')
+    parser.add_argument('-t',
+                        '--threshold',
+                        action='store',
+                        type=float,
+                        default=0.1,
+                        dest='threshold',
+                        help='Slowdown (0.1 is 10%%) reported as regression')
+    parser.add_argument('-L',
+                        '--label',
+                        action='store',
+                        dest='label',
+                        default='',
+                        help='Text saved with the results (e.g. a version)')
+    parser.add_argument('-j',
+                        '--jobs',
+                        action='store',
+                        type=int,
+                        default=1,
+                        dest='jobs',
+                        help='Parallel jobs to encode (0 for all the cores)')
+    parser.add_argument('-u',
+                        '--startup',
+                        action='store_true',
+                        dest='startup',
+                        help='Time starting zxn.py with a tiny program')
+    parser.add_argument('-b',
+                        '--budget',
+                        action='store',
+                        type=float,
+                        default=40,
+                        dest='budget',
+                        help='Startup time allowed for each command, in ms'
+                        ' (including standard modules)')
+
+    arguments = parser.parse_args()
+
+    values = {}
+
+    values['kinds'] = arguments.kinds.split(',')
+    for str_kind in values['kinds']:
+        if str_kind not in KINDS:
+            str_msg = _('Unknown kind: {0}')
+            raise ValueError(str_msg.format(str_kind))
+
+    values['stages'] = arguments.stages.split(',')
+    for str_stage in values['stages']:
+        if str_stage not in STAGES:
+            str_msg = _('Unknown stage: {0}')
+            raise ValueError(str_msg.format(str_stage))
+
+    values['sizes'] = [int(str_num) for str_num in arguments.sizes.split(',')]
+    for i_size in values['sizes']:
+        if i_size < 1 or i_size > 9999:
+            str_msg = _('Programs must have from 1 to 9999 lines')
+            raise ValueError(str_msg)
+
+    values['repeat'] = max(1, arguments.repeat)
+    values['seed'] = arguments.seed
+    values['threshold'] = arguments.threshold
+    values['label'] = arguments.label
+    values['jobs'] = arguments.jobs or None
+    values['startup'] = arguments.startup
+    values['budget'] = arguments.budget / 1000
+
+    values['output'] = None
+    if arguments.output_path:
+        values['output'] = Path(arguments.output_path)
+
+    values['compare'] = None
+    if arguments.compare_path:
+        values['compare'] = Path(arguments.compare_path)
+
+    return values
+
+
+def make_program(kind, n_lines, seed=0):
+    """
+        Returns a synthetic NextBASIC program, as a list of text lines, with
+        line numbers spread from 1 to 9999. Mixed programs use, in turn,
+        lines of all the other kinds
+    """
+
+    rnd = random.Random('{0}:{1}:{2}'.format(kind, n_lines, seed))
+    arr_numbers = sorted(rnd.sample(range(1, 10000), n_lines))
+    arr_kinds = [kind]
+    if kind == 'mixed':
+        arr_kinds = KINDS[1:]
+
+    code = ['#program bench\r\n', '#autostart\r\n']
+    for i_pos, i_number in enumerate(arr_numbers):
+        func_line = LINE_MAKERS[arr_kinds[i_pos % len(arr_kinds)]]
+        code.append('{0} {1}\r\n'.format(i_number,
+                                         func_line(rnd, arr_numbers)))
+
+    return code
+
+
+def make_data_line(rnd, arr_numbers):
+    arr_items = []
+    for _i in range(rnd.randint(8, 20)):
+        f_rnd = rnd.random()
+        if f_rnd < 0.6:
+            arr_items.append(str(rnd.randint(0, 65535)))
+        elif f_rnd < 0.8:
+            arr_items.append(str(-rnd.randint(1, 255)))
+        else:
+            arr_items.append('{0:.3f}'.format(rnd.uniform(-1000, 1000)))
+    return 'DATA ' + ','.join(arr_items)
+
+
+def make_comment_line(rnd, arr_numbers):
+    str_text = ' '.join(rnd.choice(WORDS) for _i in range(rnd.randint(3, 12)))
+    f_rnd = rnd.random()
+    if f_rnd < 0.4:
+        return 'REM ' + str_text
+    if f_rnd < 0.7:
+        return '; ' + str_text
+    return 'LET a=a+1: REM ' + str_text
+
+
+def make_string_line(rnd, arr_numbers):
+    str_text = ' '.join(rnd.choice(WORDS) for _i in range(rnd.randint(2, 10)))
+    f_rnd = rnd.random()
+    if f_rnd < 0.5:
+        return 'PRINT AT {0},{1};"{2}";a$'.format(rnd.randint(0, 23),
+                                                  rnd.randint(0, 31),
+                                                  str_text)
+    return 'LET a$="{0}"+b$: PRINT a$;"{1}"'.format(str_text,
+                                                   rnd.choice(WORDS))
+
+
+def make_dotcmd_line(rnd, arr_numbers):
+    str_name = rnd.choice(WORDS)
+    return rnd.choice([
+        '.ls', '.cd {0}', '.bmpload {0}.bmp', '.nexload {0}.nex',
+        'LAYER 2,1: .bmpload {0}.bmp', '.extract {0}.bin +0 +256',
+        'CLS : .uart -f'
+    ]).format(str_name)
+
+
+def make_goto_line(rnd, arr_numbers):
+    arr_stmts = []
+    for _i in range(rnd.randint(1, 4)):
+        i_target = rnd.choice(arr_numbers)
+        arr_stmts.append(
+            rnd.choice([
+                'GO TO {0}', 'GO SUB {0}', 'RESTORE {0}',
+                'IF a={1} THEN GO TO {0}', 'IF %a<{1} THEN GO SUB {0}'
+            ]).format(i_target, rnd.randint(0, 255)))
+    return ': '.join(arr_stmts)
+
+
+def run_benchmarks(arr_kinds,
+                   arr_sizes,
+                   arr_stages,
+                   repeat=3,
+                   seed=0,
+                   jobs=1):
+    """
+        Runs every stage for every kind and size of program. jobs is given to
+        txt2nextbasic.encode_lines() in the encode stage
+    """
+
+    dict_run = new_run(repeat, seed)
+    dict_run['jobs'] = jobs
+
+    for str_kind in arr_kinds:
+        for n_lines in arr_sizes:
+            code = make_program(str_kind, n_lines, seed)
+            n_text = len(''.join(code).encode('utf-8'))
+            bindata = txt2nextbasic.encode_lines(code)[0]
+            for str_stage in arr_stages:
+                n_bytes = n_text
+                if str_stage == 'encode':
+                    func_stage = lambda: txt2nextbasic.encode_lines(
+                        code, jobs=jobs)
+                elif str_stage == 'decode':
+                    n_bytes = len(bindata)
+                    func_stage = lambda: list(
+                        nextbasic2txt.procbin(bindata, len(bindata)))
+                elif str_stage == 'renumber':
+                    func_stage = lambda: rennextbasic.renumber(code, 10)
+                else:
+                    func_stage = lambda: round_trip(code)
+
+                seconds, result = time_stage(func_stage, repeat)
+                peak = peak_memory(func_stage)
+                seconds = max(seconds, 1e-9)
+                dict_result = {
+                    'kind': str_kind,
+                    'lines': n_lines,
+                    'stage': str_stage,
+                    'bytes': n_bytes,
+                    'seconds': seconds,
+                    'lines_per_s': n_lines / seconds,
+                    'bytes_per_s': n_bytes / seconds,
+                    'peak_kb': peak // 1024,
+                    'ok': str_stage != 'roundtrip' or result
+                }
+                dict_run['results'].append(dict_result)
+
+                str_msg = '{0:9} {1:7} {2:>5} {3:9.4f} s {4:>10.0f} lines/s' \
+                    + ' {5:>11.0f} bytes/s {6:>8} KB'
+                LOGGER.info(
+                    str_msg.format(str_stage, str_kind, n_lines, seconds,
+                                   dict_result['lines_per_s'],
+                                   dict_result['bytes_per_s'],
+                                   dict_result['peak_kb']))
+                if not dict_result['ok']:
+                    str_msg = _('Round trip changes the program: {0}, {1}')
+                    LOGGER.error(str_msg.format(str_kind, n_lines))
+
+    return dict_run
+
+
+def run_startup(repeat=3, seed=0, budget=0.04):
+    """
+        Runs zxn.py with a tiny program for each command, and compares the
+        time it takes, minus the time to run an empty Python program, with
+        budget (in seconds)
+    """
+
+    dict_run = new_run(repeat, seed)
+    dict_run['budget'] = budget
+
+    p_zxn = Path(__file__).with_name('zxn.py')
+    p_temp = Path(tempfile.mkdtemp())
+    try:
+        code = make_program('mixed', STARTUP_LINES, seed)
+        p_text = p_temp / 'tiny.txt'
+        with open(p_text, 'w') as f:
+            f.writelines(code)
+        p_bas = p_temp / 'tiny.bas'
+        txt2nextbasic.convert_file(
+            (p_text, p_bas, False, False, [], False, False))
+
+        # As a user would run them after the first time
+        compileall.compile_dir(str(p_zxn.parent), maxlevels=0, quiet=1)
+
+        seconds_empty = time_process([sys.executable, '-c', 'pass'],
+                                     repeat)[0]
+        str_msg = _('Python starts in {0:.1f} ms')
+        LOGGER.info(str_msg.format(seconds_empty * 1000))
+        seconds_std = time_process(
+            [sys.executable, '-c', 'import ' + ', '.join(STARTUP_MODULES)],
+            repeat)[0]
+        dict_run['std_seconds'] = max(seconds_std - seconds_empty, 0)
+        str_msg = _('Standard modules ({0}) load in {1:.1f} ms')
+        LOGGER.info(
+            str_msg.format(', '.join(STARTUP_MODULES),
+                           dict_run['std_seconds'] * 1000))
+
+        for str_command in STARTUP_COMMANDS:
+            arr_args = [str(p_text), str(p_temp / 'out.txt')]
+            p_input = p_text
+            if str_command == 'decode':
+                arr_args[0] = str(p_bas)
+                p_input = p_bas
+            elif str_command == 'encode':
+                arr_args[1] = str(p_temp / 'out.bas')
+            elif str_command == 'format':
+                arr_args = [str(p_temp / 'format.txt')]
+                shutil.copyfile(str(p_text), arr_args[0])
+
+            arr_cmd = [sys.executable, str(p_zxn), str_command] + arr_args
+            seconds, retval = time_process(arr_cmd, repeat)
+            seconds = max(seconds - seconds_empty, 1e-9)
+            n_bytes = os.path.getsize(p_input)
+            dict_result = {
+                'kind': 'tiny',
+                'lines': STARTUP_LINES,
+                'stage': 'startup-' + str_command,
+                'bytes': n_bytes,
+                'seconds': seconds,
+                'lines_per_s': STARTUP_LINES / seconds,
+                'bytes_per_s': n_bytes / seconds,
+                'peak_kb': None,
+                'imports': slowest_imports(arr_cmd),
+                'ok': retval == 0 and seconds <= budget
+            }
+            dict_run['results'].append(dict_result)
+
+            str_msg = '{0:16} {1:7.1f} ms (budget {2:.0f} ms) {3}'
+            LOGGER.info(
+                str_msg.format(
+                    dict_result['stage'], seconds * 1000, budget * 1000,
+                    ', '.join('{0} {1:.1f} ms'.format(str_name, i_us / 1000)
+                              for str_name, i_us in dict_result['imports'])))
+            if retval:
+                str_msg = _('zxn.py {0} failed')
+                LOGGER.error(str_msg.format(str_command))
+            elif not dict_result['ok']:
+                str_msg = _('zxn.py {0} takes too long to start')
+                LOGGER.error(str_msg.format(str_command))
+    finally:
+        shutil.rmtree(str(p_temp), ignore_errors=True)
+
+    return dict_run
+
+
+def time_process(arr_cmd, repeat=3):
+    """Best time of several runs of a command, and its last exit code"""
+
+    best = None
+    retval = 0
+    for _i in range(repeat):
+        t_start = time.perf_counter()
+        retval = subprocess.call(arr_cmd, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - t_start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, retval
+
+
+def slowest_imports(arr_cmd, count=5):
+    """
+        Modules that take longest to import (without their own imports) when
+        running a command, as [name, microseconds] lists. Needs Python 3.7
+    """
+
+    if sys.version_info < (3, 7):
+        return []
+
+    arr_cmd = arr_cmd[:1] + ['-X', 'importtime'] + arr_cmd[1:]
+    process = subprocess.run(arr_cmd,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    arr_imports = []
+    for str_line in process.stderr.splitlines():
+        arr_fields = str_line.split('|')
+        if len(arr_fields) == 3 and arr_fields[0].strip()[-1:].isdigit():
+            i_self = int(arr_fields[0].split(':')[1])
+            arr_imports.append([arr_fields[2].strip(), i_self])
+    arr_imports.sort(key=lambda arr_import: -arr_import[1])
+
+    return arr_imports[:count]
+
+
+def new_run(repeat=3, seed=0):
+    """Data saved with the results of a run"""
+
+    return {
+        'version': 1,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'tools': tool_versions(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': []
+    }
+
+
+def round_trip(code):
+    """Encodes, decodes and encodes again. True if both results match"""
+
+    bindata = txt2nextbasic.encode_lines(code)[0]
+    new_code = nextbasic2txt.procbin(bindata, len(bindata))
+    return txt2nextbasic.encode_lines(new_code)[0] == bindata
+
+
+def time_stage(func_stage, repeat=3):
+    """Best time of several runs (with gc disabled, as timeit does)"""
+
+    best = None
+    result = None
+    b_gc = gc.isenabled()
+    gc.disable()
+    try:
+        for _i in range(repeat):
+            t_start = time.perf_counter()
+            result = func_stage()
+            elapsed = time.perf_counter() - t_start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if b_gc:
+            gc.enable()
+
+    return best, result
+
+
+def peak_memory(func_stage):
+    """Peak memory allocated by a run, in bytes (timed runs don't trace)"""
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func_stage()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def tool_versions():
+    """Version and content hash of each script being measured"""
+
+    dict_tools = {}
+    for module in (txt2nextbasic, nextbasic2txt, rennextbasic, zxn_codec,
+                   zxn_program):
+        with open(module.__file__, 'rb') as f:
+            str_hash = hashlib.sha1(f.read()).hexdigest()
+        dict_tools[module.__MY_NAME__] = [module.__MY_VERSION__, str_hash]
+
+    return dict_tools
+
+
+def compare(dict_old, dict_new, threshold=0.1):
+    """
+        Logs the change of time of each result also found in dict_old.
+        Returns the number of results slower than 1 + threshold times
+    """
+
+    dict_times = {}
+    for dict_result in dict_old['results']:
+        tuple_key = (dict_result['kind'], dict_result['lines'],
+                     dict_result['stage'])
+        dict_times[tuple_key] = dict_result['seconds']
+
+    str_msg = _('Comparing with results from {0} {1}')
+    LOGGER.info(str_msg.format(dict_old['date'], dict_old.get('label', '')))
+    n_slower = 0
+    for dict_result in dict_new['results']:
+        tuple_key = (dict_result['kind'], dict_result['lines'],
+                     dict_result['stage'])
+        if tuple_key not in dict_times:
+            continue
+
+        ratio = dict_result['seconds'] / max(dict_times[tuple_key], 1e-9)
+        str_msg = '{0:9} {1:7} {2:>5} {3:9.4f} s -> {4:9.4f} s {5:+7.1%}'
+        str_msg = str_msg.format(dict_result['stage'], dict_result['kind'],
+                                 dict_result['lines'], dict_times[tuple_key],
+                                 dict_result['seconds'], ratio - 1)
+        if ratio > 1 + threshold:
+            n_slower += 1
+            LOGGER.warning(str_msg)
+        else:
+            LOGGER.info(str_msg)
+
+    if n_slower:
+        str_msg = _('{0} results are slower')
+        LOGGER.error(str_msg.format(n_slower))
+
+    return n_slower
+
+
+# Constants
+# ---------
+
+KINDS = ['mixed', 'data', 'comments', 'strings', 'dotcmd', 'goto']
+STAGES = ['encode', 'decode', 'renumber', 'roundtrip']
+STARTUP_COMMANDS = ['encode', 'decode', 'renumber', 'format']
+STARTUP_LINES = 5
+# Standard modules loaded by every command, whatever the scripts do
+STARTUP_MODULES = ['pathlib', 'logging']
+
+LINE_MAKERS = {
+    'data': make_data_line,
+    'comments': make_comment_line,
+    'strings': make_string_line,
+    'dotcmd': make_dotcmd_line,
+    'goto': make_goto_line
+}
+
+WORDS = [
+    'alpha', 'sprite', 'layer', 'score', 'level', 'player', 'enemy', 'tile',
+    'music', 'load', 'screen', 'next', 'bank', 'copper', 'palette', 'x1',
+    'y2', 'speed', 'game', 'over'
+]
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Sinclair/Next Character Codec
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Importing this module registers the "zxnext" codec, that converts text
+    to the Sinclair/Next character set and back. Block graphics, £ and ©
+    are converted to their Sinclair codes, and any other char can be
+    written as a ` escape, with its code as a decimal or hex number:
+      'PRINT "£█`x01"'.encode('zxnext') -> b'PRINT "`\x8f\x01"'
+      b'PRINT "`\x8f\x01"'.decode('zxnext') -> 'PRINT "£█`x01"'
+"""
+
+import codecs
+import re
+
+__MY_NAME__ = 'zxn_codec.py'
+__MY_VERSION__ = '1.0.0'
+
+
+# Functions
+# ---------
+
+
+def encode_chars(text):
+    """
+        Converts text to Sinclair chars, as a str with chars from 0 to 255.
+        Known UTF-8 chars are translated, and ` escapes are replaced by the
+        char with that code
+    """
+
+    if '`' not in text:
+        return text.translate(ENCODE_TABLE)
+
+    # Text, decimal code, hex code, text, decimal code, etc.
+    arr_parts = RE_ESCAPE.split(text)
+    arr_text = [arr_parts[0].translate(ENCODE_TABLE)]
+    for i_part in range(1, len(arr_parts), 3):
+        str_dec, str_hex, str_text = arr_parts[i_part:i_part + 3]
+        if str_dec:
+            arr_text.append(chr(int(str_dec)))
+        else:
+            arr_text.append(chr(int(str_hex, 16)))
+        arr_text.append(str_text.translate(ENCODE_TABLE))
+
+    return ''.join(arr_text)
+
+
+def decode_chars(text):
+    """
+        Converts Sinclair chars, as a str with chars from 0 to 255, to text,
+        using UTF-8 chars and ` escapes for non printable chars
+    """
+
+    return text.translate(DECODE_TABLE)
+
+
+def encode(text, errors='strict'):
+    """Codec encoder: text to Sinclair bytes"""
+
+    return encode_chars(text).encode('latin-1', errors), len(text)
+
+
+def decode(bindata, errors='strict'):
+    """Codec decoder: Sinclair bytes to text"""
+
+    return decode_chars(bytes(bindata).decode('latin-1', errors)), len(bindata)
+
+
+def search_codec(str_name):
+    """Codec search function, for codecs.register"""
+
+    if str_name == CODEC_NAME:
+        return CODEC_INFO
+    return None
+
+
+# Classes
+# -------
+
+
+class IncrementalDecoder(codecs.IncrementalDecoder):
+    """Codec incremental decoder. Each byte is decoded on its own"""
+    def decode(self, bindata, final=False):
+        return decode(bindata, self.errors)[0]
+
+
+# Constants
+# ---------
+
+CODEC_NAME = 'zxnext'
+
+CHARS = {
+    0x60: '£',
+    0x7f: '©',
+    0x81: '\u259D',  # Quadrant upper right
+    0x82: '\u2598',  # Quadrant upper left
+    0x83: '\u2580',  # Upper half block
+    0x84: '\u2597',  # Quadrant lower right
+    0x85: '\u2590',  # Right half block
+    0x86: '\u259A',  # Quadrant upper left and lower right
+    0x87: '\u259C',  # Quadrant upper left and upper right and lower right
+    0x88: '\u2596',  # Quadrant lower left
+    0x89: '\u259E',  # Quadrant upper right and lower left
+    0x8a: '\u258C',  # Left half block
+    0x8b: '\u259B',  # Quadrant upper left and upper right and lower left
+    0x8c: '\u2584',  # Lower half block
+    0x8d: '\u259F',  # Quadrant upper right and lower left and lower right
+    0x8e: '\u2599',  # Quadrant upper left and lower left and lower right
+    0x8f: '\u2588'  # Full block
+}
+
+# Escape: ` and integer between 0 and 255 or hex between 0 and FF
+RE_ESCAPE = re.compile(
+    '`(?:(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)|x([0-9a-fA-F]{1,2}))')
+
+# UTF-8 char to Sinclair char
+ENCODE_TABLE = str.maketrans({s_char: chr(i_char)
+                              for i_char, s_char in CHARS.items()})
+
+# Sinclair char to text (chars not found are kept)
+DECODE_TABLE = {}
+for i_char in range(256):
+    if i_char in CHARS:
+        DECODE_TABLE[i_char] = CHARS[i_char]
+    elif i_char < 0x20 or i_char > 0x7e:
+        DECODE_TABLE[i_char] = '`x{:02x}'.format(i_char)
+
+CODEC_INFO = codecs.CodecInfo(name=CODEC_NAME,
+                              encode=encode,
+                              decode=decode,
+                              incrementaldecoder=IncrementalDecoder)
+
+codecs.register(search_codec)
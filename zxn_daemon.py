@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+Resident Build Server for NextBASIC Converters
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Commands:
+      serve:    runs the server (use start to run it in background)
+      start:    starts the server in background
+      stop:     stops the server
+      status:   exit code is 0 if the server is running, 1 if not
+      build:    converts a text file to a NextBASIC file (txt2nextbasic)
+      decode:   converts a NextBASIC file to a text file (nextbasic2txt)
+      renumber: renumbers a text file, keeping a .bak copy (rennextbasic)
+      format:   formats a text file, keeping a .bak copy
+
+    The server listens on a Unix domain socket. Each connection sends one
+    request and gets one response, both as one line of JSON, e.g.:
+      {"command": "build", "input": "/a/b.bas", "output": "/a/build/b.bas"}
+      {"ok": true, "error": null, "messages": [[20, "..."]]}
+
+    When the server is not running (or on systems without Unix sockets),
+    build, decode, renumber and format are done by the client itself. If
+    there is no socket file, the converter is called directly, without
+    loading anything the client doesn't need.
+"""
+
+import sys
+import os
+import logging
+import time
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxn_daemon.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    str_command = arg_data['command']
+    if str_command in ('serve', 'start') and not has_unix_sockets():
+        LOGGER.error(_('Unix sockets are not available on this system'))
+        retval = 1
+    elif str_command == 'serve':
+        retval = serve(arg_data['socket'], arg_data['timeout'])
+    elif str_command == 'start':
+        retval = start(arg_data['socket'], arg_data['timeout'])
+    elif str_command in ('stop', 'status'):
+        dict_response = send_request(arg_data['socket'],
+                                     {'command': str_command})
+        retval = 0
+        if not dict_response:
+            LOGGER.info(_('Server is not running'))
+            retval = 1
+        elif str_command == 'status':
+            str_msg = _('Server {0} running, pid {1}')
+            LOGGER.info(
+                str_msg.format(dict_response['version'],
+                               dict_response['pid']))
+    else:
+        dict_request = arg_data['request']
+        dict_response = send_request(arg_data['socket'], dict_request)
+        if not dict_response or dict_response.get('stale'):
+            retval = run_direct(dict_request)  # In-process
+        else:
+            for i_level, str_record in dict_response['messages']:
+                LOGGER.log(i_level, str_record)
+            retval = 0
+            if not dict_response['ok']:
+                LOGGER.error(dict_response['error'])
+                retval = 1
+
+    sys.exit(retval)
+
+
+# Functions
+# ---------
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='NextBASIC Build Server')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-s',
+                        '--socket',
+                        action='store',
+                        dest='socket_path',
+                        help='Unix socket path')
+
+    server = argparse.ArgumentParser(add_help=False)
+    server.add_argument('-t',
+                        '--timeout',
+                        action='store',
+                        type=int,
+                        default=3600,
+                        dest='timeout',
+                        help='Seconds without requests before exiting')
+
+    files = argparse.ArgumentParser(add_help=False)
+    files.add_argument('-i',
+                       '--input',
+                       required=True,
+                       action='store',
+                       dest='input_path',
+                       help='Input file')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('serve',
+                        parents=[common, server],
+                        help='Run the server')
+    commands.add_parser('start',
+                        parents=[common, server],
+                        help='Start the server in background')
+    commands.add_parser('stop', parents=[common], help='Stop the server')
+    commands.add_parser('status',
+                        parents=[common],
+                        help='Exit code is 0 if the server is running')
+
+    build = commands.add_parser('build',
+                                parents=[common, files],
+                                help='Convert text to NextBASIC')
+    build.add_argument('-o',
+                       '--output',
+                       required=True,
+                       action='store',
+                       dest='output_path',
+                       help='Output NextBASIC file')
+    build.add_argument('-d',
+                       '--dont_trim',
+                       action='store_true',
+                       dest='dont_trim',
+                       help='Do not trim spaces')
+    build.add_argument('--incremental',
+                       action='store_true',
+                       dest='incremental',
+                       help='Only encode lines changed since last time')
+    build.add_argument('-m',
+                       '--minify',
+                       action='store_true',
+                       dest='minify',
+                       help='Make the program as small as possible')
+
+    decode = commands.add_parser('decode',
+                                 parents=[common, files],
+                                 help='Convert NextBASIC to text')
+    decode.add_argument('-o',
+                        '--output',
+                        required=True,
+                        action='store',
+                        dest='output_path',
+                        help='Output text file')
+    decode.add_argument('-n',
+                        '--name',
+                        action='store',
+                        dest='program_name',
+                        help='Text for #program directive')
+
+    renumber = commands.add_parser('renumber',
+                                   parents=[common, files],
+                                   help='Renumber a text file')
+    renumber.add_argument('--step',
+                          action='store',
+                          type=int,
+                          default=10,
+                          dest='step',
+                          help='Line number step size')
+    renumber.add_argument('-r',
+                          '--range',
+                          action='store',
+                          type=int,
+                          nargs=2,
+                          metavar=('FIRST', 'LAST'),
+                          dest='range',
+                          help='Renumber only lines from FIRST to LAST')
+    renumber.add_argument('--start',
+                          action='store',
+                          type=int,
+                          dest='start',
+                          help='First line number for --range')
+    renumber.add_argument('-m',
+                          '--make-room',
+                          action='store',
+                          type=int,
+                          nargs=2,
+                          metavar=('LINE', 'COUNT'),
+                          dest='room',
+                          help='Make room for COUNT new lines after LINE')
+
+    format_cmd = commands.add_parser('format',
+                                     parents=[common, files],
+                                     help='Format a text file')
+    format_cmd.add_argument('-n',
+                            '--name',
+                            action='store',
+                            dest='program_name',
+                            help='Text for #program directive')
+
+    arguments = parser.parse_args()
+
+    values = {}
+    values['command'] = arguments.command
+    values['socket'] = arguments.socket_path or default_socket()
+    values['timeout'] = getattr(arguments, 'timeout', None)
+
+    # Paths are sent as absolute paths, as the server has its own cwd
+    dict_request = {'command': arguments.command}
+    if hasattr(arguments, 'input_path'):
+        dict_request['input'] = os.path.abspath(arguments.input_path)
+    if hasattr(arguments, 'output_path'):
+        dict_request['output'] = os.path.abspath(arguments.output_path)
+    if hasattr(arguments, 'program_name'):
+        dict_request['name'] = arguments.program_name
+    if hasattr(arguments, 'dont_trim'):
+        dict_request['no_trim'] = arguments.dont_trim
+        dict_request['incremental'] = arguments.incremental
+        dict_request['minify'] = arguments.minify
+    if hasattr(arguments, 'step'):
+        dict_request['step'] = arguments.step
+        if arguments.range:
+            dict_request['range'] = arguments.range + [arguments.start]
+        dict_request['room'] = arguments.room
+    values['request'] = dict_request
+
+    return values
+
+
+def default_socket():
+    """Per user socket path"""
+
+    str_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    str_name = 'zxn_daemon.sock'
+    if hasattr(os, 'getuid'):
+        str_name = 'zxn_daemon-{0}.sock'.format(os.getuid())
+    return os.path.join(str_dir, str_name)
+
+
+def has_unix_sockets():
+    """Returns True if Unix domain sockets can be used"""
+
+    import socket
+    return hasattr(socket, 'AF_UNIX')
+
+
+def send_request(str_socket, dict_request, timeout=60):
+    """
+        Sends a request to the server and returns the response, or None if
+        the server is not running
+    """
+
+    if not os.path.exists(str_socket):
+        return None  # No server, so no need to load socket or json
+
+    import socket
+    import json
+
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str_socket)
+            sock.sendall(json.dumps(dict_request).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as f:
+                str_response = f.readline()
+    except OSError:
+        return None
+
+    if not str_response:
+        return None
+    return json.loads(str_response.decode('utf-8'))
+
+
+def run_request(dict_request):
+    """
+        Runs a build, decode, renumber or format request, and returns the
+        response, with the log messages and the error (if any)
+    """
+
+    import zxn_batch
+
+    try:
+        func, job = make_job(dict_request)
+    except ValueError as error:
+        return {'ok': False, 'error': str(error), 'messages': []}
+
+    _result, str_error, arr_records = zxn_batch.run_job((func, job))
+    return {'ok': not str_error, 'error': str_error, 'messages': arr_records}
+
+
+def run_direct(dict_request):
+    """
+        Runs a request in this process, as the converter script would do,
+        logging its messages as they come. Returns the exit code
+    """
+
+    try:
+        func, job = make_job(dict_request)
+    except ValueError as error:
+        LOGGER.error(error)
+        return 1
+
+    module = sys.modules[func.__module__]
+    module.LOGGER.addHandler(LOG_STREAM)
+    try:
+        func(job)
+    except Exception as error:
+        LOGGER.error('{0}: {1}'.format(type(error).__name__, error))
+        return 1
+    finally:
+        module.LOGGER.removeHandler(LOG_STREAM)
+
+    return 0
+
+
+def make_job(dict_request):
+    """
+        Returns the batch worker of the converter for a request, and its
+        job. Raises ValueError if the command is not known
+    """
+
+    str_command = dict_request.get('command')
+    if str_command == 'build':
+        import txt2nextbasic
+        func = txt2nextbasic.convert_file
+        job = (Path(dict_request['input']), Path(dict_request['output']),
+               False, dict_request.get('no_trim', False), [],
+               dict_request.get('incremental', False),
+               dict_request.get('minify', False))
+    elif str_command == 'decode':
+        import nextbasic2txt
+        func = nextbasic2txt.convert_file
+        job = (Path(dict_request['input']), Path(dict_request['output']),
+               dict_request.get('name'))
+    elif str_command == 'renumber':
+        import rennextbasic
+        func = rennextbasic.convert_file
+        arr_range = dict_request.get('range')
+        arr_room = dict_request.get('room')
+        job = (Path(dict_request['input']), None,
+               dict_request.get('step', 10), False,
+               tuple(arr_range) if arr_range else None,
+               tuple(arr_room) if arr_room else None)
+    elif str_command == 'format':
+        import nextbasic2txt
+        func = nextbasic2txt.format_file
+        job = (Path(dict_request['input']), dict_request.get('name'))
+    else:
+        str_msg = _('Unknown command: {0}')
+        raise ValueError(str_msg.format(str_command))
+
+    return func, job
+
+
+def serve(str_socket, timeout=3600):
+    """
+        Runs the server until it is stopped, it has been idle for timeout
+        seconds, or the converters are changed on disk
+    """
+
+    if send_request(str_socket, {'command': 'status'}):
+        str_msg = _('Server already running on {0}')
+        LOGGER.error(str_msg.format(str_socket))
+        return 1
+
+    # Load converters now, so the first request is as fast as the others
+    import zxn_batch
+    import txt2nextbasic
+    import nextbasic2txt
+    import rennextbasic
+    txt2nextbasic.load_tables()
+
+    if os.path.exists(str_socket):
+        os.remove(str_socket)  # Left by a server that didn't stop cleanly
+
+    server = make_server(str_socket, timeout)
+    str_msg = _('Listening on {0}')
+    LOGGER.info(str_msg.format(str_socket))
+    try:
+        while not server.b_stop:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(str_socket)
+
+    return 0
+
+
+def start(str_socket, timeout=3600):
+    """Starts the server in a new background process, and waits for it"""
+
+    import subprocess
+
+    if send_request(str_socket, {'command': 'status'}):
+        str_msg = _('Server already running on {0}')
+        LOGGER.info(str_msg.format(str_socket))
+        return 0
+
+    subprocess.Popen([
+        sys.executable,
+        os.path.abspath(__file__), 'serve', '-s', str_socket, '-t',
+        str(timeout)
+    ],
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+    for _i in range(50):
+        time.sleep(0.1)
+        if send_request(str_socket, {'command': 'status'}):
+            str_msg = _('Server started on {0}')
+            LOGGER.info(str_msg.format(str_socket))
+            return 0
+
+    LOGGER.error(_('Could not start server'))
+    return 1
+
+
+def modules_mtime():
+    """Modification times of the scripts used by the server"""
+
+    str_dir = os.path.dirname(os.path.abspath(__file__))
+    arr_mtimes = []
+    for str_name in SERVER_MODULES:
+        str_file = os.path.join(str_dir, str_name + '.py')
+        if os.path.exists(str_file):
+            arr_mtimes.append(os.stat(str_file).st_mtime_ns)
+        else:
+            arr_mtimes.append(None)
+    return arr_mtimes
+
+
+def make_server(str_socket, timeout=3600):
+    """
+        Returns a Unix socket server that handles requests one by one.
+        socketserver is only loaded here, as the clients don't need it
+    """
+
+    import socketserver
+    import json
+
+    class BuildServer(socketserver.UnixStreamServer):
+        def __init__(self, str_socket, timeout=3600):
+            self.b_stop = False
+            self.timeout = timeout
+            self.mtimes = modules_mtime()
+            old_umask = os.umask(0o077)  # Only for this user
+            try:
+                super(BuildServer, self).__init__(str_socket, RequestHandler)
+            finally:
+                os.umask(old_umask)
+
+        def handle_timeout(self):
+            LOGGER.info(_('Idle timeout'))
+            self.b_stop = True
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        """Reads one JSON request, and writes one JSON response"""
+        def handle(self):
+            str_request = self.rfile.readline()
+            try:
+                dict_request = json.loads(str_request.decode('utf-8'))
+                str_command = dict_request.get('command')
+            except (ValueError, AttributeError):
+                return
+
+            t_start = time.perf_counter()
+            if str_command == 'status':
+                dict_response = {
+                    'ok': True,
+                    'version': __MY_VERSION__,
+                    'pid': os.getpid()
+                }
+            elif str_command == 'stop':
+                dict_response = {'ok': True}
+                self.server.b_stop = True
+            elif modules_mtime() != self.server.mtimes:
+                # Scripts updated, so the client must do the work now
+                LOGGER.info(_('Scripts changed, stopping'))
+                dict_response = {'ok': False, 'stale': True}
+                self.server.b_stop = True
+            else:
+                dict_response = run_request(dict_request)
+
+            self.wfile.write(json.dumps(dict_response).encode('utf-8') + b'\n')
+            LOGGER.debug('{0}: {1:.1f} ms'.format(
+                str_command, (time.perf_counter() - t_start) * 1000))
+
+    return BuildServer(str_socket, timeout)
+
+
+# Constants
+# ---------
+
+# Scripts used by the server (a server started before any of them changed
+# is stopped, so the new code is used)
+SERVER_MODULES = ('zxn_daemon', 'zxn_batch', 'txt2nextbasic', 'nextbasic2txt',
+                  'rennextbasic', 'zxn_codec', 'zxn_program')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,991 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+FAT Disk Image Reader for NextBASIC Files
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Commands:
+      list:   lists the files in a FAT16 or FAT32 disk image (like
+              systemnext.img or tbblue.mmc), marking +3DOS BASIC programs
+      decode: converts every +3DOS BASIC program in the image to text, in
+              parallel, without extracting them (nextbasic2txt)
+      put:    copies files to a directory of the image, all at once,
+              skipping the ones already there with the same content
+
+    The image is mapped in memory. Only the directories, the FAT and the
+    files being read or written are accessed, so big images don't need to
+    be read fully. list and decode never change the image.
+"""
+
+import sys
+import os
+import logging
+import mmap
+import array
+import fnmatch
+import re
+import time
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxn_image.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    if arg_data['command'] == 'put':
+        arr_files = []
+        for p_source in arg_data['sources']:
+            with open(p_source, 'rb') as f:
+                arr_files.append(
+                    (arg_data['dest'].rstrip('/') + '/' + p_source.name,
+                     f.read()))
+        with FatImage(arg_data['image'], arg_data['partition'],
+                      True) as fat_image:
+            for str_path in fat_image.put_files(arr_files):
+                LOGGER.info(_('Copied: {0}').format(str_path))
+        return
+
+    with FatImage(arg_data['image'], arg_data['partition']) as fat_image:
+        arr_entries = [
+            fat_entry for fat_entry in fat_image.walk()
+            if fnmatch.fnmatch(fat_entry.path.lower(), arg_data['pattern'])
+        ]
+
+        if arg_data['command'] == 'list':
+            for fat_entry in arr_entries:
+                str_kind = 'DIR' if fat_entry.is_dir else ''
+                if not fat_entry.is_dir and fat_image.is_basic(fat_entry):
+                    str_kind = 'BASIC'
+                print('{0:<5} {1:>10} {2}'.format(str_kind, fat_entry.size,
+                                                  fat_entry.path))
+            return
+
+        arr_entries = [
+            fat_entry for fat_entry in arr_entries
+            if not fat_entry.is_dir and fat_image.is_basic(fat_entry)
+        ]
+        arr_jobs = [(arg_data['image'], fat_image.extents(fat_entry),
+                     fat_entry.size,
+                     arg_data['output'] / fat_entry.path.lstrip('/'))
+                    for fat_entry in arr_entries]
+
+    import zxn_batch
+    zxn_batch.LOGGER.addHandler(LOG_STREAM)
+
+    arr_files = [(Path('{0}:{1}'.format(arg_data['image'], fat_entry.path)),
+                  Path(fat_entry.path.lstrip('/')))
+                 for fat_entry in arr_entries]
+    arr_results, elapsed = zxn_batch.run(decode_file, arr_jobs,
+                                         arg_data['jobs'])
+    if zxn_batch.report(arr_files, arr_results, elapsed):
+        sys.exit(1)
+
+
+def decode_file(arr_job):
+    """
+        Batch worker: converts one BASIC program inside an image to text.
+        The image is mapped once for each process, and the program is read
+        from the mapping, without copying it if it is not fragmented.
+        Returns the number of lines and bytes read
+    """
+
+    import nextbasic2txt
+
+    i_path, arr_extents, i_size, o_path = arr_job
+
+    if i_path not in IMAGE_MAPS:
+        with open(i_path, 'rb') as f:
+            IMAGE_MAPS[i_path] = mmap.mmap(f.fileno(),
+                                           0,
+                                           access=mmap.ACCESS_READ)
+    bindata = read_extents(IMAGE_MAPS[i_path], arr_extents, i_size)
+
+    arr_str = nextbasic2txt.decode(bindata)
+
+    o_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(o_path, 'w') as f:
+        f.writelines(arr_str)
+
+    return len(arr_str), i_size
+
+
+def read_extents(image_map, arr_extents, i_size):
+    """
+        Returns the data of a file, given its extents (offset and length of
+        each group of consecutive clusters), as a memoryview of image_map if
+        there is only one extent, or as bytes
+    """
+
+    if len(arr_extents) == 1:
+        i_start, _i_len = arr_extents[0]
+        return memoryview(image_map)[i_start:i_start + i_size]
+
+    arr_data = []
+    for i_start, i_len in arr_extents:
+        arr_data.append(image_map[i_start:i_start + min(i_len, i_size)])
+        i_size -= i_len
+        if i_size <= 0:
+            break
+
+    return b''.join(arr_data)
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    str_hlp_image = _('Disk image file (FAT16 or FAT32)')
+    str_hlp_partition = _('Partition number, if the image has several')
+    str_hlp_pattern = _('Only files with a path matching this pattern')
+    str_hlp_output = _('Output directory')
+    str_hlp_jobs = _('Number of parallel jobs')
+    str_hlp_dest = _('Destination directory inside the image')
+    str_hlp_sources = _('Files to copy')
+
+    parser = argparse.ArgumentParser(description='NextBASIC FAT Image Reader')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('image_path', help=str_hlp_image)
+    common.add_argument('-p',
+                        '--partition',
+                        action='store',
+                        type=int,
+                        default=0,
+                        dest='partition',
+                        help=str_hlp_partition)
+    common.add_argument('-f',
+                        '--filter',
+                        action='store',
+                        default='*',
+                        dest='pattern',
+                        help=str_hlp_pattern)
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('list',
+                        parents=[common],
+                        help='List the files in the image')
+    decode = commands.add_parser('decode',
+                                 parents=[common],
+                                 help='Convert all BASIC programs to text')
+    decode.add_argument('-o',
+                        '--output',
+                        required=True,
+                        action='store',
+                        dest='output_path',
+                        help=str_hlp_output)
+    decode.add_argument('-j',
+                        '--jobs',
+                        action='store',
+                        type=int,
+                        dest='jobs',
+                        help=str_hlp_jobs)
+    put = commands.add_parser('put',
+                              parents=[common],
+                              help='Copy files to the image')
+    put.add_argument('-d',
+                     '--dest',
+                     action='store',
+                     default='/',
+                     dest='dest',
+                     help=str_hlp_dest)
+    put.add_argument('sources', nargs='+', help=str_hlp_sources)
+
+    arguments = parser.parse_args()
+
+    i_path = Path(arguments.image_path)
+    if not i_path.is_file():
+        str_msg = _('Path not found: {0}')
+        LOGGER.error(str_msg.format(i_path))
+        str_msg = _('Input path does not exist!')
+        raise IOError(str_msg)
+
+    values = {}
+    values['command'] = arguments.command
+    values['image'] = i_path.resolve()
+    values['partition'] = arguments.partition
+    values['pattern'] = arguments.pattern.lower()
+    values['output'] = None
+    values['jobs'] = None
+    if arguments.command == 'decode':
+        values['output'] = Path(arguments.output_path)
+        values['jobs'] = arguments.jobs
+    elif arguments.command == 'put':
+        values['dest'] = arguments.dest
+        values['sources'] = [Path(s_path) for s_path in arguments.sources]
+        for p_source in values['sources']:
+            if not p_source.is_file():
+                str_msg = _('Path not found: {0}')
+                LOGGER.error(str_msg.format(p_source))
+                str_msg = _('Input path does not exist!')
+                raise IOError(str_msg)
+
+    return values
+
+
+# Classes
+# -------
+
+
+class FatEntry(object):
+    """
+        File or directory found in a FAT image. offset is the position of
+        its directory entry in the image (None for the root directory)
+    """
+    def __init__(self, path, attr, cluster, size, offset=None):
+        self.path = path
+        self.attr = attr
+        self.cluster = cluster
+        self.size = size
+        self.offset = offset
+
+    @property
+    def is_dir(self):
+        return bool(self.attr & ATTR_DIRECTORY)
+
+    def __repr__(self):
+        return 'FatEntry({0!r}, {1}, {2}, {3})'.format(
+            self.path, self.attr, self.cluster, self.size)
+
+
+class FatImage(object):
+    """
+        FAT16 or FAT32 file system, inside a disk image file (with or
+        without a partition table) that is mapped in memory. It's read-only
+        unless b_write is True (see put_files)
+    """
+    def __init__(self, i_path, partition=0, b_write=False):
+        self.path = i_path
+        self.b_write = b_write
+        self.next_free = 2  # Where to start looking for free clusters
+        self.fat_table = None  # First FAT as an array, while writing
+        if b_write:
+            with open(i_path, 'r+b') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        else:
+            with open(i_path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.offset = self.find_partition(partition)
+            self.read_boot_sector()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            if self.b_write:
+                self.map.flush()
+            self.map.close()
+            self.map = None
+
+    def find_partition(self, partition=0):
+        """
+            Returns the offset of the FAT file system. If the first sector
+            is not a FAT boot sector, it's read as an MBR partition table
+        """
+
+        b_sector = self.map[:512]
+        if len(b_sector) < 512 or b_sector[510:512] != b'\x55\xaa':
+            str_msg = _('Not a valid disk image')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+
+        if is_boot_sector(b_sector):
+            return 0
+
+        arr_partitions = []
+        for i_pos in range(446, 510, 16):
+            if b_sector[i_pos + 4] in FAT_PARTITION_TYPES:
+                arr_partitions.append(
+                    int.from_bytes(b_sector[i_pos + 8:i_pos + 12], 'little'))
+        if partition >= len(arr_partitions):
+            str_msg = _('FAT partition not found: {0}')
+            LOGGER.error(str_msg.format(partition))
+            raise RuntimeError(str_msg.format(partition))
+
+        return arr_partitions[partition] * 512
+
+    def read_boot_sector(self):
+        """Reads the BIOS Parameter Block, and finds out the FAT type"""
+
+        b_sector = self.map[self.offset:self.offset + 512]
+        if not is_boot_sector(b_sector):
+            str_msg = _('Not a valid disk image')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+
+        self.sector_size = int.from_bytes(b_sector[11:13], 'little')
+        self.fsinfo_offset = None
+        self.cluster_size = b_sector[13] * self.sector_size
+        i_reserved = int.from_bytes(b_sector[14:16], 'little')
+        n_fats = b_sector[16]
+        n_root = int.from_bytes(b_sector[17:19], 'little')
+        n_sectors = int.from_bytes(b_sector[19:21], 'little')
+        if not n_sectors:
+            n_sectors = int.from_bytes(b_sector[32:36], 'little')
+        fat_sectors = int.from_bytes(b_sector[22:24], 'little')
+        if not fat_sectors:
+            fat_sectors = int.from_bytes(b_sector[36:40], 'little')
+
+        root_sectors = (n_root * 32 + self.sector_size -
+                        1) // self.sector_size
+        data_sector = i_reserved + n_fats * fat_sectors + root_sectors
+        self.n_clusters = (n_sectors - data_sector) // b_sector[13]
+
+        self.fat_offset = self.offset + i_reserved * self.sector_size
+        self.fat_size = fat_sectors * self.sector_size
+        self.n_fats = n_fats
+        self.root_offset = self.fat_offset + n_fats * self.fat_size
+        self.root_size = root_sectors * self.sector_size
+        self.data_offset = self.offset + data_sector * self.sector_size
+
+        if self.n_clusters < 4085:
+            str_msg = _('FAT12 is not supported')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+        elif self.n_clusters < 65525:
+            self.fat_type = 16
+            self.root_cluster = 0  # Fixed root directory
+            self.eoc = 0xfff8
+        else:
+            self.fat_type = 32
+            self.root_cluster = int.from_bytes(b_sector[44:48], 'little')
+            self.eoc = 0x0ffffff8
+            i_fsinfo = int.from_bytes(b_sector[48:50], 'little')
+            if 0 < i_fsinfo < i_reserved:
+                self.fsinfo_offset = self.offset + i_fsinfo * self.sector_size
+
+        LOGGER.debug('FAT{0}, {1} clusters of {2} bytes'.format(
+            self.fat_type, self.n_clusters, self.cluster_size))
+
+    def next_cluster(self, cluster):
+        """Returns the FAT entry of a cluster"""
+
+        if self.fat_type == 16:
+            i_pos = self.fat_offset + cluster * 2
+            return int.from_bytes(self.map[i_pos:i_pos + 2], 'little')
+
+        i_pos = self.fat_offset + cluster * 4
+        return int.from_bytes(self.map[i_pos:i_pos + 4],
+                              'little') & 0x0fffffff
+
+    def extents(self, fat_entry):
+        """
+            Returns a list with the offset in the image and length of each
+            group of consecutive clusters of a file or directory
+        """
+
+        if fat_entry.cluster == 0:
+            if fat_entry.is_dir:  # FAT16 root directory
+                return [(self.root_offset, self.root_size)]
+            return []
+
+        arr_extents = []
+        cluster = fat_entry.cluster
+        n_clusters = 0
+        while 2 <= cluster < self.eoc:
+            n_clusters += 1
+            if n_clusters > self.n_clusters:
+                str_msg = _('Cluster chain loop in {0}')
+                LOGGER.error(str_msg.format(fat_entry.path))
+                raise RuntimeError(str_msg.format(fat_entry.path))
+
+            i_start = self.data_offset + (cluster - 2) * self.cluster_size
+            if arr_extents and arr_extents[-1][0] + arr_extents[-1][
+                    1] == i_start:
+                arr_extents[-1][1] += self.cluster_size
+            else:
+                arr_extents.append([i_start, self.cluster_size])
+            cluster = self.next_cluster(cluster)
+
+        return [tuple(extent) for extent in arr_extents]
+
+    def read(self, fat_entry):
+        """Returns the data of a file (see read_extents)"""
+
+        return read_extents(self.map, self.extents(fat_entry),
+                            fat_entry.size)
+
+    def is_basic(self, fat_entry):
+        """Returns True if a file is a +3DOS BASIC program"""
+
+        if fat_entry.size < 128 or fat_entry.cluster < 2:
+            return False
+        i_start = self.data_offset + (fat_entry.cluster -
+                                      2) * self.cluster_size
+        b_head = self.map[i_start:i_start + 16]
+        return b_head[:8] == b'PLUS3DOS' and b_head[15] == 0
+
+    def root(self):
+        """Returns the entry of the root directory"""
+
+        return FatEntry('/', ATTR_DIRECTORY, self.root_cluster, 0)
+
+    def slots(self, dir_entry):
+        """Yields the offset of each 32 byte entry of a directory"""
+
+        for i_start, i_len in self.extents(dir_entry):
+            yield from range(i_start, i_start + i_len, 32)
+
+    def listdir(self, dir_entry):
+        """Yields the entries of a directory, with their long names"""
+
+        arr_long = []
+        for i_pos in self.slots(dir_entry):
+            b_entry = self.map[i_pos:i_pos + 32]
+            if b_entry[0] == 0x00:
+                return  # End of directory
+            if b_entry[0] == 0xe5:
+                arr_long = []
+                continue  # Deleted
+            attr = b_entry[11]
+            if attr == ATTR_LONG_NAME:
+                arr_long.append(b_entry)
+                continue
+            if attr & ATTR_VOLUME_ID:
+                arr_long = []
+                continue
+
+            str_name = long_name(arr_long, b_entry) or short_name(b_entry)
+            arr_long = []
+            if str_name in ('.', '..'):
+                continue
+
+            cluster = int.from_bytes(b_entry[26:28], 'little')
+            if self.fat_type == 32:
+                cluster |= int.from_bytes(b_entry[20:22], 'little') << 16
+            yield FatEntry(dir_entry.path.rstrip('/') + '/' + str_name, attr,
+                           cluster, int.from_bytes(b_entry[28:32], 'little'),
+                           i_pos)
+
+    def walk(self, dir_entry=None):
+        """Yields all the entries in a directory and its subdirectories"""
+
+        if dir_entry is None:
+            dir_entry = self.root()
+
+        for fat_entry in self.listdir(dir_entry):
+            yield fat_entry
+            if fat_entry.is_dir:
+                yield from self.walk(fat_entry)
+
+    def find(self, str_path):
+        """Returns the entry of a path (case insensitive), or None"""
+
+        fat_entry = self.root()
+        for str_name in str_path.strip('/').split('/'):
+            if not str_name:
+                continue
+            if not fat_entry.is_dir:
+                return None
+            for child in self.listdir(fat_entry):
+                if child.path.rsplit('/', 1)[1].lower() == str_name.lower():
+                    fat_entry = child
+                    break
+            else:
+                return None
+
+        return fat_entry
+
+    # Writing
+    # -------
+
+    def put_files(self, arr_files):
+        """
+            Copies (path in the image, data) pairs to the image, all at once:
+            the destination directories and the free space needed are
+            checked before writing anything. Files already in the image
+            with the same size and content are skipped. Returns the paths
+            of the files written
+        """
+
+        if not self.b_write:
+            str_msg = _('Image not opened for writing')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+
+        self.fat_table = None  # Read again, as the image may have changed
+        try:
+            return self.write_files(arr_files)
+        finally:
+            self.fat_table = None
+
+    def write_files(self, arr_files):
+        """Does the work of put_files()"""
+
+        # Plan: destination directory, existing entry, data
+        arr_plan = []
+        n_needed = 0
+        dict_dirs = {}
+        dict_slots = {}  # Entries needed by each new file, per directory
+        dict_files = {}  # The last copy of each file (names ignore case)
+        for str_path, bindata in arr_files:
+            dict_files[str_path.lower()] = (str_path, bindata)
+        for str_path, bindata in dict_files.values():
+            str_dir, str_name = str_path.rstrip('/').rsplit('/', 1)
+            if str_dir not in dict_dirs:
+                dict_dirs[str_dir] = self.find(str_dir)
+            dir_entry = dict_dirs[str_dir]
+            if dir_entry is None or not dir_entry.is_dir:
+                str_msg = _('Directory not found: {0}')
+                LOGGER.error(str_msg.format(str_dir or '/'))
+                raise RuntimeError(str_msg.format(str_dir or '/'))
+
+            fat_entry = self.find(str_path)
+            if fat_entry is not None:
+                if fat_entry.is_dir:
+                    str_msg = _('Not a file: {0}')
+                    LOGGER.error(str_msg.format(str_path))
+                    raise RuntimeError(str_msg.format(str_path))
+                if fat_entry.size == len(bindata) and self.read(
+                        fat_entry) == bindata:
+                    LOGGER.debug('Not changed: {0}'.format(str_path))
+                    continue
+                n_needed -= len(self.chain(fat_entry.cluster))
+            else:
+                dict_slots.setdefault(str_dir, []).append(
+                    len(self.name_entries(str_name)))
+
+            n_needed += self.clusters_for(len(bindata)) + 1  # +1: directory
+            arr_plan.append((dir_entry, str_name, fat_entry, bindata))
+
+        if not arr_plan:
+            return []
+        for str_dir, arr_slots in dict_slots.items():
+            # The root directory of FAT16 can't grow, and the entries of
+            # each name must be together
+            if dict_dirs[str_dir].cluster < 2 and not fits_in_runs([
+                    self.map[i_pos] in (0x00, 0xe5)
+                    for i_pos in self.slots(dict_dirs[str_dir])
+            ], arr_slots):
+                str_msg = _('Directory full: {0}')
+                LOGGER.error(str_msg.format(str_dir or '/'))
+                raise RuntimeError(str_msg.format(str_dir or '/'))
+        if n_needed > self.count_free():
+            str_msg = _('Not enough free space in image')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+
+        arr_written = []
+        for dir_entry, str_name, fat_entry, bindata in arr_plan:
+            self.write_file(dir_entry, str_name, fat_entry, bindata)
+            arr_written.append(dir_entry.path.rstrip('/') + '/' + str_name)
+
+        if self.fsinfo_offset is not None:
+            # Free cluster count and next free cluster are now unknown
+            i_pos = self.fsinfo_offset + 488
+            self.map[i_pos:i_pos + 8] = b'\xff' * 8
+        self.map.flush()
+
+        return arr_written
+
+    def write_file(self, dir_entry, str_name, fat_entry, bindata):
+        """
+            Writes a file, reusing the clusters of the previous version if
+            it needs the same number of them
+        """
+
+        if fat_entry is None:
+            i_pos = self.new_entry(dir_entry, str_name)
+        else:
+            i_pos = fat_entry.offset
+
+        n_clusters = self.clusters_for(len(bindata))
+        arr_chain = []
+        if fat_entry is not None and fat_entry.cluster >= 2:
+            arr_chain = self.chain(fat_entry.cluster)
+        if len(arr_chain) != n_clusters:
+            for cluster in arr_chain:
+                self.set_fat(cluster, 0)
+            arr_chain = self.allocate(n_clusters)
+
+        i_data = 0
+        for cluster in arr_chain:
+            i_start = self.data_offset + (cluster - 2) * self.cluster_size
+            b_chunk = bindata[i_data:i_data + self.cluster_size]
+            self.map[i_start:i_start + len(b_chunk)] = b_chunk
+            i_data += self.cluster_size
+
+        cluster = arr_chain[0] if arr_chain else 0
+        b_time = fat_timestamp()
+        self.map[i_pos + 11] = ATTR_ARCHIVE
+        self.map[i_pos + 14:i_pos + 18] = b_time
+        self.map[i_pos + 18:i_pos + 20] = b_time[2:]
+        self.map[i_pos + 20:i_pos + 22] = (cluster >> 16).to_bytes(2, 'little')
+        self.map[i_pos + 22:i_pos + 26] = b_time
+        self.map[i_pos + 26:i_pos + 28] = (cluster & 0xffff).to_bytes(
+            2, 'little')
+        self.map[i_pos + 28:i_pos + 32] = len(bindata).to_bytes(4, 'little')
+
+    def new_entry(self, dir_entry, str_name):
+        """
+            Adds the entries for a new name (a long name, if needed, and a
+            short one) to a directory. Returns the offset of the short one
+        """
+
+        arr_slots = []
+        set_names = set()
+        for i_pos in self.slots(dir_entry):
+            b_first = self.map[i_pos]
+            arr_slots.append((i_pos, b_first in (0x00, 0xe5)))
+            if b_first not in (0x00, 0xe5) and self.map[i_pos +
+                                                        11] != ATTR_LONG_NAME:
+                set_names.add(self.map[i_pos:i_pos + 11])
+
+        arr_entries = self.name_entries(str_name, set_names)
+
+        # First run of free entries long enough for all of them
+        arr_free = []
+        for i_pos, b_free in arr_slots:
+            if not b_free:
+                arr_free = []
+                continue
+            arr_free.append(i_pos)
+            if len(arr_free) == len(arr_entries):
+                break
+        else:
+            arr_free += self.grow_dir(dir_entry)[:len(arr_entries) -
+                                                 len(arr_free)]
+
+        for i_pos, b_entry in zip(arr_free, arr_entries):
+            self.map[i_pos:i_pos + 32] = b_entry
+
+        return arr_free[-1]
+
+    def name_entries(self, str_name, set_names=()):
+        """
+            Returns the directory entries (long name, if needed, and short
+            name not in set_names) for a new file
+        """
+
+        b_short, b_long = make_short_name(str_name, set_names)
+        arr_entries = []
+        if b_long:
+            arr_entries = long_name_entries(str_name, b_short)
+        arr_entries.append(b_short + bytes(21))
+
+        return arr_entries
+
+    def grow_dir(self, dir_entry):
+        """Adds an empty cluster to a directory. Returns its entries"""
+
+        if dir_entry.cluster < 2:
+            str_msg = _('Directory full: {0}')
+            LOGGER.error(str_msg.format(dir_entry.path))
+            raise RuntimeError(str_msg.format(dir_entry.path))
+
+        cluster = self.allocate(1)[0]
+        self.set_fat(self.chain(dir_entry.cluster)[-1], cluster)
+        i_start = self.data_offset + (cluster - 2) * self.cluster_size
+        self.map[i_start:i_start + self.cluster_size] = bytes(
+            self.cluster_size)
+
+        return list(range(i_start, i_start + self.cluster_size, 32))
+
+    def chain(self, cluster):
+        """Returns the list of clusters of a chain"""
+
+        arr_chain = []
+        while 2 <= cluster < self.eoc and len(arr_chain) <= self.n_clusters:
+            arr_chain.append(cluster)
+            cluster = self.next_cluster(cluster)
+
+        return arr_chain
+
+    def clusters_for(self, i_size):
+        """Number of clusters needed for i_size bytes"""
+
+        return (i_size + self.cluster_size - 1) // self.cluster_size
+
+    def set_fat(self, cluster, value):
+        """Changes the entry of a cluster in all the FAT copies"""
+
+        if self.fat_table is not None:
+            self.fat_table[cluster] = value
+        i_len = self.fat_type // 8
+        if self.fat_type == 32:
+            i_pos = self.fat_offset + cluster * 4
+            value |= int.from_bytes(self.map[i_pos:i_pos + 4],
+                                    'little') & 0xf0000000
+        b_value = value.to_bytes(i_len, 'little')
+        for n_fat in range(self.n_fats):
+            i_pos = self.fat_offset + n_fat * self.fat_size + cluster * i_len
+            self.map[i_pos:i_pos + i_len] = b_value
+
+    def fat_array(self):
+        """
+            Returns the first FAT as an array of integers. While writing, it
+            is only read once, and then kept up to date by set_fat()
+        """
+
+        if self.fat_table is not None:
+            return self.fat_table
+
+        fat_table = array.array('H' if self.fat_type == 16 else 'I')
+        i_end = self.fat_offset + (self.n_clusters + 2) * fat_table.itemsize
+        fat_table.frombytes(self.map[self.fat_offset:i_end])
+        if sys.byteorder != 'little':
+            fat_table.byteswap()
+        if self.fat_type == 32:
+            fat_table = array.array('I', (i & 0x0fffffff for i in fat_table))
+        if self.b_write:
+            self.fat_table = fat_table
+
+        return fat_table
+
+    def count_free(self):
+        """Number of free clusters"""
+
+        return self.fat_array()[2:].count(0)
+
+    def allocate(self, n_clusters):
+        """Finds n_clusters free clusters, and links them as a chain"""
+
+        if not n_clusters:
+            return []
+
+        fat_table = self.fat_array()
+        arr_chain = []
+        for i_first, i_last in ((self.next_free, len(fat_table)),
+                                (2, self.next_free)):
+            cluster = i_first
+            while len(arr_chain) < n_clusters:
+                try:
+                    cluster = fat_table.index(0, cluster, i_last)
+                except ValueError:
+                    break
+                arr_chain.append(cluster)
+                cluster += 1
+        if len(arr_chain) < n_clusters:
+            str_msg = _('Not enough free space in image')
+            LOGGER.error(str_msg)
+            raise RuntimeError(str_msg)
+
+        for cluster, next_cluster in zip(arr_chain, arr_chain[1:]):
+            self.set_fat(cluster, next_cluster)
+        self.set_fat(arr_chain[-1], 0xffff if self.fat_type == 16 else
+                     0x0fffffff)
+        self.next_free = arr_chain[-1] + 1
+
+        return arr_chain
+
+
+def fits_in_runs(arr_free, arr_needed):
+    """
+        Returns True if, taking the first run of free slots long enough for
+        each number in arr_needed (as new_entry() does), all of them fit
+    """
+
+    arr_free = list(arr_free)
+    for n_needed in arr_needed:
+        i_run = 0
+        for i_slot, b_free in enumerate(arr_free):
+            i_run = i_run + 1 if b_free else 0
+            if i_run == n_needed:
+                i_first = i_slot - n_needed + 1
+                arr_free[i_first:i_slot + 1] = [False] * n_needed
+                break
+        else:
+            return False
+
+    return True
+
+
+def is_boot_sector(b_sector):
+    """Returns True if b_sector looks like a FAT boot sector"""
+
+    i_size = int.from_bytes(b_sector[11:13], 'little')
+    return (b_sector[0] in (0xeb, 0xe9) and i_size in (512, 1024, 2048, 4096)
+            and b_sector[13] in (1, 2, 4, 8, 16, 32, 64, 128))
+
+
+def short_name(b_entry):
+    """Returns the 8.3 name of a directory entry"""
+
+    str_name = b_entry[:8].decode('latin-1').rstrip()
+    str_ext = b_entry[8:11].decode('latin-1').rstrip()
+    if str_name[:1] == '\x05':
+        str_name = '\xe5' + str_name[1:]
+    if str_ext:
+        str_name += '.' + str_ext
+
+    return str_name
+
+
+def make_short_name(str_name, set_names):
+    """
+        Returns an 8.3 name (as 11 bytes) not in set_names for a file name,
+        and True if a long name entry is needed too (when the name isn't
+        already a valid 8.3 name in uppercase)
+    """
+
+    str_base, str_dot, str_ext = str_name.rpartition('.')
+    if not str_dot or not str_base:
+        str_base, str_ext = str_name, ''
+
+    b_base = str_base.upper().encode('latin-1', 'replace')
+    b_ext = str_ext.upper().encode('latin-1', 'replace')
+    if (len(b_base) <= 8 and len(b_ext) <= 3
+            and not RE_SHORT_INVALID.search(str_base.upper() +
+                                            str_ext.upper())):
+        b_short = b_base.ljust(8) + b_ext.ljust(3)
+        if b_short not in set_names:
+            return b_short, str_name != str_name.upper()
+
+    str_base = RE_SHORT_INVALID.sub('_', str_base.upper().replace(' ', ''))
+    str_ext = RE_SHORT_INVALID.sub('_', str_ext.upper().replace(' ', ''))
+    b_base = str_base.encode('ascii', 'replace')[:6] or b'_'
+    b_ext = str_ext.encode('ascii', 'replace')[:3].ljust(3)
+    for i_num in range(1, 1000000):
+        b_tail = '~{0}'.format(i_num).encode('ascii')
+        b_short = (b_base[:8 - len(b_tail)] + b_tail).ljust(8) + b_ext
+        if b_short not in set_names:
+            return b_short, True
+
+    str_msg = _('Directory full')
+    LOGGER.error(str_msg)
+    raise RuntimeError(str_msg)
+
+
+def long_name_entries(str_name, b_short):
+    """Returns the long name entries for a name, in the order they go"""
+
+    i_sum = 0
+    for i_char in b_short:
+        i_sum = (((i_sum & 1) << 7) + (i_sum >> 1) + i_char) & 0xff
+
+    b_name = str_name.encode('utf-16-le')
+    if len(b_name) % 26:
+        b_name += b'\x00\x00'
+        b_name += b'\xff' * (-len(b_name) % 26)
+
+    arr_entries = []
+    for i_entry in range(len(b_name) // 26):
+        b_part = b_name[i_entry * 26:i_entry * 26 + 26]
+        i_order = i_entry + 1
+        if i_entry == len(b_name) // 26 - 1:
+            i_order |= 0x40  # Last one
+        arr_entries.append(
+            bytes([i_order]) + b_part[:10] +
+            bytes([ATTR_LONG_NAME, 0, i_sum]) + b_part[10:22] + b'\x00\x00' +
+            b_part[22:])
+
+    return arr_entries[::-1]
+
+
+def fat_timestamp():
+    """Returns the current time and date in FAT format (4 bytes)"""
+
+    t_now = time.localtime()
+    i_time = (t_now.tm_hour << 11) | (t_now.tm_min << 5) | (t_now.tm_sec //
+                                                             2)
+    i_date = (max(t_now.tm_year - 1980, 0) << 9) | (
+        t_now.tm_mon << 5) | t_now.tm_mday
+
+    return i_time.to_bytes(2, 'little') + i_date.to_bytes(2, 'little')
+
+
+def long_name(arr_long, b_entry):
+    """
+        Returns the long name stored in the entries before a directory
+        entry, or None if there isn't one or its checksum is wrong
+    """
+
+    if not arr_long:
+        return None
+
+    i_sum = 0
+    for i_char in b_entry[:11]:
+        i_sum = (((i_sum & 1) << 7) + (i_sum >> 1) + i_char) & 0xff
+
+    arr_chars = []
+    for b_long in reversed(arr_long):
+        if b_long[13] != i_sum:
+            return None
+        arr_chars.append(b_long[1:11] + b_long[14:26] + b_long[28:32])
+
+    str_name = b''.join(arr_chars).decode('utf-16-le', 'replace')
+    return str_name.split('\x00', 1)[0]
+
+
+# Constants
+# ---------
+
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0f
+
+# Chars not valid in 8.3 names
+RE_SHORT_INVALID = re.compile("[^A-Z0-9$%'_@~`!(){}^#&\x80-\xff-]")
+
+# Partition types: FAT16 (<32M), FAT16, FAT32 (CHS), FAT32 (LBA), FAT16 (LBA)
+FAT_PARTITION_TYPES = (0x04, 0x06, 0x0b, 0x0c, 0x0e)
+
+IMAGE_MAPS = {}  # Images mapped by decode_file, in each process
+
+if __name__ == '__main__':
+    main()
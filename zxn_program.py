@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+NextBASIC Program Model
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    A tokenized NextBASIC program kept in three compact arrays, instead of
+    several Python objects for each line: the line numbers (array('H')),
+    where each line starts (array('I')) and one bytearray with the data of
+    all the lines (as in a +3DOS file, ending with 0Dh, but without the
+    line number and length). Lines are found by number with a binary
+    search, and their text is only decoded when asked for:
+      program = Program.from_bytes(bindata)
+      program.get(20) -> b'\xf5"HELLO"\r'
+      program.text(20) -> '  20 PRINT "HELLO"\r\n'
+      program.slice(100, 199).to_bytes()
+"""
+
+import bisect
+from array import array
+
+__MY_NAME__ = 'zxn_program.py'
+__MY_VERSION__ = '1.0.0'
+
+
+# Classes
+# -------
+class Program(object):
+    """
+        NextBASIC program. Line numbers can't go down (there can be
+        duplicated numbers, as in some files made by other tools)
+    """
+    def __init__(self, autostart=0x8000):
+        self.numbers = array('H')
+        self.offsets = array('I', [0])  # Start of each line, and the end
+        self.data = bytearray()
+        self.autostart = autostart  # Line, or 8000h (32768) if none
+        self.variables = b''  # Data saved after the program, if any
+
+    @classmethod
+    def from_bytes(cls, bindata):
+        """
+            Reads a +3DOS BASIC file, or tokenized BASIC data without a
+            header. As when decoding, the program ends at the first line
+            number that goes down or is too big, at a line cut short, or
+            at the end of the program data. Anything after the file length
+            in the header (e.g. padding of the disk image) is left out
+        """
+
+        program = cls()
+        i_pos = 0
+        i_file = i_end = len(bindata)
+        if i_end > 128 and bindata[:8] == b'PLUS3DOS':
+            program.autostart = int.from_bytes(bindata[18:20], 'little')
+            i_pos = 128
+            # File length (with the header), so padding is left out
+            i_file = min(int.from_bytes(bindata[11:15], 'little'), i_file)
+            i_end = min(128 + int.from_bytes(bindata[20:22], 'little'),
+                        i_file)
+
+        prev_line = -1
+        view = memoryview(bindata)
+        while i_pos + 4 <= i_end:
+            line_number = int.from_bytes(bindata[i_pos:i_pos + 2], 'big')
+            l_length = int.from_bytes(bindata[i_pos + 2:i_pos + 4], 'little')
+            if line_number < prev_line or line_number > MAX_LINE:
+                break
+            if i_pos + 4 + l_length > i_end:
+                break  # Line cut short
+            prev_line = line_number
+            program.numbers.append(line_number)
+            program.data += view[i_pos + 4:i_pos + 4 + l_length]
+            program.offsets.append(len(program.data))
+            i_pos += 4 + l_length
+
+        program.variables = bytes(view[min(i_pos, i_file):i_file])
+        view.release()
+
+        return program
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, line_number):
+        return self.index(line_number) is not None
+
+    def __iter__(self):
+        """Yields number and data (as a memoryview) of each line"""
+
+        view = memoryview(self.data)
+        for i_line, line_number in enumerate(self.numbers):
+            i_start = self.offsets[i_line]
+            yield line_number, view[i_start:self.offsets[i_line + 1]]
+
+    def nbytes(self):
+        """Memory used by the arrays, in bytes"""
+
+        n_bytes = len(self.data) + len(self.variables)
+        n_bytes += self.numbers.itemsize * len(self.numbers)
+        n_bytes += self.offsets.itemsize * len(self.offsets)
+
+        return n_bytes
+
+    def index(self, line_number):
+        """Position of the (first) line with a number, or None"""
+
+        i_line = bisect.bisect_left(self.numbers, line_number)
+        if i_line < len(self.numbers) and self.numbers[i_line] == line_number:
+            return i_line
+
+        return None
+
+    def index_range(self, first=0, last=None):
+        """
+            Positions of the first line, and after the last line, of a range
+            of line numbers (to the end if last is None)
+        """
+
+        if last is None:
+            last = MAX_LINE
+
+        return (bisect.bisect_left(self.numbers, first),
+                bisect.bisect_right(self.numbers, last))
+
+    def line(self, i_line):
+        """Data of the line at a position, as bytes"""
+
+        return bytes(self.data[self.offsets[i_line]:self.offsets[i_line + 1]])
+
+    def get(self, line_number, default=None):
+        """Data of a line, as bytes, or default if not found"""
+
+        i_line = self.index(line_number)
+        if i_line is None:
+            return default
+
+        return self.line(i_line)
+
+    def text(self, line_number):
+        """Text of a line (see nextbasic2txt.decode_line), or None"""
+
+        import nextbasic2txt
+
+        b_line = self.get(line_number)
+        if b_line is None:
+            return None
+
+        return nextbasic2txt.decode_line(line_number, b_line)
+
+    def texts(self, first=0, last=None):
+        """Yields the text of each line in a range, decoding it then"""
+
+        import nextbasic2txt
+
+        i_start, i_stop = self.index_range(first, last)
+        for i_line in range(i_start, i_stop):
+            yield nextbasic2txt.decode_line(self.numbers[i_line],
+                                            self.line(i_line))
+
+    def append(self, line_number, b_line):
+        """Adds a line at the end. Raises ValueError if out of order"""
+
+        if line_number > MAX_LINE or (self.numbers
+                                      and line_number < self.numbers[-1]):
+            raise ValueError('Wrong line number: {0}'.format(line_number))
+
+        self.numbers.append(line_number)
+        self.data += b_line
+        self.offsets.append(len(self.data))
+
+    def slice(self, first=0, last=None):
+        """New Program with a copy of the lines in a range"""
+
+        i_start, i_stop = self.index_range(first, last)
+        i_begin = self.offsets[i_start]
+
+        program = Program(self.autostart)
+        program.numbers = self.numbers[i_start:i_stop]
+        program.offsets = array('I', [
+            i_pos - i_begin for i_pos in self.offsets[i_start:i_stop + 1]
+        ])
+        program.data = self.data[i_begin:self.offsets[i_stop]]
+
+        return program
+
+    def replace(self, line_number, b_line):
+        """
+            Changes the data of a line, or adds the line if it doesn't exist
+        """
+
+        i_line = self.index(line_number)
+        if i_line is None:
+            self.insert(line_number, b_line)
+            return
+
+        i_start = self.offsets[i_line]
+        i_stop = self.offsets[i_line + 1]
+        self.data[i_start:i_stop] = b_line
+        self.move_offsets(i_line + 1, len(b_line) - (i_stop - i_start))
+
+    def insert(self, line_number, b_line):
+        """Adds a line, after any other one with the same number"""
+
+        if line_number > MAX_LINE:
+            raise ValueError('Wrong line number: {0}'.format(line_number))
+
+        i_line = bisect.bisect_right(self.numbers, line_number)
+        i_start = self.offsets[i_line]
+        self.numbers.insert(i_line, line_number)
+        self.data[i_start:i_start] = b_line
+        self.offsets.insert(i_line + 1, i_start)
+        self.move_offsets(i_line + 1, len(b_line))
+
+    def delete(self, first, last=None):
+        """Removes a line, or all the lines in a range"""
+
+        if last is None:
+            last = first
+        i_start, i_stop = self.index_range(first, last)
+        if i_start == i_stop:
+            return
+
+        i_begin = self.offsets[i_start]
+        i_end = self.offsets[i_stop]
+        del self.numbers[i_start:i_stop]
+        del self.data[i_begin:i_end]
+        del self.offsets[i_start + 1:i_stop + 1]
+        self.move_offsets(i_start + 1, i_begin - i_end)
+
+    def move_offsets(self, i_line, i_delta):
+        """Moves the start of the lines from a position on"""
+
+        if i_delta:
+            self.offsets[i_line:] = array(
+                'I', [i_pos + i_delta for i_pos in self.offsets[i_line:]])
+
+    def iter_chunks(self):
+        """
+            Yields the tokenized program, line by line (number and length,
+            and then the data as a memoryview), and then the variables
+        """
+
+        view = memoryview(self.data)
+        for i_line, line_number in enumerate(self.numbers):
+            i_start = self.offsets[i_line]
+            i_stop = self.offsets[i_line + 1]
+            l_length = i_stop - i_start
+            yield line_number.to_bytes(2, 'big') + l_length.to_bytes(
+                2, 'little')
+            yield view[i_start:i_stop]
+        if self.variables:
+            yield self.variables
+
+    def to_bytes(self):
+        """Tokenized program (and variables), without +3DOS header"""
+
+        return b''.join(self.iter_chunks())
+
+
+# Constants
+# ---------
+
+MAX_LINE = 9999
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# -*- mode: Python; tab-width: 4; indent-tabs-mode: nil; -*-
+# Do not change the previous lines. See PEP 8, PEP 263.
+"""
+ZEsarUX Remote Control for zxb_build scripts
+
+    Copyright (c) 2020-2022 @Kounch
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Commands:
+      reload: tells a ZEsarUX that is already running to load again its
+              MMC image (where zxb_build has just copied the new files)
+              and to reset the machine, so the program runs again
+      serve:  fake ZEsarUX, that only prints the commands received, to
+              try reload (and the build scripts) without an emulator
+
+    ZEsarUX must be listening with its remote control protocol (ZRCP)
+    enabled (--enable-remoteprotocol, port 10000 by default). The exit
+    code of reload is 2 if ZEsarUX is not running, so the scripts can
+    start it instead.
+"""
+
+import sys
+import os
+import logging
+import socket
+import socketserver
+import time
+
+if sys.version_info > (3, 5):
+    from pathlib import Path
+else:
+    from pathlib2 import Path
+
+__MY_NAME__ = 'zxn_remote.py'
+__MY_VERSION__ = '1.0.0'
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOG_FORMAT = logging.Formatter(
+    '%(asctime)s [%(levelname)-5.5s] - %(name)s: %(message)s')
+LOG_STREAM = logging.StreamHandler(sys.stdout)
+LOG_STREAM.setFormatter(LOG_FORMAT)
+LOGGER.addHandler(logging.NullHandler())  # Silent when used as a module
+
+path_locale = os.path.dirname(__file__)
+path_locale = os.path.join(path_locale, 'locale')
+TRANSLATION = None  # Loaded by _() when first needed
+
+
+def _(message):
+    """gettext, loading the translation the first time it is used"""
+
+    global TRANSLATION
+    if TRANSLATION is None:
+        import gettext
+        TRANSLATION = gettext.translation(__MY_NAME__,
+                                          localedir=path_locale,
+                                          fallback=True)
+    return TRANSLATION.gettext(message)
+
+
+def main():
+    """Main Routine"""
+
+    LOGGER.addHandler(LOG_STREAM)
+
+    arg_data = parse_args()
+
+    if arg_data['command'] == 'serve':
+        retval = serve(arg_data['host'], arg_data['port'], arg_data['log'])
+    else:
+        retval = reload(arg_data['host'], arg_data['port'],
+                        arg_data['commands'], arg_data['source'],
+                        arg_data['timeout'])
+
+    sys.exit(retval)
+
+
+# Functions
+# ---------
+
+
+def parse_args():
+    """Command Line Parser"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ZEsarUX Remote Control')
+    parser.add_argument('-v',
+                        '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__MY_VERSION__))
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-H',
+                        '--host',
+                        action='store',
+                        default='localhost',
+                        dest='host',
+                        help='ZEsarUX host')
+    common.add_argument('-p',
+                        '--port',
+                        action='store',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        dest='port',
+                        help='ZEsarUX remote control port')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    reload_parser = commands.add_parser(
+        'reload',
+        parents=[common],
+        help='Reload the MMC image and run the program again')
+    reload_parser.add_argument('-s',
+                               '--source',
+                               action='store',
+                               dest='source_path',
+                               help='Source file, to report the time' +
+                               ' since it was saved')
+    reload_parser.add_argument('-c',
+                               '--command',
+                               action='append',
+                               dest='commands',
+                               help='ZRCP command to send, instead of' +
+                               ' the default ones')
+    reload_parser.add_argument('-t',
+                               '--timeout',
+                               action='store',
+                               type=float,
+                               default=10,
+                               dest='timeout',
+                               help='Seconds to wait for each answer')
+    serve_parser = commands.add_parser(
+        'serve',
+        parents=[common],
+        help='Fake ZEsarUX that prints the commands received')
+    serve_parser.add_argument('-l',
+                              '--log',
+                              action='store',
+                              dest='log_path',
+                              help='Append the commands received to a file')
+
+    arguments = parser.parse_args()
+
+    values = {}
+    values['command'] = arguments.command
+    values['host'] = arguments.host
+    values['port'] = arguments.port
+    if arguments.command == 'serve':
+        values['log'] = None
+        if arguments.log_path:
+            values['log'] = Path(arguments.log_path)
+    else:
+        values['commands'] = arguments.commands or RELOAD_COMMANDS
+        values['timeout'] = arguments.timeout
+        values['source'] = None
+        if arguments.source_path:
+            values['source'] = Path(arguments.source_path)
+
+    return values
+
+
+def reload(host='localhost',
+           port=None,
+           arr_commands=None,
+           p_source=None,
+           timeout=10):
+    """
+        Sends the reload commands to a running ZEsarUX, and reports how long
+        it took, and the time since p_source was saved. Returns 0, 1 if a
+        command failed, or 2 if ZEsarUX is not running
+    """
+
+    t_start = time.time()
+    try:
+        client = ZrcpClient(host, port or DEFAULT_PORT, timeout)
+    except OSError as error:
+        str_msg = _('ZEsarUX is not running ({0})')
+        LOGGER.info(str_msg.format(error))
+        return 2
+
+    with client:
+        for str_command in arr_commands or RELOAD_COMMANDS:
+            t_command = time.time()
+            try:
+                str_answer = client.command(str_command)
+            except (OSError, RuntimeError) as error:
+                str_msg = _('ZEsarUX command failed: {0} ({1})')
+                LOGGER.error(str_msg.format(str_command, error))
+                return 1
+            LOGGER.debug('{0}: {1:.1f} ms {2}'.format(
+                str_command, (time.time() - t_command) * 1000, str_answer))
+
+    t_end = time.time()
+    elapsed = int((t_end - t_start) * 1000)
+    if p_source and p_source.exists():
+        latency = int((t_end - os.stat(str(p_source)).st_mtime) * 1000)
+        str_msg = _('Reloaded in {0} ms, {1} ms after saving {2}')
+        LOGGER.info(str_msg.format(elapsed, latency, p_source.name))
+    else:
+        str_msg = _('Reloaded in {0} ms')
+        LOGGER.info(str_msg.format(elapsed))
+
+    return 0
+
+
+def serve(host='localhost', port=None, p_log=None):
+    """Runs a fake ZEsarUX remote control server until interrupted"""
+
+    server = FakeServer((host, port or DEFAULT_PORT), p_log)
+    str_msg = _('Listening on {0}:{1}')
+    LOGGER.info(str_msg.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+# Classes
+# -------
+
+
+class ZrcpClient(object):
+    """Connection to the remote control protocol (ZRCP) of ZEsarUX"""
+    def __init__(self, host='localhost', port=None, timeout=10):
+        self.sock = socket.create_connection((host, port or DEFAULT_PORT),
+                                             timeout)
+        self.buffer = b''
+        try:
+            self.read_answer()  # Welcome message
+        except Exception:
+            self.sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.sendall(b'quit\n')
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def read_answer(self):
+        """Reads until the next prompt. Returns the text before it"""
+
+        while PROMPT not in self.buffer:
+            b_data = self.sock.recv(4096)
+            if not b_data:
+                raise OSError(_('Connection closed'))
+            self.buffer += b_data
+
+        b_answer, self.buffer = self.buffer.split(PROMPT, 1)
+        return b_answer.decode('latin-1').strip()
+
+    def command(self, str_command):
+        """Sends a command and returns its answer"""
+
+        self.sock.sendall(str_command.encode('latin-1') + b'\n')
+        str_answer = self.read_answer()
+        if str_answer.startswith('Error'):
+            raise RuntimeError(str_answer)
+
+        return str_answer
+
+
+class FakeServer(socketserver.ThreadingTCPServer):
+    """
+        Answers like ZEsarUX to any command, and prints (or appends to a
+        file) the commands received
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, p_log=None):
+        self.p_log = p_log
+        super(FakeServer, self).__init__(server_address, FakeHandler)
+
+    def record(self, str_command):
+        LOGGER.info(_('Command: {0}').format(str_command))
+        if self.p_log:
+            with open(self.p_log, 'a') as f:
+                f.write('{0:.3f} {1}\n'.format(time.time(), str_command))
+
+
+class FakeHandler(socketserver.StreamRequestHandler):
+    """One fake ZRCP session"""
+    def handle(self):
+        self.wfile.write(WELCOME + PROMPT)
+        for b_line in self.rfile:
+            str_command = b_line.decode('latin-1').strip()
+            if not str_command:
+                self.wfile.write(PROMPT)
+                continue
+            self.server.record(str_command)
+            if str_command in ('quit', 'exit'):
+                return
+            self.wfile.write(PROMPT)
+
+
+# Constants
+# ---------
+
+DEFAULT_PORT = 10000
+PROMPT = b'command> '
+WELCOME = b'Welcome to ZEsarUX remote command protocol (ZRCP)\n' + \
+    b'Write help for available commands\n\n'
+
+# Load again the MMC image file, and restart the machine, so NextZXOS
+# runs autoexec.bas, which loads /devel/test.bas
+RELOAD_COMMANDS = ['close-all-menus', 'mmc-reload', 'hard-reset-cpu']
+
+if __name__ == '__main__':
+    main()
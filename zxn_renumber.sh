@@ -62,7 +62,7 @@ fi
 shopt -s nocasematch
 if [[ $action == "renumber" ]]; then
     echo $(eval_gettext "Renumbering \$filename")
-    "$python3bin" "$mypath/rennextbasic.py" -i "$fullfile"
+    "$python3bin" "$mypath/zxn_daemon.py" renumber -i "$fullfile"
     retval=$?
     if [ $retval != 0 ]; then
         echo $(gettext "Error while renumbering")
@@ -74,20 +74,12 @@ shopt -u nocasematch
 shopt -s nocasematch
 if [[ $action == "format" ]]; then
     echo $(eval_gettext "Formatting \$filename")
-    cp "$fullfile" "$filedir/$filename.bas.bak"
-    "$python3bin" "$mypath/txt2nextbasic.py" -i "$fullfile" -o "$filedir/$filename.tmp.bas"
-    retval=$?
-    if [ $retval != 0 ]; then
-        echo $(gettext "Error while Analyzing")
-        exit $retVal
-    fi
-    "$python3bin" "$mypath/nextbasic2txt.py" -i "$filedir/$filename.tmp.bas" -o "$fullfile" -n "$filename"
+    "$python3bin" "$mypath/zxn_daemon.py" format -i "$fullfile" -n "$filename"
     retval=$?
     if [ $retval != 0 ]; then
         echo $(gettext "Error while Formatting")
         exit $retVal
     fi
-    rm "$filedir/$filename.tmp.bas" 
 fi
 shopt -u nocasematch
 